@@ -15,7 +15,7 @@ from players import PlayerCollection
 
 # twisted imports
 from twisted.words.protocols import irc
-from twisted.internet import reactor, protocol
+from twisted.internet import reactor, protocol, task
 from twisted.python import log
 
 
@@ -24,9 +24,9 @@ class ImpostorBot(irc.IRCClient):
   nickname = config.BOT_NICK
 
 
-  def __init__(self, source_dir, log_filename, channel):
+  def __init__(self, processor, log_filename, channel):
     self.channel = channel
-    self.processor = RequestProcessor(source_dir, generator.Generator(), PlayerCollection())
+    self.processor = processor
     logging.basicConfig(filename=log_filename, level=logging.INFO)
 
 
@@ -102,9 +102,22 @@ class ImpostorBotFactory(protocol.ClientFactory):
     self.log_filename = log_filename
     self.source_dir = source_dir
 
+    composite_nick = None
+    if config.ALL_USED:
+      composite_nick = config.ALL_NICK
+
+    # Build the generator once, so that reconnecting does not reload all source material
+    self.processor = RequestProcessor(source_dir, generator.Generator(composite_nick=composite_nick), PlayerCollection())
+
+    # Top up any pools of quotes generated ahead of time, between requests
+    self.pool_refill = None
+    if self.processor.generator.quote_pool is not None:
+      self.pool_refill = task.LoopingCall(self.processor.generator.refillPools, config.QUOTE_POOL_REFILL_COUNT)
+      self.pool_refill.start(config.QUOTE_POOL_REFILL_INTERVAL, now=False)
+
 
   def buildProtocol(self, addr):
-    p = ImpostorBot(self.source_dir, self.log_filename, self.channel)
+    p = ImpostorBot(self.processor, self.log_filename, self.channel)
     return p
 
 
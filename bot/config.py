@@ -24,12 +24,16 @@ ALL_USED = False # Indicates whether there is a nick that will be a composite of
 ALL_NICK = 'all' # Word that denotes nick is composite of all in channel (if used)
 
 INPUT_NICKS_SEP = ':' # Character(s) used to split input nicks
-INPUT_NICKS_MAX = 2 # Maximum number of nicks a user can merge
+INPUT_NICKS_MAX = 5 # Maximum number of nicks a user can merge
+INPUT_ORDER_SEP = '/' # Character(s) used to separate input nicks from the number of words to choose each word by
 
 OUTPUT_NICKS_OPEN = '[' # Character(s) before a nick(s)
 OUTPUT_NICKS_SEP = ':' # Character(s) between output nicks
 OUTPUT_NICKS_CLOSE = '] ' # Character(s) after nick(s)
 
+QUOTE_POOL_REFILL_INTERVAL = 2.0 # Seconds between top-ups of the quotes generated ahead of time, if any are kept
+QUOTE_POOL_REFILL_COUNT = 10 # Number of quotes generated ahead of time at most in each top-up
+
 STATS_FILE_NAME = "players.p" # File to save player stats to
 CHANGES_BETWEEN_STATS_PERSISTENCE = 5 # Number of changes seen between stats writes to disk
 
@@ -54,6 +54,7 @@ class RequestProcessor():
   NICK_1_STR = "<nick1>"
   NICK_2_STR = "<nick2>"
   SEED_STR = " [seed-words]"
+  ORDER_STR = "<n>"
 
   BOLD_DEFAULT = Style.BOLD + "%s" + Style.CLEAR
 
@@ -67,6 +68,7 @@ class RequestProcessor():
   GENERATE_MERGED = GENERATE_TRIGGER + NICK_1_STR + config.INPUT_NICKS_SEP + NICK_2_STR + Style.CLEAR
   GENERATE_ALL = GENERATE_TRIGGER + config.ALL_NICK + Style.CLEAR
   GENERATE_SEEDED = GENERATE_TRIGGER + NICK_STR + SEED_STR + Style.CLEAR
+  GENERATE_ORDER = GENERATE_TRIGGER + NICK_STR + config.INPUT_ORDER_SEP + ORDER_STR + Style.CLEAR
 
   META_STATS = STATS_TRIGGER + config.META_STATS + Style.CLEAR
   META_STATS_USER = STATS_TRIGGER + config.META_STATS + " " + NICK_STR + Style.CLEAR
@@ -93,8 +95,10 @@ class RequestProcessor():
   HELP_GENERATOR = "Type " \
     + GENERATE_SINGLE + " to see a line generated for a single user, " \
     + GENERATE_RANDOM + " for a line generated for a random user, or " \
-    + GENERATE_MERGED + " to see a line generated from two users merged. " \
-    + "Optionally, the quote may be seeded, using " + GENERATE_SEEDED + ". "
+    + GENERATE_MERGED + " to see a line generated from users merged (up to " + str(config.INPUT_NICKS_MAX) + " of them). " \
+    + "Optionally, the quote may be seeded, using " + GENERATE_SEEDED + ". " \
+    + "For a looser quote, use " + GENERATE_ORDER + " to have each word chosen by only the " + ORDER_STR \
+    + " words before it. "
 
   HELP_MYSTERY = "Type " \
     + MYSTERY_START + " to generate a line from a mystery author. Then type " \
@@ -180,6 +184,9 @@ class RequestProcessor():
       GenericStatisticType.SOURCE_CHANNELS: StatisticFormat(RequestProcessor.formatGenericChannels, "Its primary source channel was %s, and additional material was drawn from %s. "),
       GenericStatisticType.BIGGEST_USERS: StatisticFormat(RequestProcessor.formatGenericBiggestUsers, "The %d users with the most source material are: %s. "),
       GenericStatisticType.MOST_QUOTED_USERS: StatisticFormat(RequestProcessor.formatGenericMostQuotedUsers, "Since I started keeping records, the user prompted for quotes most often is: %s. "),
+      GenericStatisticType.MODEL_CACHE: StatisticFormat(RequestProcessor.formatGenericModelCache, "I have the models of %d user(s) loaded, taking %d of a budget of %d bytes; there have been %d cache hit(s), %d miss(es) and %d eviction(s). "),
+      GenericStatisticType.MERGED_CACHE: StatisticFormat(RequestProcessor.formatGenericModelCache, "I have %d merged model(s) cached, taking %d of a budget of %d bytes; there have been %d merge cache hit(s), %d miss(es) and %d eviction(s). "),
+      GenericStatisticType.QUOTE_POOL: StatisticFormat(RequestProcessor.formatGenericQuotePool, "I have %d quote(s) ready in %d pool(s) of up to %d each, having generated %d ahead of time; %d request(s) were answered from them and %d missed, a hit ratio of %d%%. "),
     }
 
     self.user_statistic_formatters = {
@@ -396,7 +403,16 @@ class RequestProcessor():
   def triggerGenerateQuote(self, user, input_message):
 
       raw_tokens = re.split(' *', input_message)
-      raw_nicks = re.split(config.INPUT_NICKS_SEP, raw_tokens[0][len(config.GENERATE_TRIGGER):])[:config.INPUT_NICKS_MAX]
+      raw_request = raw_tokens[0][len(config.GENERATE_TRIGGER):]
+
+      # The number of preceding words to choose each word by may follow the nicks
+      order = None
+      (raw_request_nicks, order_sep, raw_order) = raw_request.rpartition(config.INPUT_ORDER_SEP)
+      if order_sep and raw_order.isdigit():
+        raw_request = raw_request_nicks
+        order = int(raw_order)
+
+      raw_nicks = re.split(config.INPUT_NICKS_SEP, raw_request)[:config.INPUT_NICKS_MAX]
 
       if config.ALL_USED and config.ALL_NICK in raw_nicks:
         raw_nicks = [config.ALL_NICK] # All subsumes all
@@ -408,7 +424,7 @@ class RequestProcessor():
 
       seed_words = tuple(raw_tokens[1:])
 
-      output_nicks, output_quote = self.generator.generate(nick_tuples, seed_words)
+      output_nicks, output_quote = self.generator.generate(nick_tuples, seed_words, order=order)
 
       output_message = ""
 
@@ -580,6 +596,23 @@ class RequestProcessor():
     return most_quoted
 
 
+  @staticmethod
+  def formatGenericModelCache(model_cache_raw):
+    return tuple(model_cache_raw)
+
+
+  @staticmethod
+  def formatGenericQuotePool(quote_pool_raw):
+
+    requests = quote_pool_raw.hits + quote_pool_raw.misses
+    hit_ratio = 0
+    if requests:
+      hit_ratio = (100 * quote_pool_raw.hits) / requests
+
+    return (quote_pool_raw.quote_count, quote_pool_raw.pool_count, quote_pool_raw.depth, quote_pool_raw.refills, \
+      quote_pool_raw.hits, quote_pool_raw.misses, hit_ratio)
+
+
   @staticmethod
   def formatStatsDisplayBold(nick):
     return RequestProcessor.BOLD_DEFAULT % nick
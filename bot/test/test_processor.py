@@ -13,6 +13,8 @@ from generator import generator
 from generator.generator import Generator
 from generator.generator import GenericStatisticType
 from generator.generator import SourceChannelNames
+from generator.modelcache import ModelCacheStatistics
+from generator.quotepool import QuotePoolStatistics
 from generator.users import NickAndCount
 from generator.users import UserCollection
 from generator.users import UserStatisticType
@@ -89,12 +91,14 @@ class TestProcessor(unittest.TestCase):
     return None
 
 
-  def generate_side_effect(self, *args):
+  def generate_side_effect(self, *args, **kwargs):
 
     nick_tuples = args[0]
     seed_words = args[1]
 
     if nick_tuples == [(0, "lemon")]:
+      if kwargs.get("order") == 1:
+        return (["lemon"], "a fruit I am")
       if seed_words:
         return (["lemon"], "once upon a time")
       else:
@@ -176,6 +180,41 @@ class TestProcessor(unittest.TestCase):
     self.assertEquals(stats[0], expected_stats)
 
 
+  def test_make_stats_no_nick_model_cache(self):
+
+    self.generic_stats = {
+      GenericStatisticType.USER_COUNT : 11,
+      GenericStatisticType.MODEL_CACHE : ModelCacheStatistics(4, 5000, 8192, 30, 9, 5),
+      GenericStatisticType.MERGED_CACHE : ModelCacheStatistics(1, 700, 1024, 3, 4, 0),
+    }
+    self.generator_instance.getGenericStatistics.return_value = self.generic_stats
+
+    expected_stats = "I have material from 11 users. I have the models of 4 user(s) loaded, taking 5000 of a budget " + \
+      "of 8192 bytes; there have been 30 cache hit(s), 9 miss(es) and 5 eviction(s). I have 1 merged model(s) cached, " + \
+      "taking 700 of a budget of 1024 bytes; there have been 3 merge cache hit(s), 4 miss(es) and 0 eviction(s). "
+
+    stats = self.processor.makeStats("mollusc", ["stats"])
+
+    self.assertEquals(len(stats), 1)
+    self.assertEquals(stats[0], expected_stats)
+
+
+  def test_make_stats_no_nick_quote_pool(self):
+
+    self.generic_stats = {
+      GenericStatisticType.QUOTE_POOL : QuotePoolStatistics(2, 15, 8, 6, 2, 31),
+    }
+    self.generator_instance.getGenericStatistics.return_value = self.generic_stats
+
+    expected_stats = "I have 15 quote(s) ready in 2 pool(s) of up to 8 each, having generated 31 ahead of time; " + \
+      "6 request(s) were answered from them and 2 missed, a hit ratio of 75%. "
+
+    stats = self.processor.makeStats("mollusc", ["stats"])
+
+    self.assertEquals(len(stats), 1)
+    self.assertEquals(stats[0], expected_stats)
+
+
   def test_make_stats_one_nick_unknown(self):
 
     stats = self.processor.makeStats("mollusc", ["stats", "unknown"])
@@ -431,6 +470,16 @@ class TestProcessor(unittest.TestCase):
     self.assertEquals(response, ["[lemon] once upon a time"])
 
 
+  def test_trigger_generate_quote_single_nonrandom_order(self):
+
+    self.generator_instance.generate.side_effect = self.generate_side_effect
+
+    response = self.processor.triggerGenerateQuote("mollusc", "!lemon/1")
+
+    self.assertTrue(response)
+    self.assertEquals(response, ["[lemon] a fruit I am"])
+
+
 if __name__ == "__main__":
   unittest.main()
 
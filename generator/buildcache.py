@@ -0,0 +1,283 @@
+# Cache of compiled user models, keyed by fingerprints of the source files they were built from
+
+import hashlib
+import os
+import pickle
+
+import config
+from modelfile import FORMAT_VERSION
+from modelfile import ModelFile
+from modelfile import ModelFormatError
+
+HASH_CHUNK_SIZE = 1 << 20 # Number of bytes to read at a time when hashing a source file
+
+
+class BuildCache:
+
+  def __init__(self, model_dir, lookback_count):
+
+    self.model_dir = model_dir
+    self.lookback_count = lookback_count
+    self.vocabulary = None # Shared vocabulary that cached models refer to, or None if there is no usable cache
+    self.lookback_states = None # Shared lookback states that cached models refer to, if there is a usable cache
+
+    self.fingerprints = {} # Map of source filenames to (size, mtime, digest) tuples, as last compiled
+    self.has_models = {} # Map of source filenames to whether they yielded a model when last compiled
+    self.seen = set() # Source filenames looked at during this build
+    self.composite_fingerprint = None # Nick and user source digests the cached composite model was built from, if any
+
+    self.usable = True # Cleared if the cache cannot be written, so that we stop trying
+
+
+  def getManifestFilepath(self):
+    return os.path.join(self.model_dir, config.MANIFEST_FILE_NAME)
+
+
+  def getVocabularyFilepath(self):
+    return os.path.join(self.model_dir, config.VOCABULARY_FILE_NAME)
+
+
+  def getStatesFilepath(self):
+    return os.path.join(self.model_dir, config.STATES_FILE_NAME)
+
+
+  def getCompositeFilepath(self):
+    return os.path.join(self.model_dir, config.COMPOSITE_FILE_NAME)
+
+
+  # Read the manifest, vocabulary and lookback states; return the vocabulary, or None if cached models cannot be used
+  def load(self):
+
+    manifest_filepath = self.getManifestFilepath()
+    if not os.path.isfile(manifest_filepath):
+      return None
+
+    try:
+      manifest_file = open(manifest_filepath, "rb")
+      manifest = pickle.load(manifest_file)
+      manifest_file.close()
+
+      # Manifests of other versions may be laid out differently
+      if manifest[0] != FORMAT_VERSION:
+        return None
+
+      (_, lookback_count, entries, self.composite_fingerprint) = manifest
+
+    except:
+      print "Error reading build cache manifest %s. All source material will be processed again. " % manifest_filepath
+      return None
+
+    # Even if the models are stale, remembering the sources lets us clean up after deleted ones
+    for (source_filename, (size, mtime, digest, has_model)) in entries.iteritems():
+      self.fingerprints[source_filename] = (size, mtime, digest)
+      self.has_models[source_filename] = has_model
+
+    if lookback_count != self.lookback_count:
+      return None
+
+    try:
+      vocabulary = ModelFile.readVocabulary(self.getVocabularyFilepath())
+      self.lookback_states = ModelFile.readStates(self.getStatesFilepath(), self.lookback_count)
+      self.vocabulary = vocabulary
+
+    except ModelFormatError as e:
+      print "Error reading build cache (%s). All source material will be processed again. " % e
+
+    return self.vocabulary
+
+
+  # Stop using cached models, so that all sources are processed again
+  def invalidate(self):
+    self.vocabulary = None
+    self.lookback_states = None
+    self.composite_fingerprint = None
+
+
+  @staticmethod
+  def hashFile(filepath):
+
+    digest = hashlib.sha1()
+
+    infile = open(filepath, "rb")
+    chunk = infile.read(HASH_CHUNK_SIZE)
+    while chunk:
+      digest.update(chunk)
+      chunk = infile.read(HASH_CHUNK_SIZE)
+    infile.close()
+
+    return digest.hexdigest()
+
+
+  # Return the fingerprint of a source file; the content is only hashed if its size or mtime have changed
+  def getFingerprint(self, source_filename, source_filepath):
+
+    stat = os.stat(source_filepath)
+    previous = self.fingerprints.get(source_filename)
+
+    if previous and previous[0] == stat.st_size and previous[1] == stat.st_mtime:
+      return previous
+
+    return (stat.st_size, stat.st_mtime, BuildCache.hashFile(source_filepath))
+
+
+  def getModelFilepath(self, source_filename):
+    return ModelFile.getUserFilepath(self.model_dir, source_filename[:-len(config.SOURCEFILE_EXT)])
+
+
+  # Return the cached fields of an unchanged user, {} for an unchanged source that had no material,
+  #  or None if the source must be processed again
+  # Only the nick and counts are read if counts_only is set, as when the rest is to be loaded on demand
+  def readUser(self, source_filename, fingerprint, counts_only=False):
+
+    self.seen.add(source_filename)
+
+    previous = self.fingerprints.get(source_filename)
+    if self.vocabulary is None or previous is None or previous[2] != fingerprint[2]:
+      return None
+
+    # The content is the same, so only the mtime might need updating
+    self.fingerprints[source_filename] = fingerprint
+
+    if not self.has_models[source_filename]:
+      return {}
+
+    read_function = ModelFile.readUser
+    if counts_only:
+      read_function = ModelFile.readUserCounts
+
+    try:
+      return read_function(self.getModelFilepath(source_filename), self.lookback_states, len(self.vocabulary))
+
+    except ModelFormatError as e:
+      print "Error reading cached model (%s). Its source material will be processed again. " % e
+      return None
+
+
+  # Record the fields of a user processed from a changed or new source, or None if the source had no material;
+  #  return whether the user's model file was written
+  def writeUser(self, source_filename, fingerprint, user_fields, vocabulary_size, state_count):
+
+    self.seen.add(source_filename)
+    self.fingerprints[source_filename] = fingerprint
+    self.has_models[source_filename] = user_fields is not None
+
+    model_filepath = self.getModelFilepath(source_filename)
+
+    if user_fields is None:
+      self.tryWrite(BuildCache.removeFile, model_filepath)
+      return False
+
+    if self.tryWrite(BuildCache.replaceFile, model_filepath, ModelFile.writeUser, user_fields, self.lookback_count, \
+      vocabulary_size, state_count):
+      return True
+
+    # Any model left from an earlier build refers to another vocabulary, so it must not be mistaken for this one
+    try:
+      BuildCache.removeFile(model_filepath)
+    except EnvironmentError:
+      pass
+
+    return False
+
+
+  # Drop sources that have been deleted, then write out the vocabulary, lookback states and manifest
+  def save(self, vocabulary, lookback_states):
+
+    for source_filename in self.fingerprints.keys():
+      if source_filename not in self.seen:
+        del self.fingerprints[source_filename]
+        del self.has_models[source_filename]
+        self.tryWrite(BuildCache.removeFile, self.getModelFilepath(source_filename))
+
+    self.tryWrite(BuildCache.replaceFile, self.getVocabularyFilepath(), ModelFile.writeVocabulary, vocabulary)
+    self.tryWrite(BuildCache.replaceFile, self.getStatesFilepath(), ModelFile.writeStates, lookback_states)
+    self.saveManifest()
+
+
+  def saveManifest(self):
+
+    entries = {}
+    for (source_filename, (size, mtime, digest)) in self.fingerprints.iteritems():
+      entries[source_filename] = (size, mtime, digest, self.has_models[source_filename])
+
+    self.tryWrite(BuildCache.replaceFile, self.getManifestFilepath(), BuildCache.writeManifest, \
+      (FORMAT_VERSION, self.lookback_count, entries, self.composite_fingerprint))
+
+
+  # Return what identifies the composite model of all users with a given nick, as built from the sources as they were
+  #  last saved: the nick, and the digests of the sources that yielded a user
+  def getCompositeFingerprint(self, nick):
+
+    digests = [(source_filename, digest) for (source_filename, (_, _, digest)) in self.fingerprints.iteritems() \
+      if self.has_models[source_filename]]
+
+    return (nick, tuple(sorted(digests)))
+
+
+  # Return the cached fields of the composite model with a given nick, or None if it must be built again, as it must
+  #  whenever any user's source has changed since it was written
+  def readComposite(self, nick):
+
+    if self.vocabulary is None or self.composite_fingerprint != self.getCompositeFingerprint(nick):
+      return None
+
+    try:
+      return ModelFile.readUser(self.getCompositeFilepath(), self.lookback_states, len(self.vocabulary))
+
+    except ModelFormatError as e:
+      print "Error reading cached composite model (%s). It will be built again. " % e
+      return None
+
+
+  # Record the fields of a composite model built from the sources as they were last saved
+  def writeComposite(self, user_fields, vocabulary_size, state_count):
+
+    if self.tryWrite(BuildCache.replaceFile, self.getCompositeFilepath(), ModelFile.writeUser, user_fields, \
+      self.lookback_count, vocabulary_size, state_count):
+      self.composite_fingerprint = self.getCompositeFingerprint(user_fields["nick"])
+      self.saveManifest()
+
+
+  @staticmethod
+  def writeManifest(filepath, manifest):
+
+    manifest_file = open(filepath, "wb")
+    pickle.dump(manifest, manifest_file)
+    manifest_file.close()
+
+
+  # Write a file under a temporary name and then move it into place, so that readers
+  #  (including running generators with the old file mapped) never see it half-written
+  @staticmethod
+  def replaceFile(filepath, write_function, *args):
+
+    temporary_filepath = filepath + ".tmp"
+    write_function(temporary_filepath, *args)
+    os.rename(temporary_filepath, filepath)
+
+
+  @staticmethod
+  def removeFile(filepath):
+
+    if os.path.isfile(filepath):
+      os.remove(filepath)
+
+
+  # Carry out a write to the cache, giving up on the cache (but not on the build) if it fails; return whether it was done
+  def tryWrite(self, function, filepath, *args):
+
+    if not self.usable:
+      return False
+
+    try:
+
+      if not os.path.isdir(self.model_dir):
+        os.makedirs(self.model_dir)
+
+      function(filepath, *args)
+
+    except EnvironmentError as e:
+      print "Error writing build cache (%s). Generator will start, but the next build will not be faster. " % e
+      self.usable = False
+
+    return self.usable
@@ -0,0 +1,167 @@
+# Punctuation and URL details of each token in a vocabulary, worked out once per distinct token
+
+from collections import namedtuple
+
+import config
+
+# Openers that a token opens; the index of its last character before any ending punctuation; the number of closers
+#  running back from there, which may match open parentheses; and the numbers of those matches after which the rest
+#  of the token is a parenthesis exception, and so is left as it is
+TokenMarks = namedtuple("TokenMarks", "openers, end, closer_count, exceptions")
+
+
+# Most tokens have no parentheses to open, match or drop, so only those that do are given marks; a token without
+#  marks is output as it is and leaves open parentheses alone
+class TokenClassifier:
+
+  def __init__(self, vocabulary):
+
+    self.vocabulary = vocabulary
+    self.checked = 0 # Number of tokens in the vocabulary classified so far
+
+    self.urls = set() # Ids of tokens that are URLs
+    self.closers = {} # Map of the ids of tokens that close a parenthesis to the openers they close
+    self.marks = {} # Map of the ids of tokens with parentheses to their marks
+
+
+  @staticmethod
+  def isUrl(word):
+
+    # FIXME: get a proper regex
+    return word.startswith("http") or word.startswith("www")
+
+
+  @staticmethod
+  # Note: this is not a proper balance checker, since we are not interested in unmatched openers
+  def areParenthesesBalanced(word):
+
+    closers = []
+
+    for char in word:
+
+      if closers and char == closers[-1]:
+        closers.pop()
+
+      elif char in config.CLOSERS_TO_OPENERS:
+        return False
+
+      if char in config.OPENERS_TO_CLOSERS:
+        closers.append(config.OPENERS_TO_CLOSERS[char])
+
+    return True
+
+
+  @staticmethod
+  def isParenthesisException(word):
+
+    if word in config.PARENTHESIS_EXCEPTIONS:
+      return True
+
+    if not TokenClassifier.isUrl(word):
+      return False
+
+    return TokenClassifier.areParenthesesBalanced(word)
+
+
+  @staticmethod
+  def getLastIndexBeforeEndingPunctuation(word):
+
+    i = len(word) - 1
+    while i >= 0 and word[i] in config.WORD_ENDING_PUNCTUATION:
+      i -= 1
+
+    return i
+
+
+  # Return the opener that a word closes, ignoring any punctuation after the closer, or None if it closes none
+  @staticmethod
+  def getClosedOpener(word):
+
+    last = word[TokenClassifier.getLastIndexBeforeEndingPunctuation(word)]
+    if TokenClassifier.isParenthesisException(word) or not last in config.CLOSERS_TO_OPENERS:
+      return None
+
+    return config.CLOSERS_TO_OPENERS[last]
+
+
+  # Return the marks of a word, or None if it has no parentheses to open, match or drop
+  @staticmethod
+  def getMarks(word):
+
+    openers = ""
+    if not word in config.PARENTHESIS_EXCEPTIONS:
+      i = 0
+      while i < len(word) and word[i] in config.OPENERS_TO_CLOSERS:
+        i += 1
+      openers = word[:i]
+
+    end = TokenClassifier.getLastIndexBeforeEndingPunctuation(word)
+
+    closer_count = 0
+    while end - closer_count >= 0 and word[end - closer_count] in config.CLOSERS_TO_OPENERS:
+      closer_count += 1
+
+    if not openers and not closer_count:
+      return None
+
+    exceptions = tuple([matched for matched in xrange(0, closer_count + 1) \
+      if word[:end + 1 - matched] in config.PARENTHESIS_EXCEPTIONS])
+
+    return TokenMarks(tuple(openers), end, closer_count, exceptions)
+
+
+  # Classify any tokens added to the vocabulary since the last call; it only ever grows
+  def update(self):
+
+    tokens = self.vocabulary.tokens
+
+    for ident in xrange(self.checked, len(tokens)):
+
+      word = tokens[ident]
+      if word is None:
+        continue
+
+      if TokenClassifier.isUrl(word):
+        self.urls.add(ident)
+
+      opener = TokenClassifier.getClosedOpener(word)
+      if opener:
+        self.closers[ident] = opener
+
+      marks = TokenClassifier.getMarks(word)
+      if marks:
+        self.marks[ident] = marks
+
+    self.checked = len(tokens)
+
+
+  def getClosers(self):
+    self.update()
+    return self.closers
+
+
+  # Return the text of a token as it is to be output, given the parentheses open before it, which are updated to
+  #  those open after it; closers matching open parentheses are kept, and any others are dropped
+  def cleanWord(self, ident, openers):
+
+    if ident >= self.checked:
+      self.update()
+
+    word = self.vocabulary.tokens[ident]
+    marks = self.marks.get(ident)
+    if marks is None:
+      return word
+
+    openers.extend(marks.openers)
+
+    matched = 0
+    while matched < marks.closer_count and openers and \
+      word[marks.end - matched] == config.OPENERS_TO_CLOSERS[openers[-1]]:
+
+      openers.pop()
+      matched += 1
+
+    if matched in marks.exceptions:
+      return word
+
+    return word[:marks.end + 1 - marks.closer_count] + word[marks.end + 1 - matched:]
@@ -0,0 +1,37 @@
+### Parse a directory of source material and write precompiled models, so that the bot starts quickly
+
+import sys
+
+from generator import Generator
+
+USAGE = "Usage: %s <sourcedir>"
+USER_RUN_COMPRESSION_MESSAGE = "%s: runs of single successors shrink the choices a walk makes %.2f times. "
+RUN_COMPRESSION_MESSAGE = "Compiled %d user(s); runs of single successors shrink the choices a walk makes %.2f times. "
+
+
+# Print how many times fewer edges a walk has to choose between in each user's tables, with runs taken whole, and
+#  then across all users' tables together
+def printRunCompression(users):
+
+  edge_count = 0
+  choice_count = 0.0
+
+  for nick in sorted(users.usermap):
+    all_lookbacks = users.getAllLookbacks(nick)
+    compression = all_lookbacks.getRunCompression()
+    if compression:
+      print USER_RUN_COMPRESSION_MESSAGE % (nick, compression)
+      edge_count += len(all_lookbacks.successors)
+      choice_count += len(all_lookbacks.successors) / compression
+
+  if choice_count:
+    print RUN_COMPRESSION_MESSAGE % (len(users.usermap), edge_count / choice_count)
+
+
+if __name__ == "__main__":
+
+  if len(sys.argv) < 2:
+    print USAGE % sys.argv[0]
+    sys.exit(1)
+
+  printRunCompression(Generator().compile(sys.argv[1]))
@@ -1,5 +1,21 @@
 LOOKBACK_LEN = 2 # Number of predecessors to a successor
 SOURCEFILE_EXT = ".src" # Source material file extension
+BUILD_WORKERS = 1 # Number of processes to parse source material and build tables with; 0 for one per core
+CHUNKED_PARSE_MIN_BYTES = 16 << 20 # Source files at least this big are split between all the processes
+
+MODEL_DIR_NAME = "compiled" # Directory inside sources directory holding precompiled models
+MODEL_FILE_EXT = ".mdl" # Precompiled user model file extension
+VOCABULARY_FILE_NAME = "vocabulary.voc" # Precompiled vocabulary file inside the models directory
+STATES_FILE_NAME = "states.sta" # Precompiled lookback states file inside the models directory
+MANIFEST_FILE_NAME = "manifest.p" # Fingerprints of the sources the precompiled models were built from
+COMPOSITE_FILE_NAME = "composite.cmp" # Precompiled model combining all users, if one is asked for
+MODEL_COPY_BYTES = 16 << 20 # Arrays of a precompiled model up to this size are copied into memory when read; larger ones stay mapped
+
+LAZY_MODELS = False # Whether to load each user's tables only when first needed, rather than at startup
+MODEL_CACHE_BYTES = 256 << 20 # Bytes of tables to keep loaded at most, when loading them on demand
+MERGED_CACHE_BYTES = 64 << 20 # Bytes of tables merged from several users to keep at most
+MERGED_CACHE_MIN_REQUESTS = 2 # Number of times a combination of users must be requested before its tables are merged
+RANDOM_NICK_WEIGHTED = False # Whether to choose random users in proportion to how much material they have, rather than evenly
 
 META_FILE_NAME = "meta.info" # Meta info file inside sources directory
 META_DATE = "date"
@@ -13,6 +29,10 @@ STATS_FILE_NAME = "users.p" # File to save user stats to
 CHANGES_BETWEEN_STATS_PERSISTENCE = 5 # Number of changes seen between stats writes to disk
 
 OUTPUT_WORDS_MAX = 200 # The maximum number of words to generate in a line, just to prevent infinite strings
+GENERATE_MANY_ATTEMPTS_FACTOR = 10 # Number of attempts per quote wanted, when generating a batch of unique quotes
+LOCKSTEP_MIN_QUOTES = 32 # Batches of at least this many quotes are generated all together with NumPy, if it is installed
+QUOTE_POOL_DEPTH = 0 # Number of quotes to keep ready for each of the most requested users and kinds of random request, or 0 for none
+QUOTE_POOL_USERS = 5 # Number of the most requested users to keep quotes ready for
 
 # Pairs of parentheses and other punctuation to search for in matching
 OPENERS_TO_CLOSERS = {
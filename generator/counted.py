@@ -0,0 +1,105 @@
+# Sequences of repeated items, stored as each distinct item and the number of times it occurs
+
+from array import array
+from bisect import bisect_right
+
+from transitions import INDEX_TYPECODE
+
+
+# Behaves as the sorted list of all occurrences of the items, so random.choice picks an item in proportion to its
+#  count, by bisecting running totals of the counts
+# Items are token ids, or tuples of them of a given width, which are flattened into one array
+# The arrays may be any indexable sequences, such as views onto a memory-mapped model file
+class CountedSequence:
+
+  def __init__(self, items, bounds, width=None):
+
+    self.items = items # Distinct items in order, flattened if they are tuples
+    self.bounds = bounds # Number of occurrences of all items up to and including each one
+    self.width = width # Length of each item, if the items are tuples
+
+
+  # Build from a map of items to counts
+  @staticmethod
+  def fromCounts(counts, width=None):
+
+    items = array(INDEX_TYPECODE)
+    bounds = array(INDEX_TYPECODE)
+    total = 0
+
+    for item in sorted(counts):
+
+      if width:
+        items.extend(item)
+      else:
+        items.append(item)
+
+      total += counts[item]
+      bounds.append(total)
+
+    return CountedSequence(items, bounds, width)
+
+
+  def __len__(self):
+
+    if not len(self.bounds):
+      return 0
+
+    return int(self.bounds[-1])
+
+
+  def __getitem__(self, index):
+
+    if index < 0:
+      index += len(self)
+
+    if index < 0 or index >= len(self):
+      raise IndexError("counted sequence index out of range")
+
+    return self.getItem(bisect_right(self.bounds, index))
+
+
+  # Yield each occurrence of each item, as the list it stands for would
+  def __iter__(self):
+
+    start = 0
+    for i in xrange(0, len(self.bounds)):
+      item = self.getItem(i)
+      for j in xrange(start, self.bounds[i]):
+        yield item
+      start = self.bounds[i]
+
+
+  # Return the distinct item at a given place
+  def getItem(self, i):
+
+    if self.width:
+      start = i * self.width
+      return tuple(self.items[start:start + self.width])
+
+    return self.items[i]
+
+
+  # Number of distinct items
+  def countDistinct(self):
+    return len(self.bounds)
+
+
+  # Return a map of the distinct items to their counts
+  def getCounts(self):
+
+    counts = {}
+    start = 0
+    for i in xrange(0, len(self.bounds)):
+      counts[self.getItem(i)] = self.bounds[i] - start
+      start = self.bounds[i]
+
+    return counts
+
+
+  def getArrays(self):
+    return [self.items, self.bounds]
+
+
+  def countBytes(self):
+    return sum([len(arr) * arr.itemsize for arr in self.getArrays()])
@@ -1,13 +1,37 @@
 # Per-user Markov generator class
 
+from array import array
+from collections import deque
 from collections import namedtuple
+import multiprocessing
 import os
 import random
 import time
 
+from buildcache import BuildCache
+from classifier import TokenClassifier
 import config
+from counted import CountedSequence
+from lockstep import LockstepEngine
+from modelfile import ModelFile
+from modelfile import ModelFormatError
+from modelcache import MergedModelCache
+from quotepool import QuotePool
+from states import LookbackStates
+from transitions import INDEX_TYPECODE
+from transitions import NO_ROW
+from transitions import RUN_END
+from transitions import ClosingOverlay
+from transitions import KeyPacker
+from transitions import SuffixIndex
+from transitions import TransitionTable
+from union import UnionSequence
+from union import UnionTable
 from users import User
 from users import UserCollection
+from users import UserNickType
+from vocabulary import SpecialToken
+from vocabulary import Vocabulary
 
 SourceChannelNames = namedtuple("SourceChannelNames", "primary, additionals")
 UserTuples = namedtuple("UserTuples", "all_lookbacks, closing_lookbacks, starters, urls")
@@ -20,11 +44,9 @@ class GenericStatisticType:
   SOURCE_CHANNELS = 3
   BIGGEST_USERS = 4
   MOST_QUOTED_USERS = 5
-
-
-class SpecialToken:
-  TERMINATE = 0
-  URL = 1
+  MODEL_CACHE = 6
+  MERGED_CACHE = 7
+  QUOTE_POOL = 8
 
 
 class GeneratorUtil:
@@ -55,88 +77,91 @@ class GeneratorUtil:
     return meta
 
 
-  # Make a shallow (ish) copy of a dictionary of lists
   @staticmethod
-  def copyListDict(original):
-
-    result = {}
+  def countNonTerminalWithCreate(dictionary, key, value):
 
-    for pair, successors in original.iteritems():
-      successors_copy = list(successors)
-      result[pair] = successors_copy
+    if not key in dictionary:
+      dictionary[key] = {}
 
-    return result
+    successors = dictionary[key]
+    successors[value] = successors.get(value, 0) + 1
 
 
-  # Merge one dictionary of lists into another
   @staticmethod
-  def mergeIntoDictionary(mergeinto, mergefrom):
-
-    for key, value_list in mergefrom.iteritems():
-
-      if not key in mergeinto:
-        mergeinto[key] = []
+  def countTerminalWithCreate(dictionary, key):
 
-      mergeinto[key] += value_list
+    if not SpecialToken.TERMINATE in dictionary:
+      GeneratorUtil.countNonTerminalWithCreate(dictionary, key, SpecialToken.TERMINATE)
 
 
   @staticmethod
-  def appendNonTerminalWithCreate(dictionary, key, value):
-
-    if not key in dictionary:
-      dictionary[key] = []
-
-    dictionary[key].append(value)
+  def countWithCreate(dictionary, key, count=1):
+    dictionary[key] = dictionary.get(key, 0) + count
 
 
+  # Return the (start, end) byte ranges of up to chunk_count pieces of a file, each of them ending on a line boundary
   @staticmethod
-  def appendTerminalWithCreate(dictionary, key):
+  def getChunks(filepath, chunk_count):
 
-    if not SpecialToken.TERMINATE in dictionary:
+    size = os.path.getsize(filepath)
+    if size < config.CHUNKED_PARSE_MIN_BYTES:
+      chunk_count = 1
 
-      if not key in dictionary:
-        dictionary[key] = []
+    boundaries = [0]
+    infile = open(filepath, 'r')
 
-      dictionary[key].append(SpecialToken.TERMINATE)
+    for i in range(1, chunk_count):
 
+      # Move each nominal boundary on to the start of the next line
+      position = max(boundaries[-1], size * i // chunk_count)
+      if position > 0:
+        infile.seek(position - 1)
+        infile.readline()
+        position = infile.tell()
 
-  @staticmethod
-  def isUrl(word):
+      if position >= size:
+        break
 
-    # FIXME: get a proper regex
-    return word.startswith("http") or word.startswith("www")
+      if position > boundaries[-1]:
+        boundaries.append(position)
 
+    infile.close()
+    boundaries.append(size)
 
-  @staticmethod
-  # Note: this is not a proper balance checker, since we are not interested in unmatched openers
-  def areParenthesesBalanced(word):
+    return zip(boundaries[:-1], boundaries[1:])
 
-    closers = []
 
-    for char in word:
+  # Return a list of arrays as (typecode, contents) pairs, which are far quicker to send between processes than arrays,
+  #  as those are pickled item by item
+  @staticmethod
+  def dumpArrays(arrays):
+    return [(arr.typecode, arr.tostring()) for arr in arrays]
 
-      if closers and char == closers[-1]:
-        closers.pop()
 
-      elif char in config.CLOSERS_TO_OPENERS:
-        return False
+  @staticmethod
+  def loadArrays(dumped):
 
-      if char in config.OPENERS_TO_CLOSERS:
-        closers.append(config.OPENERS_TO_CLOSERS[char])
+    arrays = []
+    for (typecode, contents) in dumped:
+      arr = array(typecode)
+      arr.fromstring(contents)
+      arrays.append(arr)
 
-    return True
+    return arrays
 
 
+  # Yield the lines in the next length bytes of a file
   @staticmethod
-  def isParenthesisException(word):
+  def readLines(infile, length):
 
-    if word in config.PARENTHESIS_EXCEPTIONS:
-      return True
+    while length > 0:
 
-    if not GeneratorUtil.isUrl(word):
-      return False
+      line = infile.readline()
+      if not line:
+        break
 
-    return GeneratorUtil.areParenthesesBalanced(word)
+      length -= len(line)
+      yield line
 
 
 class Generator:
@@ -144,16 +169,42 @@ class Generator:
   SEP = "/"
   SOURCEFILE_EXTLEN = len(config.SOURCEFILE_EXT) # Length of the source file extension
 
-  def __init__(self, lookback_count=config.LOOKBACK_LEN):
+  def __init__(self, lookback_count=config.LOOKBACK_LEN, build_workers=config.BUILD_WORKERS, lazy_models=config.LAZY_MODELS, \
+    composite_nick=None, quote_pool_depth=config.QUOTE_POOL_DEPTH):
     self.lookback_count = lookback_count
+    self.build_workers = build_workers or multiprocessing.cpu_count()
+    self.lazy_models = lazy_models
+    self.composite_nick = composite_nick # If given, the nick of a model combining all users' tables
+    self.composite_nicks = [] # Nicks of the users combined into that model, in the order of its starter and URL lists
+    self.merged_cache = MergedModelCache(config.MERGED_CACHE_BYTES, config.MERGED_CACHE_MIN_REQUESTS)
+    self.vocabulary = Vocabulary() # Tokens are interned once, and all tables are stored by token id
+    self.classifier = TokenClassifier(self.vocabulary) # Punctuation and URL details of each token in the vocabulary
+    self.lookback_states = LookbackStates(lookback_count) # Lookbacks are also interned once, and tables store their ids
+    self.lockstep = LockstepEngine(self) # Generates big batches of quotes, where NumPy is available
+
+    self.quote_pool = None # Quotes generated ahead of time, if any are to be kept
+    self.pool_random_keys = set() # Keys of the kinds of random request made so far, to keep quotes ready for
+    if quote_pool_depth:
+      self.quote_pool = QuotePool(quote_pool_depth)
 
 
   def build(self, source_dir):
+    self.source_dir = source_dir
     users = UserCollection()
-    self.readSources(source_dir, users)
+    cache = self.readSources(source_dir, users)
     users.init(source_dir)
     self.init(users, GeneratorUtil.buildMeta(source_dir))
 
+    if self.composite_nick:
+      self.buildComposite(cache)
+
+
+  # Process all sources again, ignoring and then replacing whatever models were cached from them; return the users read
+  def compile(self, source_dir):
+    users = UserCollection()
+    self.readSources(source_dir, users, use_cache=False)
+    return users
+
 
   def init(self, users, meta, time=int(time.time())):
     self.users = users
@@ -161,109 +212,515 @@ class Generator:
     self.date_started = time
 
 
-  def readSources(self, source_dir, users):
+  @staticmethod
+  def getModelDir(source_dir):
+    return os.path.join(source_dir, config.MODEL_DIR_NAME)
+
+
+  # Cached models refer to tokens and lookback states by id, so they can only be used alongside the vocabulary and
+  #  states they were built with (or ones extending them)
+  def adoptVocabulary(self, vocabulary, lookback_states):
 
-    source_filenames = os.listdir(source_dir)
+    if len(self.vocabulary) == SpecialToken.COUNT:
+      self.vocabulary = vocabulary
+      self.classifier = TokenClassifier(vocabulary)
+      self.lookback_states = lookback_states
+
+    return self.vocabulary.tokens[:len(vocabulary)] == vocabulary.tokens and \
+      self.lookback_states.extends(lookback_states)
+
+
+  # Load users from their cached models where the source has not changed since, and from source otherwise; return the
+  #  build cache, saved
+  def readSources(self, source_dir, users, use_cache=True):
+
+    cache = BuildCache(Generator.getModelDir(source_dir), self.lookback_count)
+    vocabulary = cache.load()
+    if not use_cache or not vocabulary or not self.adoptVocabulary(vocabulary, cache.lookback_states):
+      cache.invalidate()
+
+    source_filenames = sorted(os.listdir(source_dir))
+    pending = []
 
     for source_filename in source_filenames:
 
+      # The composite model is built from the users' tables instead
+      if self.composite_nick and source_filename == self.composite_nick + config.SOURCEFILE_EXT:
+        continue
+
       if source_filename.endswith(config.SOURCEFILE_EXT):
 
         source_filepath = source_dir + Generator.SEP + source_filename
-        infile = open(source_filepath, 'r')
-        (nick, user_tuples) = self.processSource(source_filename, infile)
-        infile.close()
+        fingerprint = cache.getFingerprint(source_filename, source_filepath)
 
-        # Only add new user to sources if any material actually found in file
-        if user_tuples.all_lookbacks:
-          users.addUser(
-            nick=nick,
-            starters=user_tuples.starters,
-            all_lookbacks=user_tuples.all_lookbacks,
-            closing_lookbacks=user_tuples.closing_lookbacks,
-            urls=user_tuples.urls
-          )
+        # Sources that are unchanged, but had no material in them last time either, are skipped
+        user_fields = cache.readUser(source_filename, fingerprint, self.lazy_models)
+        if user_fields:
+          self.addUser(users, source_filepath, user_fields)
 
+        elif user_fields is None:
+          pending.append((source_filename, source_filepath, fingerprint))
 
-  def processSource(self, source_filename, source_data):
+    # A single source is still worth a pool if it is big enough to be split between the workers
+    if self.build_workers > 1 and (len(pending) > 1 or (pending and pending[0][2][0] >= config.CHUNKED_PARSE_MIN_BYTES)):
+      processed = self.processSourcesParallel([source_filepath for (_, source_filepath, _) in pending])
+    else:
+      processed = self.processSourcesSerial([source_filepath for (_, source_filepath, _) in pending])
+
+    for (i, (nick, user_tuples, vocabulary_size, state_count)) in enumerate(processed):
+
+      (source_filename, source_filepath, fingerprint) = pending[i]
 
+      # Only add new user to sources if any material actually found in file
+      user_fields = None
+      if user_tuples.all_lookbacks:
+        user_fields = Generator.getUserFields(nick, user_tuples)
+
+      # In lazy mode, the user is loaded back from this when first needed, if it could be written
+      written = cache.writeUser(source_filename, fingerprint, user_fields, vocabulary_size, state_count)
+
+      if user_fields:
+        self.addUser(users, source_filepath, user_fields, written)
+
+    self.lookback_states.commit()
+    cache.save(self.vocabulary, self.lookback_states)
+
+    return cache
+
+
+  @staticmethod
+  def getUserFields(nick, user_tuples):
+
+    return {
+      "nick" : nick,
+      "starters" : user_tuples.starters,
+      "all_lookbacks" : user_tuples.all_lookbacks,
+      "closing_lookbacks" : user_tuples.closing_lookbacks,
+      "urls" : user_tuples.urls,
+    }
+
+
+  # Add a user, or in lazy mode, only what is needed to count, find and later load it, which is all that fields read
+  #  from a cached model hold then
+  # If the user's model file is not known to hold these fields, the user is loaded from source instead
+  def addUser(self, users, source_filepath, user_fields, use_model=True):
+
+    if not self.lazy_models:
+      users.addUser(**user_fields)
+      return
+
+    if not "starter_count" in user_fields:
+      user_fields = Generator.getUserCounts(user_fields)
+
+    users.addUser(loader=self.getUserLoader(source_filepath, use_model), **user_fields)
+
+
+  # Return the nick and counts of a user given as fields, as a model file's header holds them
+  @staticmethod
+  def getUserCounts(user_fields):
+
+    return {
+      "nick" : user_fields["nick"],
+      "starter_count" : len(user_fields["starters"]),
+      "production_count" : user_fields["all_lookbacks"].countProductions(),
+    }
+
+
+  # Return a function loading a user's tables from its cached model, or from its source if that model has been
+  #  replaced since startup (its token ids would then refer to another vocabulary), cannot be read, or is not to be used
+  def getUserLoader(self, source_filepath, use_model=True):
+
+    source_filename = os.path.basename(source_filepath)
     nick = source_filename[:-Generator.SOURCEFILE_EXTLEN]
-    starters = []
-    all_lookbacks = {}
-    closing_lookbacks = {}
-    urls = []
+    model_filepath = ModelFile.getUserFilepath(Generator.getModelDir(os.path.dirname(source_filepath)), nick)
+    model_identity = use_model and Generator.getFileIdentity(model_filepath)
 
-    for opener in config.OPENERS_TO_CLOSERS:
-      closing_lookbacks[opener] = {}
-    user_tuples = UserTuples(all_lookbacks, closing_lookbacks, starters, urls)
+    def loadUser():
+
+      if model_identity and Generator.getFileIdentity(model_filepath) == model_identity:
+        try:
+          return ModelFile.readUser(model_filepath, self.lookback_states, len(self.vocabulary))
+        except (ModelFormatError, EnvironmentError):
+          pass
+
+      infile = open(source_filepath, 'r')
+      (nick, user_tuples) = self.processSource(source_filename, infile)
+      infile.close()
+      self.lookback_states.commit()
+
+      return Generator.getUserFields(nick, user_tuples)
+
+    return loadUser
+
+
+  # Parse a user's source material again, replacing their tables, and any merged from them, with what it now holds
+  # The user keeps their aliases and statistics; their cached model is left for the next build to bring up to date
+  def reloadUser(self, nick):
+
+    user = self.users.getByAlias(nick)
+    source_filename = user.nick + config.SOURCEFILE_EXT
+    source_filepath = self.source_dir + Generator.SEP + source_filename
+
+    old_tuples = None
+    if user.nick in self.composite_nicks:
+      old_tuples = self.getModelTuples(user.nick)
+
+    if self.lazy_models:
+      loader = self.getUserLoader(source_filepath, use_model=False)
+      user_fields = loader()
+      self.users.replaceModel(loader=loader, **Generator.getUserCounts(user_fields))
+
+    else:
+      infile = open(source_filepath, 'r')
+      (_, user_tuples) = self.processSource(source_filename, infile)
+      infile.close()
+      self.lookback_states.commit()
+      user_fields = Generator.getUserFields(user.nick, user_tuples)
+      self.users.replaceModel(**user_fields)
+
+    self.merged_cache.invalidate(user.nick)
+
+    if self.quote_pool is not None:
+      self.quote_pool.discard(user.nick)
+
+    if old_tuples:
+      new_tuples = UserTuples(user_fields["all_lookbacks"], user_fields["closing_lookbacks"], user_fields["starters"], \
+        user_fields["urls"])
+      self.updateComposite(user.nick, old_tuples, new_tuples)
+
+
+  # Build a model whose tables sum those of all users, for the composite nick; this replaces reading a source
+  #  amalgamating all others
+  # Its tables are read from the build cache, if given, unless any user's source has changed since they were cached
+  #  there, in which case they are merged again and cached; its lists are views onto the users' own either way
+  def buildComposite(self, cache=None):
+
+    self.composite_nicks = self.users.getNicks()
+    if not self.composite_nicks:
+      return
+
+    users_tuples = [self.getModelTuples(nick) for nick in self.composite_nicks]
+
+    cached_fields = None
+    if cache:
+      cached_fields = cache.readComposite(self.composite_nick)
+
+    if cached_fields:
+      combined_tuples = Generator.combineTuples(users_tuples)
+      composite_tuples = UserTuples(cached_fields["all_lookbacks"], cached_fields["closing_lookbacks"], \
+        combined_tuples.starters, combined_tuples.urls)
+
+    else:
+      (composite_tuples, _) = self.mergeTuples(users_tuples, None)
+
+      if cache:
+        table_tuples = UserTuples(composite_tuples.all_lookbacks, composite_tuples.closing_lookbacks, \
+          CountedSequence.fromCounts({}, self.lookback_count), CountedSequence.fromCounts({}))
+        cache.writeComposite(Generator.getUserFields(self.composite_nick, table_tuples), len(self.vocabulary), \
+          len(self.lookback_states))
+
+    self.users.addComposite(**Generator.getUserFields(self.composite_nick, composite_tuples))
+
+
+  # Bring the composite model up to date with a user's new tables, by taking away their old counts and adding the new
+  # Only the rows of the lookbacks the user had or has are built again, so this takes time in proportion to the user's
+  #  tables rather than the composite's
+  def updateComposite(self, nick, old_tuples, new_tuples):
+
+    composite = self.users.getByAlias(self.composite_nick)
+    weights = [1, -1, 1]
+
+    counts_by_state = {}
+    for (table, weight) in zip([old_tuples.all_lookbacks, new_tuples.all_lookbacks], weights[1:]):
+      for row in xrange(0, len(table.states)):
+
+        state = table.states[row]
+        if not state in counts_by_state:
+          counts_by_state[state] = composite.all_lookbacks.getStateCounts(state)
+
+        successor_counts = counts_by_state[state]
+        for (successor, count) in table.getRowCounts(row).iteritems():
+          successor_counts[successor] = successor_counts.get(successor, 0) + count * weight
+
+    # Lookbacks left without any count lose their rows
+    for (state, successor_counts) in counts_by_state.iteritems():
+      counts_by_state[state] = {successor: count for (successor, count) in successor_counts.iteritems() if count > 0}
+
+    all_lookbacks = composite.all_lookbacks.replaceRows(counts_by_state)
+
+    url_counts = ClosingOverlay.mergeUrlCounts([composite.closing_lookbacks, old_tuples.closing_lookbacks, \
+      new_tuples.closing_lookbacks], weights)
+    closing_lookbacks = self.buildClosing(all_lookbacks, url_counts)
+
+    # The lists are views onto each user's own, so only the user's need be swapped
+    i = self.composite_nicks.index(nick)
+    starter_lists = list(composite.starters.sequences)
+    starter_lists[i] = new_tuples.starters
+    url_lists = list(composite.urls.sequences)
+    url_lists[i] = new_tuples.urls
+
+    composite_tuples = UserTuples(all_lookbacks, closing_lookbacks, UnionSequence(starter_lists), UnionSequence(url_lists))
+    self.users.replaceModel(**Generator.getUserFields(self.composite_nick, composite_tuples))
+    self.merged_cache.invalidate(self.composite_nick)
+
+
+  # Return a user's tables and lists as they are held, rather than copies of them
+  def getModelTuples(self, nick):
+
+    user = self.users.getModel(nick)
+
+    return UserTuples(user.all_lookbacks, user.closing_lookbacks, user.starters, user.urls)
+
+
+  # Return what identifies a particular version of a file, or None if there is no such file
+  @staticmethod
+  def getFileIdentity(filepath):
+
+    try:
+      stat = os.stat(filepath)
+    except OSError:
+      return None
+
+    return (stat.st_ino, stat.st_size, stat.st_mtime)
+
+
+  # Yield the nick and tables of each of the given sources, in order, with the numbers of tokens and states there were
+  #  once it was processed, as its tables may refer to any of those
+  def processSourcesSerial(self, source_filepaths):
+
+    for source_filepath in source_filepaths:
+
+      infile = open(source_filepath, 'r')
+      (nick, user_tuples) = self.processSource(os.path.basename(source_filepath), infile)
+      infile.close()
+
+      yield (nick, user_tuples, len(self.vocabulary), len(self.lookback_states))
+
+
+  # Yield the same as processSourcesSerial, with the parsing and table building spread over a pool of processes
+  # Big sources are split into chunks at line boundaries, so that they too are spread over the pool
+  # Each worker counts against a vocabulary of its own; interning those tokens and then the lookback states here, in
+  #  source and chunk order, gives every token and state the id a serial build would have given it
+  # Everything else, remapping and merging the counts and building the tables, is done in the workers; a few sources
+  #  are kept in each stage at once, so that the workers get on with the next ones while this interns, and so the
+  #  numbers of tokens and states are taken as each source is interned, rather than when it is yielded
+  def processSourcesParallel(self, source_filepaths):
+
+    pool = multiprocessing.Pool(self.build_workers)
+    counting = deque()
+    merging = deque()
+    building = deque()
+
+    try:
+
+      for source_filepath in source_filepaths:
+
+        counting.append(self.startCounting(pool, source_filepath))
+
+        if len(counting) > self.build_workers:
+          merging.append(self.startMerging(pool, *counting.popleft()))
+
+        if len(merging) > self.build_workers:
+          building.append(self.startBuilding(pool, *merging.popleft()))
+
+        if len(building) > self.build_workers:
+          yield self.finishBuilding(*building.popleft())
+
+      while counting:
+        merging.append(self.startMerging(pool, *counting.popleft()))
+
+      while merging:
+        building.append(self.startBuilding(pool, *merging.popleft()))
+
+      while building:
+        yield self.finishBuilding(*building.popleft())
+
+    finally:
+      pool.terminate()
+      pool.join()
+
+
+  # Start counting the chunks of a source in a pool; return its nick and the pending counts of each chunk
+  def startCounting(self, pool, source_filepath):
+
+    nick = os.path.basename(source_filepath)[:-Generator.SOURCEFILE_EXTLEN]
+    chunks = GeneratorUtil.getChunks(source_filepath, self.build_workers)
+
+    results = []
+    for (start, end) in chunks:
+      results.append(pool.apply_async(countSourceChunk, [(self.lookback_count, source_filepath, start, end)]))
+
+    return (nick, results)
+
+
+  # Intern the tokens each chunk of a source was counted against, and start merging its counts in a pool
+  def startMerging(self, pool, nick, results):
+
+    chunks = []
+    for result in results:
+      (tokens, counted) = result.get()
+      chunks.append((self.getRemappedIds(tokens), counted))
+
+    self.fitVocabulary()
+    packer = self.lookback_states.packer
+
+    return (nick, len(self.vocabulary), packer, \
+      pool.apply_async(mergeSourceCounts, [(self.lookback_count, packer.wide, chunks)]))
+
+
+  # Return a list mapping the ids of a list of tokens, as counted by a worker, to their ids in our vocabulary
+  def getRemappedIds(self, tokens):
+    return range(0, SpecialToken.COUNT) + [self.vocabulary.getOrCreateId(token) for token in tokens[SpecialToken.COUNT:]]
+
+
+  # Intern the lookback states of a source's merged counts, in order of their keys, and start building its tables in
+  #  a pool
+  # The keys are packed again if the states have been packed wider since the counts were sent to be merged
+  def startBuilding(self, pool, nick, vocabulary_size, merge_packer, result):
+
+    (lookback_counts, closing_urls, starters, urls) = result.get()
+    packer = self.lookback_states.packer
+
+    keys = merge_packer.loadKeys(GeneratorUtil.loadArrays(lookback_counts[:1])[0])
+    if packer.wide != merge_packer.wide:
+      keys = packer.createKeys([packer.repack(key, merge_packer) for key in keys])
+      lookback_counts = GeneratorUtil.dumpArrays([packer.dumpKeys(keys)]) + lookback_counts[1:]
+
+    states = array(INDEX_TYPECODE, self.lookback_states.getOrCreateIds(keys))
+
+    url_counts = {}
+    for (lookback, counts) in closing_urls.iteritems():
+      url_counts[self.lookback_states.findLookback(lookback)] = counts
+
+    task = (self.lookback_count, packer.wide, lookback_counts, GeneratorUtil.dumpArrays([states]), \
+      config.OPENERS_TO_CLOSERS.keys(), self.classifier.getClosers(), url_counts)
+
+    return (nick, vocabulary_size, len(self.lookback_states), starters, urls, packer, \
+      pool.apply_async(buildTableArrays, [task]))
+
+
+  # Wait for the tables of a source to be built in a pool; return them as processSourcesSerial yields them
+  def finishBuilding(self, nick, vocabulary_size, state_count, starters, urls, packer, result):
+
+    (table_arrays, index_arrays, closing_arrays) = result.get()
+
+    suffix_index = SuffixIndex.fromArrays(packer, *GeneratorUtil.loadArrays(index_arrays))
+    all_lookbacks = TransitionTable(self.lookback_states, *GeneratorUtil.loadArrays(table_arrays), \
+      suffix_index=suffix_index)
+
+    closing = {}
+    for (opener, arrays) in closing_arrays.iteritems():
+      closing[opener] = ClosingOverlay(all_lookbacks, *GeneratorUtil.loadArrays(arrays))
+
+    starters = CountedSequence(*GeneratorUtil.loadArrays(starters), width=self.lookback_count)
+    urls = CountedSequence(*GeneratorUtil.loadArrays(urls))
+
+    return (nick, UserTuples(all_lookbacks, closing, starters, urls), vocabulary_size, state_count)
+
+
+  def processSource(self, source_filename, source_data):
+    nick = source_filename[:-Generator.SOURCEFILE_EXTLEN]
+    return (nick, self.buildTables(self.countSource(source_data)))
+
+
+  # Return empty counts, as gathered by countSource; closing successors are only picked out once the tables are built,
+  #  except for URLs, which the tables hold as the URL token, so those closing a parenthesis are counted by lookback
+  # Starters and URLs are counted as maps of each distinct one to the number of times it was seen
+  @staticmethod
+  def createCounts():
+    return UserTuples({}, {}, {}, {})
+
+
+  # Return the counts of all productions in some source material, as maps of lookbacks to successor counts
+  def countSource(self, source_data):
+
+    user_tuples = Generator.createCounts()
 
     for line in source_data:
       words = line.split()
       if len(words) >= self.lookback_count: # Not interested in lines too short to create productions
         user_tuples = self.processLineWords(words, user_tuples)
 
-    return (nick, user_tuples)
+    return user_tuples
+
+
+  # Pack the counts gathered for each lookback, starter and URL into compact tables
+  def buildTables(self, user_tuples):
+
+    self.fitVocabulary()
+    all_lookbacks = TransitionTable.fromLookbacks(self.lookback_states, user_tuples.all_lookbacks)
+    starters = CountedSequence.fromCounts(user_tuples.starters, self.lookback_count)
+    urls = CountedSequence.fromCounts(user_tuples.urls)
+
+    url_counts = {}
+    for (lookback, counts) in user_tuples.closing_lookbacks.iteritems():
+      url_counts[self.lookback_states.findLookback(lookback)] = counts
+
+    return UserTuples(all_lookbacks, self.buildClosing(all_lookbacks, url_counts), starters, urls)
+
+
+  # Pack the lookback states wide if the vocabulary has outgrown their keys, before any more lookbacks are packed
+  def fitVocabulary(self):
+
+    if not self.lookback_states.packer.fits(len(self.vocabulary)):
+      self.lookback_states.widen()
+
+
+  # Return a map of each opener to an overlay of the successors in a table that close it, along with any of the URLs
+  #  counted by lookback state in url_counts
+  def buildClosing(self, all_lookbacks, url_counts={}):
+    return ClosingOverlay.fromTable(all_lookbacks, config.OPENERS_TO_CLOSERS.keys(), self.classifier.getClosers(), \
+      SpecialToken.URL, url_counts)
 
 
   def processLineWords(self, words, user_tuples):
 
     all_lookbacks = user_tuples.all_lookbacks
-    closing_lookbacks = user_tuples.closing_lookbacks
+    closing_urls = user_tuples.closing_lookbacks
     starters = user_tuples.starters
     urls = user_tuples.urls
 
+    # Each word is interned once, and then classified by id, so that each distinct token is only examined once
+    ids = [self.vocabulary.getOrCreateId(word) for word in words]
+    self.classifier.update()
+    url_ids = self.classifier.urls
+    closers = self.classifier.closers
+
     starter_words = []
-    for word in (words[0:self.lookback_count]):
-      if GeneratorUtil.isUrl(word):
-        urls.append(word)
+    for ident in ids[0:self.lookback_count]:
+      if ident in url_ids:
+        GeneratorUtil.countWithCreate(urls, ident)
         starter_words.append(SpecialToken.URL)
       else:
-        starter_words.append(word)
+        starter_words.append(ident)
 
     starter = tuple(starter_words)
-    starters.append(starter)
+    GeneratorUtil.countWithCreate(starters, starter)
 
     lookback = starter
 
     bound = len(words) - self.lookback_count
     for i in range(0, bound):
 
-      follow_index = i + self.lookback_count
-      follow = words[follow_index]
+      follow = ids[i + self.lookback_count]
 
-      last_index = Generator.getLastIndexBeforeEndingPunctuation(follow)
-      last = follow[last_index]
-
-      # Add some tuples to specific closing pools
-      if not GeneratorUtil.isParenthesisException(follow) and last in config.CLOSERS_TO_OPENERS:
-        opener = config.CLOSERS_TO_OPENERS[last]
-        GeneratorUtil.appendNonTerminalWithCreate(closing_lookbacks[opener], lookback, follow)
-
-      if GeneratorUtil.isUrl(follow):
-        urls.append(follow)
+      if follow in url_ids:
+        GeneratorUtil.countWithCreate(urls, follow)
+        if follow in closers:
+          GeneratorUtil.countNonTerminalWithCreate(closing_urls, lookback, follow)
         follow = SpecialToken.URL
 
       # Add all tuples to the generic pool
-      GeneratorUtil.appendNonTerminalWithCreate(all_lookbacks, lookback, follow)
+      GeneratorUtil.countNonTerminalWithCreate(all_lookbacks, lookback, follow)
 
       list_lookback = list(lookback[1:self.lookback_count])
       list_lookback.append(follow)
       lookback = tuple(list_lookback)
 
-    last_lookback = tuple(words[bound:])
-    GeneratorUtil.appendTerminalWithCreate(all_lookbacks, last_lookback)
-
-    return UserTuples(all_lookbacks, closing_lookbacks, starters, urls)
-
-
-  @staticmethod
-  def getLastIndexBeforeEndingPunctuation(word):
-
-    i = len(word) - 1
-    while i >= 0 and word[i] in config.WORD_ENDING_PUNCTUATION:
-      i -= 1
+    last_lookback = tuple(ids[bound:])
+    GeneratorUtil.countTerminalWithCreate(all_lookbacks, last_lookback)
 
-    return i
+    return UserTuples(all_lookbacks, closing_urls, starters, urls)
 
 
   @staticmethod
@@ -295,14 +752,35 @@ class Generator:
       GenericStatisticType.DATE_GENERATED: Generator.getFirstOrNone(self.meta.get(config.META_DATE)),
       GenericStatisticType.SOURCE_CHANNELS: SourceChannelNames(channel_primary, channel_additionals),
       GenericStatisticType.BIGGEST_USERS: self.users.getBiggestUsers(),
-      GenericStatisticType.MOST_QUOTED_USERS: self.users.getMostQuoted()
+      GenericStatisticType.MOST_QUOTED_USERS: self.users.getMostQuoted(),
+      GenericStatisticType.MODEL_CACHE: self.users.getModelCacheStatistics(),
+      GenericStatisticType.MERGED_CACHE: self.merged_cache.getStatistics(),
+      GenericStatisticType.QUOTE_POOL: self.getQuotePoolStatistics(),
     }
 
 
+  def getQuotePoolStatistics(self):
+
+    if self.quote_pool is None:
+      return None
+
+    return self.quote_pool.getStatistics()
+
+
   def getUserStatistics(self, nick):
     return self.users.getUserStatistics(nick)
 
 
+  # Return the token that a successor is held as in the tables, which is the URL token for a URL closing a parenthesis;
+  #  any successor has been cleaned for output already, so the classifier knows it
+  def getHeldToken(self, token):
+
+    if token in self.classifier.urls:
+      return SpecialToken.URL
+
+    return token
+
+
   @staticmethod
   def substituteIfUrl(token, urls):
 
@@ -312,115 +790,179 @@ class Generator:
     return random.choice(urls)
 
 
+  # Return the text of a token id as it is to be output, substituting a URL from the pool for the URL placeholder,
+  #  and keeping track of open parentheses
+  def getCleanedWord(self, token, urls, openers):
+    return self.classifier.cleanWord(Generator.substituteIfUrl(token, urls), openers)
+
+
   # Return a line generated from a given lookback collection and a given initial pair
-  def generateFromInitial(self, user_tuples, initial):
+  def generateFromInitial(self, user_tuples, initial, order=None):
+    return " ".join(self.iterateFromInitial(user_tuples, initial, order))
 
-    openers = []
 
-    first_word = Generator.substituteIfUrl(initial[0], user_tuples.urls)
-    line = Generator.getCleanedWord(first_word, openers)
+  # Return the number of preceding words to choose each next word by: the lookback length unless fewer are asked for
+  def getOrder(self, order):
 
-    for word in initial[1:]:
-      word = Generator.substituteIfUrl(word, user_tuples.urls)
-      line += ' ' + Generator.getCleanedWord(word, openers)
+    if not order:
+      return self.lookback_count
 
-    # FIXME: this should not be possible; maybe do something else here?
-    if not initial in user_tuples.all_lookbacks:
-      return line
+    return max(1, min(order, self.lookback_count))
 
-    line += self.createLine(user_tuples, initial, openers)
 
-    # Close any remaining open parentheses
-    while openers:
-      line += config.OPENERS_TO_CLOSERS[openers.pop()]
+  # Yield the words of a line generated from a given lookback collection and a given initial pair, as they are
+  #  generated; any parentheses still open at the end are closed on the last word
+  def iterateFromInitial(self, user_tuples, initial, order=None):
 
-    return line
+    openers = []
+    words = self.iterateWords(user_tuples, initial, openers, self.getOrder(order))
 
+    # Hold each word back until the next is known, so that the last can be closed off
+    last_word = next(words)
+    for word in words:
+      yield last_word
+      last_word = word
 
-  def createLine(self, user_tuples, initial, openers):
+    # FIXME: this should not be possible; maybe do something else here?
+    if initial in user_tuples.all_lookbacks:
 
-    line = ""
-    i = self.lookback_count
-    follow = ""
-    current_tuple = initial
+      # Close any remaining open parentheses
+      while openers:
+        last_word += config.OPENERS_TO_CLOSERS[openers.pop()]
 
-    while current_tuple in user_tuples.all_lookbacks and i < config.OUTPUT_WORDS_MAX and follow != SpecialToken.TERMINATE:
+    yield last_word
 
-      follow_token = Generator.getFollow(user_tuples, current_tuple, openers)
-      follow = Generator.substituteIfUrl(follow_token, user_tuples.urls)
 
-      if follow_token != SpecialToken.TERMINATE:
-        line += ' ' + Generator.getCleanedWord(follow, openers)
+  # Yield the cleaned words of a line, keeping track of open parentheses as we go
+  def iterateWords(self, user_tuples, initial, openers, order):
 
-        current_list = list(current_tuple[1:self.lookback_count])
-        current_list.append(follow_token)
-        current_tuple = tuple(current_list)
-        i += 1
+    for token in initial:
+      yield self.getCleanedWord(token, user_tuples.urls, openers)
 
-    return line
+    if not initial in user_tuples.all_lookbacks:
+      return
 
+    for word in self.iterateLine(user_tuples, initial, openers, order):
+      yield word
 
-  @staticmethod
-  def getFollow(user_tuples, current_tuple, openers):
+
+  # Walking a single table at full order, each step follows the edge taken to the row of the next lookback; otherwise,
+  #  or once an edge leads to a lookback the table does not hold, each lookback is looked up as it comes, by its
+  #  packed key, which is shifted along as each word is added
+  def iterateLine(self, user_tuples, initial, openers, order):
+
+    i = self.lookback_count
 
     lookbacks = user_tuples.all_lookbacks
-    closing_lookbacks = user_tuples.closing_lookbacks
+    packer = lookbacks.lookback_states.packer
+    current_key = packer.pack(initial)
 
-    current_opener = None
-    if openers:
-      current_opener = openers[-1]
+    row = None
+    if order == self.lookback_count and isinstance(lookbacks, TransitionTable):
+      row = lookbacks.findRow(initial)
 
-    if current_opener and current_tuple in closing_lookbacks[current_opener]:
-      lookbacks = closing_lookbacks[current_opener]
+    while i < config.OUTPUT_WORDS_MAX:
 
-    next_follow = random.choice(lookbacks[current_tuple])
+      # A row with a single successor starts a run, which is taken whole; as that successor is also the only one that
+      #  could close a parenthesis there, the closing successors make no difference along it, unless it is the URL
+      #  token standing for a URL that closes the parenthesis open
+      if row is not None and lookbacks.runs[row] != NO_ROW and \
+        not (openers and user_tuples.closing_lookbacks[openers[-1]].url_entries):
 
-    return next_follow
+        start = lookbacks.runs[row]
+        position = start
+        follow = lookbacks.run_successors[position]
 
+        while follow != RUN_END:
 
-  @staticmethod
-  def getCleanedWord(word, openers):
+          if follow == SpecialToken.TERMINATE or i >= config.OUTPUT_WORDS_MAX:
+            return
 
-    Generator.addNewOpeners(word, openers)
-    matched_end_index = Generator.removeMatchedOpeners(word, openers)
-    cleaned_word = Generator.removeUnmatchedClosers(word, matched_end_index)
+          yield self.getCleanedWord(follow, user_tuples.urls, openers)
 
-    return cleaned_word
+          i += 1
+          position += 1
+          follow = lookbacks.run_successors[position]
 
+        next_row = lookbacks.run_successors[position+1]
+        if next_row == NO_ROW:
+          current_key = lookbacks.getKey(row)
+          for token in lookbacks.run_successors[start:position]:
+            current_key = packer.shift(current_key, token)
+          row = None
+        else:
+          row = next_row
 
-  @staticmethod
-  def addNewOpeners(word, openers):
+        continue
 
-    if not word in config.PARENTHESIS_EXCEPTIONS:
+      if row is None:
+        follow = Generator.getFollow(user_tuples, current_key, openers, order)
+      else:
+        (edge, follow) = Generator.getFollowEdge(user_tuples, row, openers)
+
+      if follow is None or follow == SpecialToken.TERMINATE:
+        break
+
+      yield self.getCleanedWord(follow, user_tuples.urls, openers)
 
-      i = 0
-      while i < len(word) and word[i] in config.OPENERS_TO_CLOSERS:
+      if row is None:
+        current_key = packer.shift(current_key, self.getHeldToken(follow))
 
-        openers.append(word[i])
-        i += 1
+      # Such as after a URL ending a line, whose terminal count went to the lookback holding the URL itself
+      elif lookbacks.next_rows[edge] == NO_ROW:
+        current_key = packer.shift(lookbacks.getKey(row), lookbacks.successors[edge])
+        row = None
+
+      else:
+        row = lookbacks.next_rows[edge]
 
+      i += 1
 
+
+  # As getFollow, for a lookback at full order whose row in the table is known, returning the edge taken along with
+  #  the successor; a URL closing a parenthesis is returned as itself, on the edge of the URL token
   @staticmethod
-  def removeMatchedOpeners(word, openers):
+  def getFollowEdge(user_tuples, row, openers):
 
-    i = Generator.getLastIndexBeforeEndingPunctuation(word)
-    while i >= 0 and len(openers) > 0 and word[i] == config.OPENERS_TO_CLOSERS[openers[-1]]:
+    if openers:
+      closing = user_tuples.closing_lookbacks[openers[-1]]
+      closing_row = closing.findOverlayRow(row)
+      if closing_row is not None:
+        return closing.sampleEdge(closing_row)
 
-      openers.pop()
-      i -= 1
+    edge = user_tuples.all_lookbacks.sampleEdge(row)
 
-    return i + 1
+    return (edge, user_tuples.all_lookbacks.successors[edge])
 
 
+  # Return a successor to the last few words of a packed lookback, as many as the order asks for, or fewer if those
+  #  have not been seen together; return None if not even the last word has been seen with anything after it
+  # All tables share their states, so the lookback's state is found once for every table it is looked up in
   @staticmethod
-  def removeUnmatchedClosers(word, matched_end_index):
+  def getFollow(user_tuples, current_key, openers, order):
+
+    lookbacks = user_tuples.all_lookbacks
+    state = lookbacks.lookback_states.getId(current_key)
+
+    # While a parenthesis is open, the successors that close it are preferred
+    if openers and state is not None:
+      follow = user_tuples.closing_lookbacks[openers[-1]].sampleState(state)
+      if follow is not None:
+        return follow
+
+    if order == lookbacks.lookback_count and state is not None:
+      follow = lookbacks.sampleState(state)
+      if follow is not None:
+        return follow
 
-    core_end_index = matched_end_index - 1
-    if not word[:matched_end_index] in config.PARENTHESIS_EXCEPTIONS:
-      while core_end_index in xrange(0, len(word)) and word[core_end_index] in config.CLOSERS_TO_OPENERS:
-        core_end_index -= 1
+    # Back off to ever shorter suffixes, rather than ending the line
+    current_tuple = lookbacks.lookback_states.packer.unpack(current_key)
+    for length in xrange(min(order, lookbacks.lookback_count - 1), 0, -1):
+      follow = lookbacks.sampleSuffix(current_tuple[-length:])
+      if follow is not None:
+        return follow
 
-    return word[:core_end_index+1] + word[matched_end_index:]
+    return None
 
 
   def getTuplesForUser(self, nick):
@@ -433,91 +975,93 @@ class Generator:
     return UserTuples(all_lookbacks, closing_lookbacks, starters, urls)
 
 
+  # Return a read-only view combining several users' tuples, without copying any of them
   @staticmethod
-  def copyTuples(user_tuples):
+  def combineTuples(users_tuples, weights=None):
 
-    new_starters = list(user_tuples.starters)
-    new_all_lookbacks = GeneratorUtil.copyListDict(user_tuples.all_lookbacks)
-    new_closing_lookbacks = {}
-    for opener in config.OPENERS_TO_CLOSERS:
-      new_closing_lookbacks[opener] = GeneratorUtil.copyListDict(user_tuples.closing_lookbacks[opener])
-    new_urls = list(user_tuples.urls)
-
-    return UserTuples(new_all_lookbacks, new_closing_lookbacks, new_starters, new_urls)
+    all_lookbacks = UnionTable([user_tuples.all_lookbacks for user_tuples in users_tuples], weights)
 
+    closing_lookbacks = {}
+    for opener in config.OPENERS_TO_CLOSERS:
+      closing_lookbacks[opener] = UnionTable([user_tuples.closing_lookbacks[opener] for user_tuples in users_tuples], \
+        weights)
 
-  def mergeAdditionalUserData(self, further_nicks, first_user_tuples):
+    starters = UnionSequence([user_tuples.starters for user_tuples in users_tuples], weights)
+    urls = UnionSequence([user_tuples.urls for user_tuples in users_tuples], weights)
 
-    all_lookbacks = first_user_tuples.all_lookbacks
-    closing_lookbacks = first_user_tuples.closing_lookbacks
-    starters = first_user_tuples.starters
-    urls = first_user_tuples.urls
+    return UserTuples(all_lookbacks, closing_lookbacks, starters, urls)
 
-    for other_nick in further_nicks:
 
-      other_user_tuples = self.getTuplesForUser(other_nick)
+  # Get lookback and starting tuples for users known to exist
+  # Several users are combined, optionally weighted by a map of nicks to positive integer weights (1 by default);
+  #  their tables are merged if the combination has been requested often enough, or if merging is forced
+  def getTuples(self, nicks, weights=None, force_merge=False):
 
-      GeneratorUtil.mergeIntoDictionary(all_lookbacks, other_user_tuples.all_lookbacks)
+    if len(nicks) == 1:
+      return self.getTuplesForUser(nicks[0])
 
-      for opener in config.OPENERS_TO_CLOSERS:
-        GeneratorUtil.mergeIntoDictionary(closing_lookbacks[opener], \
-          other_user_tuples.closing_lookbacks[opener])
+    user_weights = [1] * len(nicks)
+    if weights:
+      user_weights = [weights.get(nick, 1) for nick in nicks]
 
-      starters += list(other_user_tuples.starters)
-      urls += list(other_user_tuples.urls)
+    # Combinations requested often enough are merged into tables of their own, which are quicker to sample from
+    key = tuple(sorted(zip(nicks, user_weights)))
+    merged_tuples = self.merged_cache.get(key, lambda: self.mergeTuples(self.getTuplesForUsers(nicks), user_weights), \
+      lambda: Generator.countMergedBytesMin(self.getTuplesForUsers(nicks)), force_merge)
+    if merged_tuples:
+      return merged_tuples
 
-    return UserTuples(all_lookbacks, closing_lookbacks, starters, urls)
+    return Generator.combineTuples(self.getTuplesForUsers(nicks), user_weights)
 
 
-  # Get lookback and starting tuples for users known to exist
-  def getTuples(self, nicks):
+  def getTuplesForUsers(self, nicks):
+    return [self.getTuplesForUser(nick) for nick in nicks]
 
-    # Take lookbacks from first user initially
-    first_nick = nicks[0]
-    user_tuples = self.getTuplesForUser(first_nick)
 
-    # If we have more than one nick, we will be constructing new lookback maps
-    #  and starter list, so we will want copies
-    if len(nicks) > 1:
-      user_tuples = Generator.copyTuples(user_tuples)
-      user_tuples = self.mergeAdditionalUserData(nicks[1:], user_tuples)
+  # Return several users' tuples with their tables merged, along with the number of bytes in those tables
+  def mergeTuples(self, users_tuples, weights):
 
-    return user_tuples
+    combined_tuples = Generator.combineTuples(users_tuples, weights)
 
+    all_lookbacks = TransitionTable.merge(combined_tuples.all_lookbacks.tables, weights)
+    size = all_lookbacks.countBytes()
 
-  @staticmethod
-  def partialTupleMatches(partial, tup):
+    url_counts = ClosingOverlay.mergeUrlCounts([user_tuples.closing_lookbacks for user_tuples in users_tuples], weights)
+    closing_lookbacks = self.buildClosing(all_lookbacks, url_counts)
+    for closing in closing_lookbacks.itervalues():
+      size += closing.countBytes()
 
-    for i in range(0, len(partial)):
-      if partial[i] != tup[i]:
-        return False
+    # The lists are left as views, as they are small and cheap to sample from anyway
+    merged_tuples = UserTuples(all_lookbacks, closing_lookbacks, combined_tuples.starters, combined_tuples.urls)
 
-    return True
+    return (merged_tuples, size)
 
 
-  # Return tuples whose first element matches a given one
+  # Return the fewest bytes that several users' tables could take up merged; those hold every lookback and successor
+  #  of each user's, so take up at least as many as the biggest
   @staticmethod
-  def findMatchingTuples(first, tuples):
-
-    matches = []
-
-    for tup in tuples:
-      if Generator.partialTupleMatches(first, tup):
-        matches.append(tup)
-
-    return matches
+  def countMergedBytesMin(users_tuples):
+    return max([user_tuples.all_lookbacks.countBytes() for user_tuples in users_tuples])
 
 
+  # Return an initial lookback tuple of token ids, either from the given seed words or from the starters
   def makeInitial(self, lookbacks, starters, given_initial):
 
     initial = given_initial
 
     if given_initial:
 
+      # Seed words that are not in the vocabulary cannot match anything
+      given_initial = self.vocabulary.getIds(given_initial)
+      if given_initial is None:
+        return None
+      initial = given_initial
+
+      # Matching lookbacks are found through the table's index, rather than by checking every one
       if len(given_initial) < self.lookback_count:
-        matching_tuples = Generator.findMatchingTuples(given_initial, lookbacks)
-        if matching_tuples:
-          initial = random.choice(matching_tuples)
+        matching_tuple = lookbacks.choosePrefix(given_initial)
+        if matching_tuple:
+          initial = matching_tuple
 
       # If the initial is not present, then a quote cannot be formed from it
       if not initial in lookbacks:
@@ -529,19 +1073,320 @@ class Generator:
     return initial
 
 
-  def generate(self, nick_tuples, initial=None, random_min_starters=0, increment_quote_count=True):
+  # Return the initial lookback tuples of token ids that quotes may start from, as makeInitial would choose among them,
+  #  or None if there are none
+  def getInitials(self, lookbacks, starters, given_initial):
+
+    if not given_initial:
+      return starters
+
+    initial = self.vocabulary.getIds(given_initial)
+    if initial is None:
+      return None
+
+    if len(initial) < self.lookback_count:
+      return lookbacks.findPrefix(initial) or None
+
+    if not initial in lookbacks:
+      return None
+
+    return [initial]
+
+
+  # Quotes may be generated with each word chosen by fewer preceding words (the order) than the lookback length
+  def generate(self, nick_tuples, initial=None, random_min_starters=0, increment_quote_count=True, weights=None, \
+    order=None):
+
+    pooled = self.popPooled(nick_tuples, initial, random_min_starters, increment_quote_count, weights, order)
+    if pooled:
+      return pooled
+
+    (real_nicks, words) = self.generateWords(nick_tuples, initial, random_min_starters, increment_quote_count, weights, \
+      order)
+
+    return (real_nicks, " ".join(words))
+
+
+  # Return the pool key for a request that a quote generated ahead of time could answer, or None if there is none
+  # Only plain requests for a single user, or for a single random user, can be answered from a pool
+  def getPoolKey(self, nick_tuples, initial, random_min_starters, weights, order):
+
+    if self.quote_pool is None or initial or weights or order or len(nick_tuples) != 1:
+      return None
+
+    (nick_type, nick) = nick_tuples[0]
+    if nick_type == UserNickType.RANDOM:
+      return (UserNickType.RANDOM, random_min_starters)
+
+    if not self.users.containsByAlias(nick):
+      return None
+
+    return self.users.getByAlias(nick).nick
+
+
+  # Pools for random requests are keyed by (random type, minimum starter count), and those for users by nick
+  @staticmethod
+  def isRandomPoolKey(key):
+    return isinstance(key, tuple)
+
+
+  # Return a (nicks, quote) pair generated ahead of time for a request, or None if there is none ready
+  def popPooled(self, nick_tuples, initial, random_min_starters, increment_quote_count, weights, order):
+
+    key = self.getPoolKey(nick_tuples, initial, random_min_starters, weights, order)
+    if key is None:
+      return None
+
+    if Generator.isRandomPoolKey(key):
+      self.pool_random_keys.add(key)
+      self.quote_pool.addKey(key)
+
+    pooled = self.quote_pool.pop(key)
+    if not pooled:
+      return None
+
+    # A user requested by name is counted as usual
+    if not Generator.isRandomPoolKey(key):
+      self.users.getRealNicks(nick_tuples, random_min_starters, increment_quote_count)
+
+    return pooled
+
+
+  # Top up the pools of ready quotes by up to a given number of quotes in all, emptiest first; return the number added
+  # Pools are kept for the users requested most often at the time, and for each kind of random request seen
+  # Pools are only refilled from users whose tables are already loaded; loading others would evict those in use
+  def refillPools(self, count):
+
+    if self.quote_pool is None:
+      return 0
+
+    hot_nicks = self.users.getMostQuotedNicks(config.QUOTE_POOL_USERS)
+    self.quote_pool.setKeys(hot_nicks + list(self.pool_random_keys))
+
+    added = 0
+    for (key, shortfall) in self.quote_pool.findShortfalls():
+
+      if added >= count:
+        break
+
+      if not self.isPoolRefillable(key):
+        continue
+
+      for (nicks, quote) in self.generatePoolQuotes(key, min(shortfall, count - added)):
+        self.quote_pool.push(key, nicks, quote)
+        added += 1
+
+    return added
+
+
+  # A random user may be any user, so random pools can only be refilled when no users are loaded on demand
+  def isPoolRefillable(self, key):
+
+    if Generator.isRandomPoolKey(key):
+      return not self.users.lazy
+
+    return self.users.isResident(key)
+
+
+  # Return up to a given number of (nicks, quote) pairs for a pool; random users are drawn afresh for each quote
+  def generatePoolQuotes(self, key, count):
+
+    pairs = []
+
+    if Generator.isRandomPoolKey(key):
+      for i in xrange(0, count):
+        (nicks, words) = self.generateWords([(UserNickType.RANDOM, "")], None, key[1], False)
+        quote = " ".join(words)
+        if quote:
+          pairs.append((nicks, quote))
+
+    else:
+      (nicks, quotes) = self.generateBatch([(UserNickType.NONRANDOM, key)], count, False, None, 0, False, None, None)
+      pairs = [(nicks, quote) for quote in quotes if quote]
+
+    return pairs
+
+
+  # As generate, but return an iterator over the words of the quote instead of the quote itself, so that long quotes
+  #  can be passed on as they are generated
+  def generateWords(self, nick_tuples, initial=None, random_min_starters=0, increment_quote_count=True, weights=None, \
+    order=None):
 
     real_nicks = self.users.getRealNicks(nick_tuples, random_min_starters, increment_quote_count)
     if not real_nicks:
-      return ([], "")
+      return ([], iter([]))
 
-    user_tuples = self.getTuples(real_nicks)
+    user_tuples = self.getTuples(real_nicks, weights)
 
     initial = self.makeInitial(user_tuples.all_lookbacks, user_tuples.starters, initial)
     if not initial:
-      return ([], "")
+      return ([], iter([]))
+
+    return (real_nicks, self.iterateFromInitial(user_tuples, initial, order))
+
+
+  # Return up to a given number of quotes from the same users, resolving and merging their tables only once
+  # Any random users are chosen once for the whole batch; if a seed is given, the batch is reproducible
+  # If only unique quotes are wanted, fewer may be returned, as we give up after a certain number of attempts
+  def generateMany(self, nick_tuples, count, seed=None, unique=False, initial=None, random_min_starters=0, \
+    increment_quote_count=True, weights=None, order=None):
+
+    random_state = None
+    if seed is not None:
+      random_state = random.getstate()
+      random.seed(seed)
+
+    try:
+      return self.generateBatch(nick_tuples, count, unique, initial, random_min_starters, increment_quote_count, weights, \
+        order)
+
+    finally:
+      if random_state is not None:
+        random.setstate(random_state)
+
+
+  def generateBatch(self, nick_tuples, count, unique, initial, random_min_starters, increment_quote_count, weights, order):
+
+    real_nicks = self.users.getRealNicks(nick_tuples, random_min_starters, increment_quote_count)
+    if not real_nicks:
+      return ([], [])
+
+    user_tuples = self.getTuples(real_nicks, weights, force_merge=True)
+
+    initials = self.getInitials(user_tuples.all_lookbacks, user_tuples.starters, initial)
+    if not initials:
+      return ([], [])
+
+    quotes = []
+    seen = set()
+    attempts = count
+    if unique:
+      attempts = count * config.GENERATE_MANY_ATTEMPTS_FACTOR
+
+    while len(quotes) < count and attempts > 0:
+
+      batch_count = min(count - len(quotes), attempts)
+      attempts -= batch_count
+
+      for quote in self.generateQuotes(user_tuples, initials, batch_count, self.getOrder(order)):
+
+        if unique:
+          if quote in seen:
+            continue
+          seen.add(quote)
+
+        quotes.append(quote)
+
+    return (real_nicks, quotes)
+
+
+  # Return a number of quotes, each from one of the given initial tuples; big enough batches are walked in lockstep
+  def generateQuotes(self, user_tuples, initials, count, order):
+
+    if count >= config.LOCKSTEP_MIN_QUOTES and order == self.lookback_count and LockstepEngine.canWalk(user_tuples):
+      return self.lockstep.generate(user_tuples, initials, count)
+
+    return [self.generateFromInitial(user_tuples, random.choice(initials), order) for i in xrange(0, count)]
+
+
+# Merge the counts of the chunks of a source, each counted against a vocabulary of its own, into counts against
+#  ours, for Generator.processSourcesParallel; this runs in a worker process, so it must be a module-level function
+# Each chunk comes with a list mapping the ids of its tokens to ours, and the merged counts go back as the words of
+#  the packed key of each lookback, in order, followed by the flattened counts of their successors; the few counts of
+#  closing URLs go back as they are, by lookback
+def mergeSourceCounts(task):
+
+  (lookback_count, wide, chunks) = task
+  packer = KeyPacker(lookback_count, wide)
+
+  counts_by_key = {}
+  closing_urls = {}
+  starters = {}
+  urls = {}
+
+  for (ids, counted) in chunks:
+
+    (tokens, offsets, successors, counts) = GeneratorUtil.loadArrays(counted.all_lookbacks)
+
+    for row in xrange(0, len(offsets) - 1):
+
+      start = row * lookback_count
+      key = packer.pack([ids[token] for token in tokens[start:start + lookback_count]])
+      successor_counts = counts_by_key.setdefault(key, {})
+
+      for edge in xrange(offsets[row], offsets[row + 1]):
+        successor = ids[successors[edge]]
+        successor_counts[successor] = successor_counts.get(successor, 0) + counts[edge]
+
+    for (lookback, url_counts) in counted.closing_lookbacks.iteritems():
+      merged_counts = closing_urls.setdefault(tuple([ids[token] for token in lookback]), {})
+      for (url, count) in url_counts.iteritems():
+        GeneratorUtil.countWithCreate(merged_counts, ids[url], count)
+
+    for (starter, count) in counted.starters.iteritems():
+      GeneratorUtil.countWithCreate(starters, tuple([ids[token] for token in starter]), count)
+
+    for (url, count) in counted.urls.iteritems():
+      GeneratorUtil.countWithCreate(urls, ids[url], count)
+
+  keys = sorted(counts_by_key)
+  key_words = packer.dumpKeys(packer.createKeys(keys))
+  lookback_counts = [key_words] + TransitionTable.flattenCounts([counts_by_key[key] for key in keys])
+
+  starters = CountedSequence.fromCounts(starters, lookback_count)
+  urls = CountedSequence.fromCounts(urls)
+
+  return (GeneratorUtil.dumpArrays(lookback_counts), closing_urls, \
+    GeneratorUtil.dumpArrays([starters.items, starters.bounds]), GeneratorUtil.dumpArrays([urls.items, urls.bounds]))
+
+
+# Build the arrays of a table, its suffix index and its closing overlays from a source's merged counts and the ids of
+#  its lookback states, for Generator.processSourcesParallel; this runs in a worker process, so it must be a
+#  module-level function
+def buildTableArrays(task):
+
+  (lookback_count, wide, lookback_counts, states, openers, closers, url_counts) = task
+  packer = KeyPacker(lookback_count, wide)
+
+  (key_words, offsets, successors, counts) = GeneratorUtil.loadArrays(lookback_counts)
+  keys = packer.loadKeys(key_words)
+  states = GeneratorUtil.loadArrays(states)[0]
+
+  (table_arrays, index_arrays) = TransitionTable.buildArrays(packer, states, keys, offsets, successors, counts)
+  fields = dict(zip([name for (name, _) in TransitionTable.ARRAY_FIELDS], table_arrays))
+  url_edges = ClosingOverlay.findUrlEdges(fields["states"], fields["offsets"], fields["successors"], SpecialToken.URL, \
+    url_counts)
+  closing_arrays = ClosingOverlay.buildArrays(fields["offsets"], fields["successors"], openers, closers, url_edges)
+
+  dumped_closing = {}
+  for (opener, arrays) in closing_arrays.iteritems():
+    dumped_closing[opener] = GeneratorUtil.dumpArrays(arrays)
+
+  index_arrays = SuffixIndex(packer, *index_arrays).getArrays()
+
+  return (GeneratorUtil.dumpArrays(table_arrays), GeneratorUtil.dumpArrays(index_arrays), dumped_closing)
+
+
+# Count the productions in a range of a source file, for Generator.processSourcesParallel; this runs in a worker
+#  process, so it must be a module-level function
+# The counts of lookbacks go back as arrays of the tokens of each lookback, followed by the flattened counts of their
+#  successors, as those are far quicker to send between processes than maps
+def countSourceChunk(task):
+
+  (lookback_count, source_filepath, start, end) = task
+  generator = Generator(lookback_count, 1)
+
+  infile = open(source_filepath, 'r')
+  infile.seek(start)
+  counted = generator.countSource(GeneratorUtil.readLines(infile, end - start))
+  infile.close()
 
-    quote = self.generateFromInitial(user_tuples, initial)
+  lookbacks = counted.all_lookbacks.keys()
+  tokens = array(INDEX_TYPECODE, [token for lookback in lookbacks for token in lookback])
+  successor_counts_list = [counted.all_lookbacks[lookback] for lookback in lookbacks]
+  lookback_counts = [tokens] + TransitionTable.flattenCounts(successor_counts_list)
 
-    return (real_nicks, quote)
+  dumped = UserTuples(GeneratorUtil.dumpArrays(lookback_counts), counted.closing_lookbacks, counted.starters, \
+    counted.urls)
 
+  return (generator.vocabulary.tokens, dumped)
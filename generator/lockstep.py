@@ -0,0 +1,241 @@
+# Generation of many quotes at once, walking all of their chains together with NumPy
+
+import random
+
+import config
+from transitions import NO_ROW
+from transitions import TransitionTable
+from vocabulary import SpecialToken
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+
+# Each step samples the successors of all chains still going in one go, and follows the edges taken to the rows of
+#  their next lookbacks; only lookbacks reached by backing off are searched for
+# Most quotes are made up of plain words, which are output as they are; a chain is only followed word by word once it
+#  produces a word with parentheses to match (which may steer it into a closing table) or a URL to substitute
+class LockstepEngine:
+
+  def __init__(self, generator):
+
+    self.generator = generator
+    self.classifier = None
+    self.plain = None # Whether each token id is output as it is, with nothing to match or substitute
+
+
+  # Whether a batch from these tables can be generated in lockstep; this needs NumPy, tables that are not views, and
+  #  keys that fit in 64-bit integers
+  @staticmethod
+  def canWalk(user_tuples):
+
+    if numpy is None or not isinstance(user_tuples.all_lookbacks, TransitionTable):
+      return False
+
+    return not user_tuples.all_lookbacks.lookback_states.packer.wide
+
+
+  # The vocabulary only ever grows, so only tokens added since the last batch need checking
+  def updatePlain(self):
+
+    if self.generator.classifier is not self.classifier:
+      self.classifier = self.generator.classifier
+      self.plain = numpy.zeros(0, dtype=bool)
+
+    self.classifier.update()
+    tokens = self.classifier.vocabulary.tokens
+
+    start = len(self.plain)
+    if start == len(tokens):
+      return
+
+    marks = self.classifier.marks
+    plain = [tokens[ident] is not None and not ident in marks for ident in xrange(start, len(tokens))]
+
+    self.plain = numpy.concatenate([self.plain, numpy.array(plain, dtype=bool)])
+
+
+  # Return a given number of quotes, each started from one of the given initial lookbacks of token ids
+  def generate(self, user_tuples, initials, count):
+
+    self.updatePlain()
+
+    table = user_tuples.all_lookbacks
+    table.lookback_states.commit()
+    walk = LockstepWalk(table, numpy.random.RandomState(random.getrandbits(32)))
+    chosen = [random.choice(initials) for i in xrange(0, count)]
+    steps_max = max(0, config.OUTPUT_WORDS_MAX - table.lookback_count)
+
+    current = numpy.array([table.lookback_states.packer.pack(initial) for initial in chosen], dtype=numpy.uint64)
+    follows = numpy.zeros((count, steps_max), dtype=walk.successors.dtype)
+    lengths = numpy.zeros(count, dtype=numpy.int64)
+    current_rows = walk.findRows(current)
+    walked = current_rows != NO_ROW
+
+    # Chains followed word by word, with their cleaned words and open parentheses so far
+    is_slow = numpy.zeros(count, dtype=bool)
+    slow = {}
+    for chain in xrange(0, count):
+      if not all([self.plain[token] for token in chosen[chain]]):
+        is_slow[chain] = True
+        slow[chain] = self.startWords(user_tuples, chosen[chain], [])
+
+    # Chains whose initial lookback has not been seen are not walked at all
+    active = numpy.flatnonzero(walked)
+
+    for step in xrange(0, steps_max):
+
+      if not active.size:
+        break
+
+      rows = current_rows[active]
+      found = rows != NO_ROW
+
+      edges = numpy.full(len(active), -1, dtype=numpy.int64)
+      edges[found] = walk.sampleEdges(rows[found])
+
+      follow = numpy.full(len(active), SpecialToken.TERMINATE, dtype=walk.successors.dtype)
+      follow[found] = walk.successors[edges[found]]
+
+      # Other chains whose lookback has not been seen back off to shorter ones, as in the scalar walk
+      for position in numpy.flatnonzero(~found):
+        chain = active[position]
+        openers = []
+        if is_slow[chain]:
+          openers = slow[chain][1]
+        backed_off = self.generator.getFollow(user_tuples, int(current[chain]), openers, table.lookback_count)
+        if backed_off is not None:
+          follow[position] = backed_off
+
+      # Chains with parentheses open may have to be sampled from among the successors closing them instead; the
+      #  overlays are over this table, so the rows already found can be looked up in them directly
+      # A URL closing a parenthesis is walked on as the URL token that the table holds, but output as itself
+      closing_urls = {}
+      for position in numpy.flatnonzero(is_slow[active] & found):
+        openers = slow[active[position]][1]
+        if openers:
+          closing = user_tuples.closing_lookbacks[openers[-1]]
+          row = closing.findOverlayRow(int(rows[position]))
+          if row is not None:
+            (edges[position], token) = closing.sampleEdge(row)
+            follow[position] = walk.successors[edges[position]]
+            if token != follow[position]:
+              closing_urls[active[position]] = token
+
+      going = follow != SpecialToken.TERMINATE
+      active = active[going]
+      follow = follow[going]
+      edges = edges[going]
+
+      follows[active, step] = follow
+      lengths[active] += 1
+      current[active] = ((current[active] << walk.shift) | follow.astype(numpy.uint64)) & walk.mask
+
+      # Chains that backed off took no edge of the table, so their next lookbacks have to be searched for
+      taken = edges >= 0
+      current_rows[active[taken]] = walk.next_rows[edges[taken]]
+      current_rows[active[~taken]] = walk.findRows(current[active[~taken]])
+
+      # A chain producing its first word that is not plain has only had plain words so far
+      for position in numpy.flatnonzero(~self.plain[follow] & ~is_slow[active]):
+        chain = active[position]
+        is_slow[chain] = True
+        slow[chain] = self.startWords(user_tuples, [], tuple(chosen[chain]) + tuple(follows[chain, :step].tolist()))
+
+      for position in numpy.flatnonzero(is_slow[active]):
+        chain = active[position]
+        (words, openers) = slow[chain]
+        token = closing_urls.get(chain, follow[position])
+        words.append(self.generator.getCleanedWord(token, user_tuples.urls, openers))
+
+    quotes = []
+    tokens = self.classifier.vocabulary.tokens
+
+    for chain in xrange(0, count):
+
+      if is_slow[chain]:
+
+        (words, openers) = slow[chain]
+
+        # Close any remaining open parentheses, unless the chain could not even be started
+        if walked[chain]:
+          while openers:
+            words[-1] += config.OPENERS_TO_CLOSERS[openers.pop()]
+
+        quotes.append(" ".join(words))
+
+      else:
+        chain_tokens = list(chosen[chain]) + follows[chain, :lengths[chain]].tolist()
+        quotes.append(" ".join([tokens[token] for token in chain_tokens]))
+
+    return quotes
+
+
+  # Return the words and open parentheses of a chain to be followed word by word from here on, given the tokens it
+  #  has produced so far that may need cleaning, and those that are known to be plain
+  def startWords(self, user_tuples, tokens, plain_tokens):
+
+    words = self.classifier.vocabulary.getTokens(plain_tokens)
+    openers = []
+
+    for token in tokens:
+      words.append(self.generator.getCleanedWord(token, user_tuples.urls, openers))
+
+    return (words, openers)
+
+
+# The arrays of one table, and the index of the states it shares with others, as seen by a batch walking it
+class LockstepWalk:
+
+  def __init__(self, table, rng):
+
+    self.rng = rng
+
+    # Runs are not taken here, as each step samples the successors of all chains at once anyway
+    arrays = [TransitionTable.toNumPy(arr) for arr in table.getArrays()]
+    (self.states, self.offsets, self.totals, self.successors, _, self.thresholds, self.aliases, self.next_rows, _, _, \
+      _) = arrays
+
+    self.sorted_keys = TransitionTable.toNumPy(table.lookback_states.sorted_keys)
+    self.sorted_ids = TransitionTable.toNumPy(table.lookback_states.sorted_ids)
+
+    self.shift = numpy.uint64(table.lookback_states.packer.token_bits)
+    self.mask = numpy.uint64((1 << (table.lookback_states.packer.token_bits * table.lookback_count)) - 1)
+
+
+  # Return the row of each of the given packed keys, or NO_ROW where there is none; each key is looked up among the
+  #  shared states, and then its state among the table's
+  def findRows(self, keys):
+
+    positions = numpy.searchsorted(self.sorted_keys, keys)
+    found = positions < len(self.sorted_keys)
+    found[found] = self.sorted_keys[positions[found]] == keys[found]
+
+    states = numpy.zeros(len(keys), dtype=self.states.dtype)
+    states[found] = self.sorted_ids[positions[found]]
+
+    rows = numpy.searchsorted(self.states, states)
+    found &= rows < len(self.states)
+    found[found] = self.states[rows[found]] == states[found]
+
+    rows[~found] = NO_ROW
+
+    return rows
+
+
+  # Return an edge for each of the given rows, as TransitionTable.sampleEdge would
+  def sampleEdges(self, rows):
+
+    starts = self.offsets[rows].astype(numpy.int64)
+    widths = self.offsets[rows+1] - starts
+    totals = self.totals[rows]
+
+    edges = starts + (self.rng.random_sample(len(rows)) * widths).astype(numpy.int64)
+    positions = (self.rng.random_sample(len(rows)) * totals).astype(numpy.int64)
+
+    aliased = positions >= self.thresholds[edges]
+    edges[aliased] = starts[aliased] + self.aliases[edges[aliased]]
+
+    return edges
@@ -0,0 +1,180 @@
+# Least-recently-used caches of user tables that are loaded on demand, and of tables merged from several users
+
+from collections import namedtuple
+from collections import OrderedDict
+
+ModelCacheStatistics = namedtuple("ModelCacheStatistics", "model_count, size, budget, hits, misses, evictions")
+
+REQUEST_COUNTS_MAX = 1024 # Number of uncached combinations of users to keep request counts for
+OVERSIZED_KEYS_MAX = 1024 # Number of combinations of users too big to merge to remember
+
+
+class ModelCache:
+
+  def __init__(self, budget):
+
+    self.budget = budget # Number of bytes of tables to keep loaded at most, though the last user loaded is always kept
+    self.users = OrderedDict() # Map of nicks to loaded users, least recently used first
+    self.sizes = {} # Map of nicks to the number of bytes in their tables
+    self.size = 0
+
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+
+  def __len__(self):
+    return len(self.users)
+
+
+  def __contains__(self, nick):
+    return nick in self.users
+
+
+  # Make sure that a user's tables are loaded, unloading those of the least recently used users to stay within budget
+  def load(self, user):
+
+    if user.nick in self.users:
+      self.hits += 1
+      self.users[user.nick] = self.users.pop(user.nick)
+      return
+
+    self.misses += 1
+
+    user.loadModel()
+    size = user.countModelBytes()
+
+    self.users[user.nick] = user
+    self.sizes[user.nick] = size
+    self.size += size
+
+    while self.size > self.budget and len(self.users) > 1:
+      self.evict()
+
+
+  def evict(self):
+
+    (nick, user) = self.users.popitem(last=False)
+    self.size -= self.sizes.pop(nick)
+    user.unloadModel()
+    self.evictions += 1
+
+
+  # Unload a user's tables, so that they will be loaded afresh when next needed
+  def discard(self, nick):
+
+    if nick in self.users:
+      self.size -= self.sizes.pop(nick)
+      self.users.pop(nick).unloadModel()
+
+
+  def getStatistics(self):
+    return ModelCacheStatistics(len(self.users), self.size, self.budget, self.hits, self.misses, self.evictions)
+
+
+# Models are keyed by tuples of (nick, weight) pairs, sorted by nick
+# A model is only built once its key has been requested a given number of times, so that one-off combinations,
+#  which are better served by views onto the users' own tables, do not churn the cache
+# Nor is it built if it would not fit in the budget, as far as can be told beforehand; keys whose models turn out not
+#  to fit are remembered, so that those are never built again, and are left to such views too
+class MergedModelCache:
+
+  def __init__(self, budget, min_requests):
+
+    self.budget = budget # Number of bytes of tables to keep at most
+    self.min_requests = min_requests
+    self.models = OrderedDict() # Map of keys to models, least recently used first
+    self.sizes = {} # Map of keys to the number of bytes in their models' tables
+    self.size = 0
+    self.request_counts = OrderedDict() # Map of keys not cached to the number of times they were requested, least recent first
+    self.oversized = OrderedDict() # Keys of models too big for the budget, least recently requested first
+
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+
+  def __len__(self):
+    return len(self.models)
+
+
+  def __contains__(self, key):
+    return key in self.models
+
+
+  # Return the model for a key, building it by calling a function returning it and its size if the key has now been
+  #  requested often enough (or if forced to); return None if it is not (yet) worth building, or too big to keep
+  # A function returning the fewest bytes the model could take up, if given, is called first, so that models that
+  #  could not fit are not built
+  def get(self, key, build, estimate=None, force=False):
+
+    if key in self.models:
+      self.hits += 1
+      self.models[key] = self.models.pop(key)
+      return self.models[key]
+
+    self.misses += 1
+
+    if key in self.oversized and not force:
+      self.oversized[key] = self.oversized.pop(key)
+      return None
+
+    request_count = self.request_counts.pop(key, 0) + 1
+    if request_count < self.min_requests and not force:
+      self.request_counts[key] = request_count
+      if len(self.request_counts) > REQUEST_COUNTS_MAX:
+        self.request_counts.popitem(last=False)
+      return None
+
+    if estimate and estimate() > self.budget:
+      self.addOversized(key)
+      if not force:
+        return None
+
+    (model, size) = build()
+    if size > self.budget:
+      self.addOversized(key)
+      return model
+
+    self.models[key] = model
+    self.sizes[key] = size
+    self.size += size
+
+    while self.size > self.budget:
+      self.evict()
+
+    return model
+
+
+  def addOversized(self, key):
+
+    self.oversized.pop(key, None)
+    self.oversized[key] = True
+    if len(self.oversized) > OVERSIZED_KEYS_MAX:
+      self.oversized.popitem(last=False)
+
+
+  def evict(self):
+
+    (key, model) = self.models.popitem(last=False)
+    self.size -= self.sizes.pop(key)
+    self.evictions += 1
+
+
+  # Drop every model built from a given user's tables, such as when they have been replaced, and forget what is known
+  #  about building any other including them
+  def invalidate(self, nick):
+
+    for key in self.models.keys():
+      if nick in [key_nick for (key_nick, _) in key]:
+        self.size -= self.sizes.pop(key)
+        del self.models[key]
+
+    for keys in [self.request_counts, self.oversized]:
+      for key in keys.keys():
+        if nick in [key_nick for (key_nick, _) in key]:
+          del keys[key]
+
+
+  def getStatistics(self):
+    return ModelCacheStatistics(len(self.models), self.size, self.budget, self.hits, self.misses, self.evictions)
@@ -0,0 +1,437 @@
+# Versioned binary model files, read back through memory maps without copying
+
+from array import array
+import mmap
+import os
+import struct
+
+import config
+from counted import CountedSequence
+from states import LookbackStates
+from transitions import INDEX_TYPECODE
+from transitions import KEY_TYPECODE
+from transitions import ClosingOverlay
+from transitions import KeyPacker
+from transitions import SuffixIndex
+from transitions import TransitionTable
+from vocabulary import SpecialToken
+from vocabulary import Vocabulary
+
+FORMAT_VERSION = 12 # Increment whenever the layout below changes
+BYTE_ORDER_MARK = 0x01020304 # Arrays are stored in native byte order, so reject files from other platforms
+ALIGNMENT = 8 # Every array starts on a multiple of this
+
+USER_MAGIC = "IMPU"
+VOCABULARY_MAGIC = "IMPV"
+STATES_MAGIC = "IMPS"
+
+# Magic, version, byte order mark, lookback length, words per suffix index key, vocabulary size needed, state count
+#  needed, production count, starter count, nick length, array count
+USER_HEADER = struct.Struct("=4sIIIIQQQQII")
+
+# Magic, version, byte order mark, token count
+VOCABULARY_HEADER = struct.Struct("=4sIIQ")
+
+# Magic, version, byte order mark, lookback length, words per key, state count
+STATES_HEADER = struct.Struct("=4sIIIIQ")
+
+LENGTH = struct.Struct("=Q")
+
+
+class ModelFormatError(Exception):
+  pass
+
+
+# Read-only view onto an array stored inside a buffer, such as a memory map; items are unpacked on access
+class MappedArray:
+
+  def __init__(self, buf, offset, typecode, length):
+
+    self.buf = buf
+    self.offset = offset
+    self.typecode = typecode
+    self.item = struct.Struct(typecode)
+    self.itemsize = self.item.size
+    self.length = length
+
+
+  def __len__(self):
+    return self.length
+
+
+  def __getitem__(self, index):
+
+    if isinstance(index, slice):
+
+      (start, stop, step) = index.indices(self.length)
+      if step != 1:
+        return [self[i] for i in xrange(start, stop, step)]
+
+      count = max(0, stop - start)
+      return list(struct.unpack_from("%d%s" % (count, self.typecode), self.buf, self.offset + start * self.itemsize))
+
+    if index < 0:
+      index += self.length
+
+    if index < 0 or index >= self.length:
+      raise IndexError("mapped array index out of range")
+
+    return self.item.unpack_from(self.buf, self.offset + index * self.itemsize)[0]
+
+
+  def __iter__(self):
+
+    for i in xrange(0, self.length):
+      yield self[i]
+
+
+  def tostring(self):
+    return self.buf[self.offset:self.offset + self.length * self.itemsize]
+
+
+  # Return a copy of the items in memory, which is far quicker to read from
+  def toArray(self):
+
+    arr = array(self.typecode)
+    arr.fromstring(self.tostring())
+
+    return arr
+
+
+class ModelFile:
+
+  @staticmethod
+  def getOpeners():
+    return sorted(config.OPENERS_TO_CLOSERS)
+
+
+  @staticmethod
+  def pad(outfile):
+
+    remainder = outfile.tell() % ALIGNMENT
+    if remainder:
+      outfile.write("\0" * (ALIGNMENT - remainder))
+
+
+  @staticmethod
+  def align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+  # Write a list of arrays as their lengths, followed by their aligned contents
+  @staticmethod
+  def writeArrays(outfile, arrays):
+
+    for arr in arrays:
+      outfile.write(LENGTH.pack(len(arr)))
+
+    for arr in arrays:
+      ModelFile.pad(outfile)
+      outfile.write(arr.tostring())
+
+    ModelFile.pad(outfile)
+
+
+  # Return views onto arrays written by writeArrays, starting at a given offset
+  @staticmethod
+  def mapArrays(buf, offset, typecodes):
+
+    lengths = []
+    for i in range(0, len(typecodes)):
+      lengths.append(ModelFile.unpackFrom(LENGTH, buf, offset)[0])
+      offset += LENGTH.size
+
+    arrays = []
+    for (typecode, length) in zip(typecodes, lengths):
+      offset = ModelFile.align(offset)
+      mapped = MappedArray(buf, offset, typecode, length)
+      offset += length * mapped.itemsize
+      if offset > len(buf):
+        raise ModelFormatError("Model file is truncated")
+      arrays.append(mapped)
+
+    return arrays
+
+
+  # Every item read from a mapped array is unpacked on its own, which makes walking a mapped table several times slower
+  #  than walking one in memory; so arrays are copied, unless they are big enough that paging them in only as they are
+  #  used is worth that
+  @staticmethod
+  def loadArray(mapped):
+
+    if len(mapped) * mapped.itemsize > config.MODEL_COPY_BYTES:
+      return mapped
+
+    return mapped.toArray()
+
+
+  @staticmethod
+  def unpackFrom(header, buf, offset):
+
+    if offset + header.size > len(buf):
+      raise ModelFormatError("Model file is truncated")
+
+    return header.unpack_from(buf, offset)
+
+
+  @staticmethod
+  def getUserTypecodes():
+
+    table_typecodes = [typecode for (_, typecode) in TransitionTable.ARRAY_FIELDS + SuffixIndex.ARRAY_FIELDS]
+    overlay_typecodes = [typecode for (_, typecode) in ClosingOverlay.ARRAY_FIELDS]
+
+    counted_typecodes = [INDEX_TYPECODE, INDEX_TYPECODE]
+
+    return table_typecodes + overlay_typecodes * len(ModelFile.getOpeners()) + counted_typecodes * 2
+
+
+  # A file that is missing or cannot be read is reported as unusable, the same as one that is malformed
+  @staticmethod
+  def mapFile(filepath):
+
+    try:
+      model_file = open(filepath, "rb")
+    except EnvironmentError as e:
+      raise ModelFormatError("Cannot open model file %s: %s" % (filepath, e))
+
+    try:
+      return mmap.mmap(model_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    except (ValueError, EnvironmentError) as e:
+      raise ModelFormatError("Cannot map model file %s: %s" % (filepath, e))
+
+    finally:
+      model_file.close()
+
+
+  # Check the parts of a header that every model file shares
+  @staticmethod
+  def checkHeader(filepath, magic, expected_magic, version, byte_order_mark):
+
+    if magic != expected_magic:
+      raise ModelFormatError("%s is not a model file" % filepath)
+
+    if version != FORMAT_VERSION:
+      raise ModelFormatError("%s has format version %d, but version %d is required" % (filepath, version, FORMAT_VERSION))
+
+    if byte_order_mark != BYTE_ORDER_MARK:
+      raise ModelFormatError("%s was written on a platform with a different byte order" % filepath)
+
+
+  # Write one user's tables, starters and URLs, referring to tokens and lookback states by their ids in the shared
+  #  vocabulary and states
+  # The user is given as fields, as they would be passed to UserCollection.addUser
+  @staticmethod
+  def writeUser(filepath, user_fields, lookback_count, vocabulary_size, state_count):
+
+    nick = user_fields["nick"]
+    all_lookbacks = user_fields["all_lookbacks"]
+
+    suffix_index = all_lookbacks.suffix_index
+    arrays = all_lookbacks.getArrays() + suffix_index.getArrays()
+    for opener in ModelFile.getOpeners():
+      arrays += user_fields["closing_lookbacks"][opener].getArrays()
+    arrays += user_fields["starters"].getArrays()
+    arrays += user_fields["urls"].getArrays()
+
+    outfile = open(filepath, "wb")
+
+    outfile.write(USER_HEADER.pack(USER_MAGIC, FORMAT_VERSION, BYTE_ORDER_MARK, lookback_count, \
+      suffix_index.packer.key_words, vocabulary_size, state_count, all_lookbacks.countProductions(), \
+      len(user_fields["starters"]), len(nick), len(arrays)))
+    outfile.write(nick)
+    ModelFile.pad(outfile)
+    ModelFile.writeArrays(outfile, arrays)
+
+    outfile.close()
+
+
+  # Return the fields of a user, for passing on to UserCollection.addUser, with the tables mapped from file
+  @staticmethod
+  def readUser(filepath, lookback_states, vocabulary_size):
+
+    lookback_count = lookback_states.lookback_count
+    buf = ModelFile.mapFile(filepath)
+
+    (key_words, production_count, _, nick, array_count) = ModelFile.readUserHeader(filepath, buf, lookback_states, \
+      vocabulary_size)
+
+    # The suffix index keeps the width of keys it was written with, even if the states are packed wider since
+    packer = ModelFile.getPacker(filepath, lookback_count, key_words)
+
+    typecodes = ModelFile.getUserTypecodes()
+    if array_count != len(typecodes):
+      raise ModelFormatError("%s has %d arrays, but %d are expected" % (filepath, array_count, len(typecodes)))
+
+    mapped = ModelFile.mapArrays(buf, ModelFile.align(USER_HEADER.size + len(nick)), typecodes)
+    arrays = [ModelFile.loadArray(arr) for arr in mapped]
+
+    index_start = len(TransitionTable.ARRAY_FIELDS)
+    table_width = index_start + len(SuffixIndex.ARRAY_FIELDS)
+    suffix_index = SuffixIndex.fromArrays(packer, *arrays[index_start:table_width])
+    all_lookbacks = TransitionTable(lookback_states, *arrays[:index_start], production_count=production_count, \
+      suffix_index=suffix_index)
+
+    overlay_width = len(ClosingOverlay.ARRAY_FIELDS)
+    closing_lookbacks = {}
+    for (i, opener) in enumerate(ModelFile.getOpeners()):
+      start = table_width + i * overlay_width
+      closing_lookbacks[opener] = ClosingOverlay(all_lookbacks, *arrays[start:start + overlay_width])
+
+    return {
+      "nick" : nick,
+      "starters" : CountedSequence(arrays[-4], arrays[-3], lookback_count),
+      "all_lookbacks" : all_lookbacks,
+      "closing_lookbacks" : closing_lookbacks,
+      "urls" : CountedSequence(arrays[-2], arrays[-1]),
+    }
+
+
+  # Return only what is needed to count and find a user, from the header of their model file, as passed to
+  #  UserCollection.addUser along with a loader for the rest
+  @staticmethod
+  def readUserCounts(filepath, lookback_states, vocabulary_size):
+
+    buf = ModelFile.mapFile(filepath)
+    (_, production_count, starter_count, nick, _) = ModelFile.readUserHeader(filepath, buf, lookback_states, \
+      vocabulary_size)
+
+    return {
+      "nick" : nick,
+      "starter_count" : starter_count,
+      "production_count" : production_count,
+    }
+
+
+  # Check the header of a user's model file against the shared vocabulary and states; return the words per suffix
+  #  index key, production count, starter count, nick and array count
+  @staticmethod
+  def readUserHeader(filepath, buf, lookback_states, vocabulary_size):
+
+    lookback_count = lookback_states.lookback_count
+
+    (magic, version, byte_order_mark, file_lookback_count, key_words, file_vocabulary_size, file_state_count, \
+      production_count, starter_count, nick_length, array_count) = ModelFile.unpackFrom(USER_HEADER, buf, 0)
+
+    ModelFile.checkHeader(filepath, magic, USER_MAGIC, version, byte_order_mark)
+
+    if file_lookback_count != lookback_count:
+      raise ModelFormatError("%s has lookback length %d, but %d is configured" % (filepath, file_lookback_count, lookback_count))
+
+    if file_vocabulary_size > vocabulary_size:
+      raise ModelFormatError("%s refers to tokens missing from the vocabulary" % filepath)
+
+    if file_state_count > len(lookback_states):
+      raise ModelFormatError("%s refers to lookback states missing from those shared" % filepath)
+
+    if USER_HEADER.size + nick_length > len(buf):
+      raise ModelFormatError("Model file is truncated")
+
+    nick = buf[USER_HEADER.size:USER_HEADER.size + nick_length]
+
+    return (key_words, production_count, starter_count, nick, array_count)
+
+
+  @staticmethod
+  def writeVocabulary(filepath, vocabulary):
+
+    offsets = array("L", [0])
+    blob = []
+    position = 0
+
+    for token in vocabulary.tokens:
+      if token is not None:
+        blob.append(token)
+        position += len(token)
+      offsets.append(position)
+
+    outfile = open(filepath, "wb")
+
+    outfile.write(VOCABULARY_HEADER.pack(VOCABULARY_MAGIC, FORMAT_VERSION, BYTE_ORDER_MARK, len(vocabulary)))
+    ModelFile.writeArrays(outfile, [offsets])
+    outfile.write("".join(blob))
+
+    outfile.close()
+
+
+  @staticmethod
+  def readVocabulary(filepath):
+
+    buf = ModelFile.mapFile(filepath)
+
+    (magic, version, byte_order_mark, token_count) = ModelFile.unpackFrom(VOCABULARY_HEADER, buf, 0)
+    ModelFile.checkHeader(filepath, magic, VOCABULARY_MAGIC, version, byte_order_mark)
+
+    offsets = ModelFile.mapArrays(buf, VOCABULARY_HEADER.size, ["L"])[0]
+    if len(offsets) != token_count + 1:
+      raise ModelFormatError("%s has an inconsistent token count" % filepath)
+
+    blob_start = ModelFile.align(offsets.offset + len(offsets) * offsets.itemsize)
+    bounds = offsets[:]
+    if blob_start + bounds[-1] > len(buf):
+      raise ModelFormatError("Model file is truncated")
+
+    blob = buf[blob_start:blob_start + bounds[-1]]
+    buf.close()
+
+    vocabulary = Vocabulary()
+    for i in range(SpecialToken.COUNT, token_count):
+      vocabulary.getOrCreateId(blob[bounds[i]:bounds[i+1]])
+
+    return vocabulary
+
+
+  # Write the shared lookback states, along with their index; any states added since the index was last brought up
+  #  to date must be committed to it first
+  @staticmethod
+  def writeStates(filepath, lookback_states):
+
+    outfile = open(filepath, "wb")
+
+    outfile.write(STATES_HEADER.pack(STATES_MAGIC, FORMAT_VERSION, BYTE_ORDER_MARK, lookback_states.lookback_count, \
+      lookback_states.packer.key_words, len(lookback_states)))
+    ModelFile.writeArrays(outfile, lookback_states.getArrays())
+
+    outfile.close()
+
+
+  # States are added to as users are processed, so these are read into memory rather than mapped
+  @staticmethod
+  def readStates(filepath, lookback_count):
+
+    buf = ModelFile.mapFile(filepath)
+
+    (magic, version, byte_order_mark, file_lookback_count, key_words, state_count) = \
+      ModelFile.unpackFrom(STATES_HEADER, buf, 0)
+    ModelFile.checkHeader(filepath, magic, STATES_MAGIC, version, byte_order_mark)
+
+    if file_lookback_count != lookback_count:
+      raise ModelFormatError("%s has lookback length %d, but %d is configured" % (filepath, file_lookback_count, lookback_count))
+
+    packer = ModelFile.getPacker(filepath, lookback_count, key_words)
+
+    mapped = ModelFile.mapArrays(buf, STATES_HEADER.size, [KEY_TYPECODE, INDEX_TYPECODE, INDEX_TYPECODE])
+    if [len(arr) for arr in mapped] != [state_count * key_words, state_count, state_count]:
+      raise ModelFormatError("%s has an inconsistent state count" % filepath)
+
+    arrays = [mapped_arr.toArray() for mapped_arr in mapped]
+    buf.close()
+
+    return LookbackStates.fromArrays(lookback_count, packer.wide, *arrays)
+
+
+  # Return a packer for lookbacks of a given length whose keys were written as a given number of words each
+  @staticmethod
+  def getPacker(filepath, lookback_count, key_words):
+
+    for wide in [False, True]:
+      packer = KeyPacker(lookback_count, wide)
+      if packer.key_words == key_words:
+        return packer
+
+    raise ModelFormatError("%s has keys of %d words, which no packer writes" % (filepath, key_words))
+
+
+  @staticmethod
+  def getUserFilepath(model_dir, nick):
+    return os.path.join(model_dir, nick + config.MODEL_FILE_EXT)
@@ -0,0 +1,93 @@
+# Pools of quotes generated ahead of time, for the users requested most often and for random requests
+
+from collections import deque
+from collections import namedtuple
+
+QuotePoolStatistics = namedtuple("QuotePoolStatistics", "pool_count, quote_count, depth, hits, misses, refills")
+
+
+# Each pool is keyed by a single nick, or by a minimum starter count for random users, and holds up to a given number
+#  of (nicks, quote) pairs; the oldest are dropped first if a pool is ever overfilled
+# Requests for keys without a pool are not counted as hits or misses, so the hit ratio reflects only pooled keys
+class QuotePool:
+
+  def __init__(self, depth):
+
+    self.depth = depth # Number of quotes to keep ready in each pool
+    self.pools = {} # Map of keys to queues of (nicks, quote) pairs, oldest first
+
+    self.hits = 0
+    self.misses = 0
+    self.refills = 0
+
+
+  def __len__(self):
+    return len(self.pools)
+
+
+  def __contains__(self, key):
+    return key in self.pools
+
+
+  # Make sure that there is a pool for each of the given keys, dropping the pools of any other keys
+  def setKeys(self, keys):
+
+    for key in self.pools.keys():
+      if not key in keys:
+        del self.pools[key]
+
+    for key in keys:
+      self.addKey(key)
+
+
+  def addKey(self, key):
+    if not key in self.pools:
+      self.pools[key] = deque(maxlen=self.depth)
+
+
+  # Return the oldest (nicks, quote) pair ready for a key, or None if there is none
+  def pop(self, key):
+
+    if not key in self.pools:
+      return None
+
+    pool = self.pools[key]
+    if not pool:
+      self.misses += 1
+      return None
+
+    self.hits += 1
+    return pool.popleft()
+
+
+  def push(self, key, nicks, quote):
+    if key in self.pools:
+      self.pools[key].append((nicks, quote))
+      self.refills += 1
+
+
+  # Return a list of (key, number of quotes missing) pairs for pools that are not full, emptiest first
+  def findShortfalls(self):
+
+    shortfalls = []
+    for (key, pool) in self.pools.iteritems():
+      if len(pool) < self.depth:
+        shortfalls.append((key, self.depth - len(pool)))
+
+    return sorted(shortfalls, key=lambda x:x[1], reverse=True)
+
+
+  # Drop any quotes generated from a user, such as when their material has changed
+  def discard(self, nick):
+
+    for (key, pool) in self.pools.iteritems():
+      kept = [entry for entry in pool if not nick in entry[0]]
+      if len(kept) < len(pool):
+        self.pools[key] = deque(kept, maxlen=self.depth)
+
+
+  def getStatistics(self):
+
+    quote_count = sum([len(pool) for pool in self.pools.itervalues()])
+
+    return QuotePoolStatistics(len(self.pools), quote_count, self.depth, self.hits, self.misses, self.refills)
@@ -0,0 +1,205 @@
+# Lookback states shared by all users, each given a stable integer id, so that tables need only store those ids
+
+from array import array
+from bisect import bisect_left
+from itertools import izip
+
+from transitions import INDEX_TYPECODE
+from transitions import KeyPacker
+
+
+# Ids are handed out in the order states are first seen, and never change, as with token ids; so tables built
+#  against one set of states can be used alongside any set extending it
+# States are found by their packed keys through an index sorted by key, and the key of a state through its place in
+#  that index, so that each key is stored only once; states added since the index was last brought up to date are
+#  found through a map, and their keys kept in order of id, until it is
+class LookbackStates:
+
+  def __init__(self, lookback_count, wide=False):
+
+    self.lookback_count = lookback_count
+    self.packer = KeyPacker(lookback_count, wide)
+
+    self.sorted_keys = self.packer.createKeys() # Keys of the states in the index, in order
+    self.sorted_ids = array(INDEX_TYPECODE) # Id of the state with each of those keys
+    self.positions = array(INDEX_TYPECODE) # Place in the index of each state in it, indexed by id
+    self.pending = {} # Map of the keys of states added since the index was last brought up to date to their ids
+    self.pending_keys = self.packer.createKeys() # Keys of those states, in order of id
+
+
+  # Build from arrays as returned by getArrays
+  @staticmethod
+  def fromArrays(lookback_count, wide, sorted_key_words, sorted_ids, positions):
+
+    lookback_states = LookbackStates(lookback_count, wide)
+    lookback_states.sorted_keys = lookback_states.packer.loadKeys(sorted_key_words)
+    lookback_states.sorted_ids = sorted_ids
+    lookback_states.positions = positions
+
+    return lookback_states
+
+
+  def __len__(self):
+    return len(self.positions) + len(self.pending_keys)
+
+
+  # Return the id of the state with a packed key, or None if it has never been seen
+  def getId(self, key):
+
+    position = bisect_left(self.sorted_keys, key)
+    if position < len(self.sorted_keys) and self.sorted_keys[position] == key:
+      return self.sorted_ids[position]
+
+    return self.pending.get(key)
+
+
+  def getOrCreateId(self, key):
+
+    ident = self.getId(key)
+
+    if ident is None:
+      ident = len(self)
+      self.pending_keys.append(key)
+      self.pending[key] = ident
+
+    return ident
+
+
+  # Return the ids of the states with a sequence of packed keys, each None if it has never been seen
+  def getIds(self, keys):
+
+    # Until the index is first brought up to date, every state is found through the map
+    if not self.sorted_keys:
+      return map(self.pending.get, keys)
+
+    return [self.getId(key) for key in keys]
+
+
+  # Return the ids of the states with a sequence of distinct packed keys, adding those never seen in the order given
+  def getOrCreateIds(self, keys):
+
+    idents = self.getIds(keys)
+    new_keys = [key for (key, ident) in izip(keys, idents) if ident is None]
+
+    if not new_keys:
+      return idents
+
+    self.pending.update(izip(new_keys, xrange(len(self), len(self) + len(new_keys))))
+    self.pending_keys.extend(new_keys)
+
+    return self.getIds(keys)
+
+
+  def getKey(self, ident):
+
+    if ident < len(self.positions):
+      return self.sorted_keys[self.positions[ident]]
+
+    return self.pending_keys[ident - len(self.positions)]
+
+
+  # Return the id of the state of a lookback tuple of token ids, or None if it has never been seen
+  def findLookback(self, lookback):
+
+    if len(lookback) != self.lookback_count:
+      return None
+
+    return self.getId(self.packer.pack(lookback))
+
+
+  def getLookback(self, ident):
+    return self.packer.unpack(self.getKey(ident))
+
+
+  # Return whether these are the given states, perhaps with others added since
+  def extends(self, lookback_states):
+
+    if lookback_states is self:
+      return True
+
+    if len(lookback_states) > len(self):
+      return False
+
+    # States packed at different widths have different keys, so those are compared by their lookbacks instead
+    get = LookbackStates.getKey
+    if lookback_states.packer.wide != self.packer.wide:
+      get = LookbackStates.getLookback
+
+    for ident in xrange(0, len(lookback_states)):
+      if get(self, ident) != get(lookback_states, ident):
+        return False
+
+    return True
+
+
+  # Pack every key wide, once the vocabulary has outgrown the keys; this keeps the keys in the same order, so neither
+  #  the ids of the states nor their places in the index change
+  def widen(self):
+
+    packer = KeyPacker(self.lookback_count, True)
+    self.sorted_keys = packer.createKeys([packer.repack(key, self.packer) for key in self.sorted_keys])
+    self.pending_keys = packer.createKeys([packer.repack(key, self.packer) for key in self.pending_keys])
+
+    self.pending = {}
+    for (i, key) in enumerate(self.pending_keys):
+      self.pending[key] = len(self.positions) + i
+
+    self.packer = packer
+
+
+  # Bring the index up to date with the states added since it last was; until then, finding those is slower
+  # This copies the whole index, so it is done once after a batch of states has been added, rather than after each
+  def commit(self):
+
+    if not self.pending:
+      return
+
+    # As when all states are added in one build, there may be nothing to merge with
+    if not self.sorted_keys:
+      self.sorted_keys = self.packer.createKeys(sorted(self.pending))
+      self.sorted_ids = array(INDEX_TYPECODE, [self.pending[key] for key in self.sorted_keys])
+      self.indexPositions()
+      return
+
+    sorted_keys = self.packer.createKeys()
+    sorted_ids = array(INDEX_TYPECODE)
+    start = 0
+
+    for key in sorted(self.pending):
+      position = bisect_left(self.sorted_keys, key, start)
+      sorted_keys.extend(self.sorted_keys[start:position])
+      sorted_ids.extend(self.sorted_ids[start:position])
+      sorted_keys.append(key)
+      sorted_ids.append(self.pending[key])
+      start = position
+
+    sorted_keys.extend(self.sorted_keys[start:])
+    sorted_ids.extend(self.sorted_ids[start:])
+
+    self.sorted_keys = sorted_keys
+    self.sorted_ids = sorted_ids
+    self.indexPositions()
+
+
+  # Record the place in the index of every state, once all are in it
+  def indexPositions(self):
+
+    positions = array(INDEX_TYPECODE, [0]) * len(self.sorted_ids)
+    for (position, ident) in enumerate(self.sorted_ids):
+      positions[ident] = position
+
+    self.positions = positions
+    self.pending = {}
+    self.pending_keys = self.packer.createKeys()
+
+
+  # Return the arrays of the index as they are written, with wide keys split into words
+  def getArrays(self):
+    return [self.packer.dumpKeys(self.sorted_keys), self.sorted_ids, self.positions]
+
+
+  def countBytes(self):
+
+    index_bytes = sum([len(arr) * arr.itemsize for arr in [self.sorted_ids, self.positions]])
+
+    return self.packer.countKeyBytes(self.sorted_keys) + index_bytes
@@ -4,7 +4,7 @@
 
 import sys
 sys.path.append(".")
-from impostor import Margen
+from generator.generator import Generator
 
 QUITCHAR = '#' # The character to break the loop (ideally, one that isn't a valid nick character)
 QUANTITY = 24 # How many lines to print each time it is called
@@ -14,7 +14,8 @@ def get_input():
   return raw_input('Enter <nick> to generate, including \'' + RANDNICK + '\' for a random user; enter \'' + QUITCHAR + '\' to exit: ')
 
 def main(src_dir):
-  generator = Margen.Margen(src_dir)
+  generator = Generator()
+  generator.build(src_dir)
 
   request = get_input().strip()
 
@@ -31,9 +32,9 @@ def main(src_dir):
         nick_tuple = (True, '')
       nick_tuples.append(nick_tuple)
 
-    for i in range(0, QUANTITY):
+    output_nicks, output_quotes = generator.generateMany(nick_tuples, QUANTITY)
 
-      output_nicks, output_quote = generator.generate(nick_tuples)
+    for output_quote in output_quotes:
       if output_quote:
         output_message = '[' + output_nicks[0]
         for output_nick in output_nicks[1:]:
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from generator import config
+
+
+# Write a user's source file of the given lines into a directory, returning its path
+def writeSource(source_dir, nick, lines):
+
+  source_filepath = os.path.join(source_dir, nick + config.SOURCEFILE_EXT)
+  source_file = open(source_filepath, "w")
+  source_file.write("\n".join(lines) + "\n")
+  source_file.close()
+
+  return source_filepath
+
+
+# Write a source file for each user in a dictionary of nicks to lines, returning their paths in order of nick
+def writeSources(source_dir, sources):
+
+  return [writeSource(source_dir, nick, sources[nick]) for nick in sorted(sources)]
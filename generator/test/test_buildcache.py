@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from generator import config
+from generator.buildcache import BuildCache
+from generator.generator import Generator
+from generator.modelfile import ModelFile
+from generator.test.sources import writeSource
+
+
+class TestBuildCache(unittest.TestCase):
+
+  def setUp(self):
+
+    self.source_dir = tempfile.mkdtemp()
+    self.model_dir = os.path.join(self.source_dir, config.MODEL_DIR_NAME)
+
+    writeSource(self.source_dir, "almond", ["a b c d", "a b c e", "(f g h) i"])
+    writeSource(self.source_dir, "birch", ["a b [c d] e", "l m n"])
+    writeSource(self.source_dir, "cedar", ["x"])
+
+    Generator().build(self.source_dir)
+
+
+  def tearDown(self):
+    shutil.rmtree(self.source_dir)
+
+
+  # Build again, returning the generator and the names of the sources that had to be processed
+  def rebuild(self, lookback_count=config.LOOKBACK_LEN, composite_nick=None):
+
+    generator = Generator(lookback_count, composite_nick=composite_nick)
+    processed = []
+    original_process_source = generator.processSource
+
+    def processSource(source_filename, source_data):
+      processed.append(source_filename)
+      return original_process_source(source_filename, source_data)
+
+    generator.processSource = processSource
+    generator.build(self.source_dir)
+
+    return (generator, processed)
+
+
+  def test_build_writes_cache(self):
+
+    model_filenames = os.listdir(self.model_dir)
+
+    self.assertTrue(config.MANIFEST_FILE_NAME in model_filenames)
+    self.assertTrue(config.VOCABULARY_FILE_NAME in model_filenames)
+    self.assertTrue(config.STATES_FILE_NAME in model_filenames)
+    self.assertTrue("almond" + config.MODEL_FILE_EXT in model_filenames)
+    self.assertTrue("birch" + config.MODEL_FILE_EXT in model_filenames)
+    self.assertFalse("cedar" + config.MODEL_FILE_EXT in model_filenames)
+
+
+  def test_rebuild_unchanged(self):
+
+    (generator, processed) = self.rebuild()
+
+    self.assertEqual(processed, [])
+    self.assertEqual(generator.users.countUsers(), 2)
+
+    nicks, quote = generator.generate([(0, "birch")], ("l",))
+    self.assertEqual(nicks, ["birch"])
+    self.assertEqual(quote, "l m n")
+
+
+  def test_rebuild_changed_source(self):
+
+    writeSource(self.source_dir, "birch", ["l m o"])
+
+    (generator, processed) = self.rebuild()
+
+    self.assertEqual(processed, ["birch" + config.SOURCEFILE_EXT])
+
+    nicks, quote = generator.generate([(0, "birch")], ("l",))
+    self.assertEqual(quote, "l m o")
+
+    nicks, quote = generator.generate([(0, "almond")], ("(f",))
+    self.assertEqual(quote, "(f g h) i")
+
+
+  def test_rebuild_new_source(self):
+
+    writeSource(self.source_dir, "dogwood", ["p q r"])
+
+    (generator, processed) = self.rebuild()
+
+    self.assertEqual(processed, ["dogwood" + config.SOURCEFILE_EXT])
+    self.assertEqual(generator.users.countUsers(), 3)
+
+    # New lookbacks are added to the shared states, leaving those the cached models refer to where they were
+    nicks, quote = generator.generate([(0, "dogwood")], ("p",))
+    self.assertEqual(quote, "p q r")
+
+    nicks, quote = generator.generate([(0, "almond")], ("(f",))
+    self.assertEqual(quote, "(f g h) i")
+
+
+  def test_rebuild_deleted_source(self):
+
+    os.remove(os.path.join(self.source_dir, "almond" + config.SOURCEFILE_EXT))
+
+    (generator, processed) = self.rebuild()
+
+    self.assertEqual(processed, [])
+    self.assertEqual(generator.users.countUsers(), 1)
+    self.assertFalse(os.path.isfile(ModelFile.getUserFilepath(self.model_dir, "almond")))
+
+
+  def test_rebuild_touched_source_not_processed(self):
+
+    source_filepath = os.path.join(self.source_dir, "almond" + config.SOURCEFILE_EXT)
+    stat = os.stat(source_filepath)
+    os.utime(source_filepath, (stat.st_atime, stat.st_mtime + 10))
+
+    (generator, processed) = self.rebuild()
+
+    self.assertEqual(processed, [])
+
+
+  def test_rebuild_different_lookback(self):
+
+    (generator, processed) = self.rebuild(config.LOOKBACK_LEN + 1)
+
+    self.assertEqual(len(processed), 3)
+    self.assertEqual(generator.users.getByAlias("birch").all_lookbacks.lookback_count, config.LOOKBACK_LEN + 1)
+
+
+  def test_rebuild_corrupt_manifest(self):
+
+    manifest_file = open(os.path.join(self.model_dir, config.MANIFEST_FILE_NAME), "w")
+    manifest_file.write("junk")
+    manifest_file.close()
+
+    (generator, processed) = self.rebuild()
+
+    self.assertEqual(len(processed), 3)
+    self.assertEqual(generator.users.countUsers(), 2)
+
+
+  def test_rebuild_corrupt_model(self):
+
+    model_file = open(ModelFile.getUserFilepath(self.model_dir, "almond"), "r+b")
+    model_file.truncate(16)
+    model_file.close()
+
+    (generator, processed) = self.rebuild()
+
+    self.assertEqual(processed, ["almond" + config.SOURCEFILE_EXT])
+    self.assertEqual(generator.users.countUsers(), 2)
+
+
+  def test_rebuild_missing_model(self):
+
+    os.remove(ModelFile.getUserFilepath(self.model_dir, "almond"))
+
+    (generator, processed) = self.rebuild()
+
+    self.assertEqual(processed, ["almond" + config.SOURCEFILE_EXT])
+    self.assertEqual(generator.users.countUsers(), 2)
+    self.assertTrue(os.path.isfile(ModelFile.getUserFilepath(self.model_dir, "almond")))
+
+
+  def test_rebuild_missing_states(self):
+
+    os.remove(os.path.join(self.model_dir, config.STATES_FILE_NAME))
+
+    (generator, processed) = self.rebuild()
+
+    self.assertEqual(len(processed), 3)
+    self.assertEqual(generator.users.countUsers(), 2)
+
+
+  def test_rebuild_composite_unchanged(self):
+
+    (generator, _) = self.rebuild(composite_nick="all")
+    composite = generator.users.getByAlias("all")
+    self.assertTrue(os.path.isfile(os.path.join(self.model_dir, config.COMPOSITE_FILE_NAME)))
+
+    with mock.patch.object(Generator, "mergeTuples") as merge_tuples:
+      (generator, processed) = self.rebuild(composite_nick="all")
+
+    self.assertFalse(merge_tuples.called)
+    self.assertEqual(generator.users.getByAlias("all").production_count, composite.production_count)
+    self.assertEqual(generator.users.getByAlias("all").starter_count, composite.starter_count)
+
+    nicks, quote = generator.generate([(0, "all")], ("(f",))
+    self.assertEqual(quote, "(f g h) i")
+
+
+  def test_rebuild_composite_changed_source(self):
+
+    self.rebuild(composite_nick="all")
+    writeSource(self.source_dir, "birch", ["l m o"])
+
+    with mock.patch.object(Generator, "mergeTuples", autospec=True, side_effect=Generator.mergeTuples) as merge_tuples:
+      (generator, processed) = self.rebuild(composite_nick="all")
+
+    self.assertTrue(merge_tuples.called)
+
+    nicks, quote = generator.generate([(0, "all")], ("l",))
+    self.assertEqual(quote, "l m o")
+
+    # The composite cached by that build is read back by the next
+    with mock.patch.object(Generator, "mergeTuples") as merge_tuples:
+      (generator, processed) = self.rebuild(composite_nick="all")
+
+    self.assertFalse(merge_tuples.called)
+
+
+  def test_compile_ignores_cache(self):
+
+    generator = Generator()
+    generator.processSource = mock.Mock(wraps=generator.processSource)
+    generator.compile(self.source_dir)
+
+    self.assertEqual(generator.processSource.call_count, 3)
+
+
+  def test_get_fingerprint_hashes_only_when_stat_changes(self):
+
+    cache = BuildCache(self.model_dir, config.LOOKBACK_LEN)
+    cache.load()
+
+    source_filepath = os.path.join(self.source_dir, "almond" + config.SOURCEFILE_EXT)
+
+    with mock.patch.object(BuildCache, "hashFile") as hash_file:
+      cache.getFingerprint("almond" + config.SOURCEFILE_EXT, source_filepath)
+      self.assertFalse(hash_file.called)
+
+      cache.getFingerprint("dogwood" + config.SOURCEFILE_EXT, source_filepath)
+      self.assertTrue(hash_file.called)
+
+
+  def test_unwritable_cache(self):
+
+    with mock.patch.object(ModelFile, "writeUser", side_effect=IOError("disk full")):
+      writeSource(self.source_dir, "dogwood", ["p q r"])
+      (generator, processed) = self.rebuild()
+
+    self.assertEqual(generator.users.countUsers(), 3)
+
+
+  def test_unwritable_cache_removes_stale_model(self):
+
+    writeSource(self.source_dir, "birch", ["l m o"])
+
+    with mock.patch.object(ModelFile, "writeUser", side_effect=IOError("disk full")):
+      generator = Generator(lazy_models=True)
+      generator.build(self.source_dir)
+
+    self.assertFalse(os.path.exists(ModelFile.getUserFilepath(self.model_dir, "birch")))
+
+    nicks, quote = generator.generate([(0, "birch")], ("l",), increment_quote_count=False)
+    self.assertEqual(quote, "l m o")
+
+
+  def test_unwritable_cache_stale_model_not_loaded(self):
+
+    writeSource(self.source_dir, "birch", ["l m o"])
+
+    with mock.patch.object(ModelFile, "writeUser", side_effect=IOError("disk full")):
+      with mock.patch.object(BuildCache, "removeFile", side_effect=OSError("read-only")):
+        generator = Generator(lazy_models=True)
+        generator.build(self.source_dir)
+
+    self.assertTrue(os.path.exists(ModelFile.getUserFilepath(self.model_dir, "birch")))
+
+    with mock.patch.object(ModelFile, "readUser") as read_user:
+      nicks, quote = generator.generate([(0, "birch")], ("l",), increment_quote_count=False)
+      self.assertFalse(read_user.called)
+
+    self.assertEqual(quote, "l m o")
+
+
+if __name__ == "__main__":
+  unittest.main()
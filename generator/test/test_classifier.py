@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from generator.classifier import TokenClassifier
+from generator.vocabulary import Vocabulary
+
+
+class TestTokenClassifier(unittest.TestCase):
+
+  def setUp(self):
+
+    self.vocabulary = Vocabulary()
+    self.classifier = TokenClassifier(self.vocabulary)
+
+
+  def clean(self, word, openers):
+    return self.classifier.cleanWord(self.vocabulary.getOrCreateId(word), openers)
+
+
+  def test_update_classifies_new_tokens(self):
+
+    plain = self.vocabulary.getOrCreateId("plain")
+    url = self.vocabulary.getOrCreateId("http://a.b.com")
+    closer = self.vocabulary.getOrCreateId("c),")
+    self.classifier.update()
+
+    self.assertEqual(self.classifier.urls, {url})
+    self.assertEqual(self.classifier.closers, {closer : "("})
+    self.assertFalse(plain in self.classifier.marks)
+    self.assertEqual(self.classifier.marks[closer], ((), 1, 1, ()))
+
+    later = self.vocabulary.getOrCreateId("[d")
+    self.assertEqual(self.classifier.getClosers(), {closer : "("})
+    self.assertEqual(self.classifier.marks[later].openers, ("[",))
+
+
+  def test_closers_exceptions(self):
+
+    for word in [":)", ">:)", "http://a.b.com(s)"]:
+      self.vocabulary.getOrCreateId(word)
+    self.vocabulary.getOrCreateId("http://a.b.com)")
+    self.classifier.update()
+
+    self.assertEqual(self.classifier.closers.values(), ["("])
+
+
+  def test_clean_plain(self):
+
+    openers = ["("]
+
+    self.assertEqual(self.clean("a(b", openers), "a(b")
+    self.assertEqual(openers, ["("])
+
+
+  def test_clean_opens_and_matches(self):
+
+    openers = []
+
+    self.assertEqual(self.clean("([a", openers), "([a")
+    self.assertEqual(openers, ["(", "["])
+    self.assertEqual(self.clean("b)]!", openers), "b)]!")
+    self.assertEqual(openers, [])
+
+
+  def test_clean_drops_unmatched_closers(self):
+
+    openers = ["["]
+
+    self.assertEqual(self.clean("a)],", openers), "a],")
+    self.assertEqual(openers, [])
+    self.assertEqual(self.clean("b}", openers), "b")
+
+
+  def test_clean_quotes(self):
+
+    openers = []
+
+    self.assertEqual(self.clean("\"", openers), "\"")
+    self.assertEqual(openers, [])
+    self.assertEqual(self.clean("\"a", openers), "\"a")
+    self.assertEqual(self.clean("b\"", openers), "b\"")
+    self.assertEqual(openers, [])
+
+
+  def test_clean_exceptions(self):
+
+    openers = []
+    self.assertEqual(self.clean(":)", openers), ":)")
+    self.assertEqual(self.clean("(:", openers), "(:")
+    self.assertEqual(openers, [])
+
+    openers = ["("]
+    self.assertEqual(self.clean(">:))", openers), ">:))")
+    self.assertEqual(openers, [])
+
+
+if __name__ == "__main__":
+  unittest.main()
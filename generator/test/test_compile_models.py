@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+import mock
+from StringIO import StringIO
+import unittest
+
+from generator import compile_models
+from generator.states import LookbackStates
+from generator.transitions import TransitionTable
+
+
+class TestCompileModels(unittest.TestCase):
+
+  def setUp(self):
+
+    lookback_states = LookbackStates(2)
+    self.tables = {
+      "almond" : TransitionTable.fromLookbacks(lookback_states, {
+        (1, 2) : {3 : 2},
+        (2, 3) : {4 : 2},
+        (3, 4) : {5 : 1, 6 : 1},
+        (7, 2) : {3 : 1},
+      }),
+      "birch" : TransitionTable.fromLookbacks(lookback_states, {(2, 3) : {4 : 3, 5 : 1}, (3, 4) : {6 : 1}}),
+      "cedar" : TransitionTable.fromLookbacks(lookback_states, {}),
+    }
+
+    self.users = mock.Mock()
+    self.users.usermap = dict.fromkeys(self.tables)
+    self.users.getAllLookbacks.side_effect = self.tables.__getitem__
+
+
+  def test_print_run_compression(self):
+
+    with mock.patch("sys.stdout", new_callable=StringIO) as stdout:
+      compile_models.printRunCompression(self.users)
+
+    self.assertEqual(stdout.getvalue().splitlines(), [
+      compile_models.USER_RUN_COMPRESSION_MESSAGE % ("almond", 5.0 / 4),
+      compile_models.USER_RUN_COMPRESSION_MESSAGE % ("birch", 1.0),
+      compile_models.RUN_COMPRESSION_MESSAGE % (3, 8.0 / 7),
+    ])
+
+
+if __name__ == "__main__":
+  unittest.main()
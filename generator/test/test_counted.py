@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+from array import array
+import unittest
+
+from generator.counted import CountedSequence
+from generator.modelfile import MappedArray
+
+
+class TestCountedSequence(unittest.TestCase):
+
+  def setUp(self):
+    self.sequence = CountedSequence.fromCounts({7 : 2, 3 : 1, 9 : 3})
+
+
+  def test_from_counts(self):
+
+    self.assertEqual(list(self.sequence.items), [3, 7, 9])
+    self.assertEqual(list(self.sequence.bounds), [1, 3, 6])
+    self.assertEqual(self.sequence.countDistinct(), 3)
+
+
+  def test_behaves_as_list(self):
+
+    self.assertEqual(len(self.sequence), 6)
+    self.assertEqual(list(self.sequence), [3, 7, 7, 9, 9, 9])
+    self.assertEqual([self.sequence[i] for i in range(0, 6)], [3, 7, 7, 9, 9, 9])
+    self.assertEqual(self.sequence[-1], 9)
+    self.assertEqual(self.sequence[-6], 3)
+    self.assertRaises(IndexError, self.sequence.__getitem__, 6)
+    self.assertRaises(IndexError, self.sequence.__getitem__, -7)
+
+
+  def test_tuples(self):
+
+    counts = {(4, 5) : 2, (1, 2) : 1}
+    sequence = CountedSequence.fromCounts(counts, 2)
+
+    self.assertEqual(list(sequence.items), [1, 2, 4, 5])
+    self.assertEqual(list(sequence), [(1, 2), (4, 5), (4, 5)])
+    self.assertEqual(sequence.getCounts(), counts)
+
+
+  def test_empty(self):
+
+    sequence = CountedSequence.fromCounts({}, 2)
+
+    self.assertEqual(len(sequence), 0)
+    self.assertEqual(list(sequence), [])
+    self.assertRaises(IndexError, sequence.__getitem__, 0)
+
+
+  def test_count_bytes(self):
+    self.assertEqual(self.sequence.countBytes(), 6 * self.sequence.items.itemsize)
+
+
+  def test_mapped(self):
+
+    items = MappedArray(array("I", [1, 2, 3, 4]).tostring(), 0, "I", 4)
+    bounds = MappedArray(array("I", [2, 3]).tostring(), 0, "I", 2)
+
+    sequence = CountedSequence(items, bounds, 2)
+
+    self.assertEqual(list(sequence), [(1, 2), (1, 2), (3, 4)])
+    self.assertEqual(sequence[2], (3, 4))
+
+
+if __name__ == "__main__":
+  unittest.main()
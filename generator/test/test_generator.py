@@ -1,15 +1,28 @@
 # -*- coding: utf-8 -*-
 
+from array import array
+from collections import Counter
 import mock
 from mock import patch
+import random
+import shutil
+import tempfile
 import unittest
 
 from generator import config
+from generator import generator
+from generator import transitions
 from generator import users
 from generator.generator import Generator
 from generator.generator import GeneratorUtil
 from generator.generator import GenericStatisticType
 from generator.generator import SpecialToken
+from generator.generator import UserTuples
+from generator.states import LookbackStates
+from generator.test.sources import writeSource
+from generator.test.sources import writeSources
+from generator.transitions import TransitionTable
+from generator.union import UnionTable
 from generator.users import UserNickType
 
 
@@ -67,11 +80,11 @@ class TestGenerator(unittest.TestCase):
       ("olc", "(an") : ["ghaoth]"],
       ("(an", "ghaoth]") : ["(nach"],
       ("ghaoth]", "(nach") : ["séideann"],
-      ("(nach", "séideann") : ["eile"],
+      ("(nach", "séideann") : ["eile", "maith),"],
       ("séideann", "maith),") : ["do"],
       ("maith),", "do") : ["dhuine"],
       ("do", "dhuine") : ["éigin"],
-      ("dhuine", "éigin") : ["eile"],
+      ("dhuine", "éigin") : ["eile", ">:))"],
       ("éigin", ">:))") : ["{mar"],
       (">:))", "{mar") : ["a"],
       ("{mar", "a") : [":)"],
@@ -88,153 +101,127 @@ class TestGenerator(unittest.TestCase):
       ("ina", "thost") : [SpecialToken.TERMINATE],
     }
 
+    # Only closing successors are chosen while a parenthesis is open, so the bard never goes on to "eile"
     self.closing_lookbacks = {}
-    self.closing_lookbacks[self.saoi_nick] = {"(":{}, "{":{}, "[":{}, "\"":{}}
-    self.closing_lookbacks[self.file_nick] = {"(":{}, "{":{}, "[":{}, "\"":{}}
-    self.closing_lookbacks[self.bard_nick] = {
-      "(" : {
-        ("(nach", "séideann") : ["maith),"],
-        ("dhuine", "éigin") : [">:))"],
-      },
-      "{":{}, "[":{}, "\"":{},
-    }
-    self.closing_lookbacks[self.poet_nick] = {}
 
     self.generator = Generator()
+    self.encodeFixtures()
 
     with patch(users.__name__ + ".UserCollection") as users_mock:
 
       self.users_instance = users_mock.return_value
 
 
-  @staticmethod
-  def retrieve_value_or_default(dictionary, key, default):
+  def encodeToken(self, token):
 
-    if key in dictionary:
-      return dictionary[key]
+    if token == SpecialToken.TERMINATE:
+      return token
 
-    return default
+    return self.generator.vocabulary.getOrCreateId(token)
 
 
-  def aliases_side_effect(self, *args):
+  def encodeTuple(self, tokens):
+    return tuple([self.encodeToken(token) for token in tokens])
 
-    return TestGenerator.retrieve_value_or_default(self.aliases, args[0], [])
 
+  def encodeLookbacks(self, lookbacks):
 
-  def stats_side_effect(self, *args):
+    encoded = {}
 
-    return TestGenerator.retrieve_value_or_default(self.stats, args[0], None)
+    for (lookback, follows) in lookbacks.iteritems():
+      encoded[self.encodeTuple(lookback)] = Counter(self.encodeTuple(follows))
 
+    return encoded
 
-  def starters_side_effect(self, *args):
 
-    return TestGenerator.retrieve_value_or_default(self.starters, args[0], [])
+  def buildTable(self, lookbacks):
+    return TransitionTable.fromLookbacks(self.generator.lookback_states, self.encodeLookbacks(lookbacks))
 
 
-  def all_lookbacks_side_effect(self, *args):
+  def buildClosingTables(self, table):
+    return self.generator.buildClosing(table)
 
-    return TestGenerator.retrieve_value_or_default(self.all_lookbacks, args[0], {})
 
+  @staticmethod
+  def countFollows(table, lookback):
+    return sum(table.getCounts(lookback).values())
 
-  def closing_lookbacks_side_effect(self, *args):
 
-    return TestGenerator.retrieve_value_or_default(self.closing_lookbacks, args[0], {})
+  @staticmethod
+  def getLookbacks(table):
 
+    lookbacks = {}
 
-  def test_copy_list_dict(self):
+    for lookback in table:
+      lookbacks[lookback] = table.getCounts(lookback)
 
-    rain_key = "rain"
+    return lookbacks
 
-    focloir = {
-      rain_key : ["fearthainn", "báisteach"],
-    }
 
-    copy = GeneratorUtil.copyListDict(focloir)
+  # Convert the string-based fixtures into the token ids the generator works with
+  def encodeFixtures(self):
 
-    self.assertTrue(copy)
-    self.assertEqual(copy, focloir)
+    for (nick, starters) in self.starters.iteritems():
+      self.starters[nick] = [self.encodeTuple(starter) for starter in starters]
 
-    # Check that the list is new
-    self.assertFalse(copy[rain_key] is focloir[rain_key])
+    for (nick, lookbacks) in self.all_lookbacks.iteritems():
+      self.all_lookbacks[nick] = self.buildTable(lookbacks)
 
-    # Check that the list elements are not new
-    for i in range(0, len(copy[rain_key])):
-      self.assertTrue(copy[rain_key][i] is focloir[rain_key][i])
+    for (nick, all_lookbacks) in self.all_lookbacks.iteritems():
+      self.closing_lookbacks[nick] = self.buildClosingTables(all_lookbacks)
 
 
-  def test_merge_into_dictionary_no_matching_keys(self):
+  @staticmethod
+  def retrieve_value_or_default(dictionary, key, default):
 
-    tree_key = "tree"
-    tree_value = ["crann"]
+    if key in dictionary:
+      return dictionary[key]
 
-    rain_key = "rain"
-    rain_value = ["báisteach"]
+    return default
 
-    focloir1 = {
-      tree_key : tree_value,
-    }
 
-    focloir2 = {
-      rain_key : rain_value,
-    }
+  def aliases_side_effect(self, *args):
 
-    GeneratorUtil.mergeIntoDictionary(focloir1, focloir2)
+    return TestGenerator.retrieve_value_or_default(self.aliases, args[0], [])
 
-    # Ensure first dictionary has been mutated correctly
-    self.assertEqual(len(focloir1), 2)
-    self.assertTrue(tree_key in focloir1)
-    self.assertTrue(rain_key in focloir1)
-    self.assertEqual(focloir1[tree_key], tree_value)
-    self.assertEqual(focloir1[rain_key], rain_value)
 
-    self.assertTrue(focloir1[tree_key] is tree_value)
-    self.assertTrue(focloir1[rain_key] is not rain_value)
-    self.assertTrue(focloir1[rain_key][0] is rain_value[0])
+  def stats_side_effect(self, *args):
 
-    # Ensure second dictionary is unchanged
-    self.assertEqual(len(focloir2), 1)
-    self.assertTrue(rain_key in focloir2)
+    return TestGenerator.retrieve_value_or_default(self.stats, args[0], None)
 
-    self.assertEqual(len(focloir2[rain_key]), 1)
-    self.assertTrue(focloir2[rain_key] is rain_value)
-    self.assertTrue(focloir2[rain_key][0] is rain_value[0])
 
+  def starters_side_effect(self, *args):
 
-  def test_merge_into_dictionary_with_matching_keys(self):
+    return TestGenerator.retrieve_value_or_default(self.starters, args[0], [])
 
-    rain_key = "rain"
-    rain_elem1 = "fearthainn"
-    rain_elem2 = "báisteach"
-    rain_value1 = [rain_elem1]
-    rain_value2 = [rain_elem2]
 
-    focloir1 = {
-      rain_key : rain_value1,
-    }
+  def all_lookbacks_side_effect(self, *args):
+
+    return TestGenerator.retrieve_value_or_default(self.all_lookbacks, args[0], {})
 
-    focloir2 = {
-      rain_key : rain_value2,
-    }
 
-    GeneratorUtil.mergeIntoDictionary(focloir1, focloir2)
+  def closing_lookbacks_side_effect(self, *args):
 
-    # Ensure first dictionary has been mutated correctly
-    self.assertEqual(len(focloir1), 1)
-    self.assertTrue(rain_key in focloir1)
-    self.assertEqual(focloir1[rain_key], [rain_elem1, rain_elem2])
+    return TestGenerator.retrieve_value_or_default(self.closing_lookbacks, args[0], {})
 
-    self.assertTrue(focloir1[rain_key] is rain_value1)
-    self.assertTrue(focloir1[rain_key][0] is rain_value1[0])
-    self.assertTrue(focloir1[rain_key][1] is rain_value2[0])
 
-    # Ensure second dictionary is unchanged
-    self.assertEqual(len(focloir2), 1)
-    self.assertTrue(rain_key in focloir2)
+  def test_combine_tuples(self):
 
-    self.assertEqual(len(focloir2[rain_key]), 1)
-    self.assertTrue(rain_key in focloir2)
-    self.assertTrue(focloir2[rain_key] is rain_value2)
-    self.assertTrue(focloir2[rain_key][0] is rain_value2[0])
+    first_table = self.buildTable({("báisteach", "trom") : ["inniu"]})
+    first = UserTuples(first_table, self.buildClosingTables(first_table), [self.encodeTuple(("báisteach", "trom"))], \
+      [self.encodeToken("http://www.met.ie")])
+    second_table = self.buildTable({("grian", "te") : ["inniu"]})
+    second = UserTuples(second_table, self.buildClosingTables(second_table), [self.encodeTuple(("grian", "te"))], [])
+
+    combined = Generator.combineTuples([first, second])
+
+    # Check that the views see both users, without having copied either
+    self.assertTrue(self.encodeTuple(("báisteach", "trom")) in combined.all_lookbacks)
+    self.assertTrue(self.encodeTuple(("grian", "te")) in combined.all_lookbacks)
+    self.assertTrue(combined.all_lookbacks.tables[0] is first.all_lookbacks)
+    self.assertEqual(list(combined.starters), first.starters + second.starters)
+    self.assertEqual(list(combined.urls), first.urls)
+    self.assertTrue(combined.closing_lookbacks["("].tables[1] is second.closing_lookbacks["("])
 
 
   def test_init_empty(self):
@@ -259,13 +246,13 @@ class TestGenerator(unittest.TestCase):
 
     (nick, user_tuples) = self.generator.processSource(source_filename, source_data)
 
-    ab = ("a", "b")
-    bc = ("b", "c")
-    cd = ("c", "d")
-    ce = ("c", "e")
-    fg = ("f", "g")
-    gh = ("g", "h")
-    ij = ("i", "j")
+    ab = self.encodeTuple(("a", "b"))
+    bc = self.encodeTuple(("b", "c"))
+    cd = self.encodeTuple(("c", "d"))
+    ce = self.encodeTuple(("c", "e"))
+    fg = self.encodeTuple(("f", "g"))
+    gh = self.encodeTuple(("g", "h"))
+    ij = self.encodeTuple(("i", "j"))
 
     self.assertEqual(nick, source_nick)
 
@@ -282,28 +269,28 @@ class TestGenerator(unittest.TestCase):
     self.assertTrue(gh in user_tuples.all_lookbacks)
     self.assertTrue(ij in user_tuples.all_lookbacks)
 
-    self.assertEqual(len(user_tuples.all_lookbacks[ab]), 2)
-    self.assertTrue("c" in user_tuples.all_lookbacks[ab])
-    self.assertEqual(user_tuples.all_lookbacks[ab][0], user_tuples.all_lookbacks[ab][1])
+    self.assertEqual(self.countFollows(user_tuples.all_lookbacks, ab), 2)
+    self.assertTrue(self.encodeToken("c") in user_tuples.all_lookbacks.getCounts(ab))
+    self.assertEqual(user_tuples.all_lookbacks.getCounts(ab)[self.encodeToken("c")], 2)
 
-    self.assertEqual(len(user_tuples.all_lookbacks[bc]), 2)
-    self.assertTrue("d" in user_tuples.all_lookbacks[bc])
-    self.assertTrue("e" in user_tuples.all_lookbacks[bc])
+    self.assertEqual(self.countFollows(user_tuples.all_lookbacks, bc), 2)
+    self.assertTrue(self.encodeToken("d") in user_tuples.all_lookbacks.getCounts(bc))
+    self.assertTrue(self.encodeToken("e") in user_tuples.all_lookbacks.getCounts(bc))
 
-    self.assertEqual(len(user_tuples.all_lookbacks[cd]), 1)
-    self.assertTrue(SpecialToken.TERMINATE in user_tuples.all_lookbacks[cd])
+    self.assertEqual(self.countFollows(user_tuples.all_lookbacks, cd), 1)
+    self.assertTrue(SpecialToken.TERMINATE in user_tuples.all_lookbacks.getCounts(cd))
 
-    self.assertEqual(len(user_tuples.all_lookbacks[ce]), 1)
-    self.assertTrue(SpecialToken.TERMINATE in user_tuples.all_lookbacks[ce])
+    self.assertEqual(self.countFollows(user_tuples.all_lookbacks, ce), 1)
+    self.assertTrue(SpecialToken.TERMINATE in user_tuples.all_lookbacks.getCounts(ce))
 
-    self.assertEqual(len(user_tuples.all_lookbacks[fg]), 1)
-    self.assertTrue("h" in user_tuples.all_lookbacks[fg])
+    self.assertEqual(self.countFollows(user_tuples.all_lookbacks, fg), 1)
+    self.assertTrue(self.encodeToken("h") in user_tuples.all_lookbacks.getCounts(fg))
 
-    self.assertEqual(len(user_tuples.all_lookbacks[gh]), 1)
-    self.assertTrue(SpecialToken.TERMINATE in user_tuples.all_lookbacks[gh])
+    self.assertEqual(self.countFollows(user_tuples.all_lookbacks, gh), 1)
+    self.assertTrue(SpecialToken.TERMINATE in user_tuples.all_lookbacks.getCounts(gh))
 
-    self.assertEqual(len(user_tuples.all_lookbacks[ij]), 1)
-    self.assertTrue(SpecialToken.TERMINATE in user_tuples.all_lookbacks[ij])
+    self.assertEqual(self.countFollows(user_tuples.all_lookbacks, ij), 1)
+    self.assertTrue(SpecialToken.TERMINATE in user_tuples.all_lookbacks.getCounts(ij))
 
     self.assertEqual(len(user_tuples.closing_lookbacks), 4)
     self.assertFalse(user_tuples.closing_lookbacks["("])
@@ -319,14 +306,14 @@ class TestGenerator(unittest.TestCase):
     (nick, user_tuples) = self.generator.processSource("almond.src", source_data)
 
     self.assertEqual(len(user_tuples.all_lookbacks), 11)
-    self.assertEqual(len(user_tuples.all_lookbacks[("c", "d")]), 2)
+    self.assertEqual(self.countFollows(user_tuples.all_lookbacks, self.encodeTuple(("c", "d"))), 2)
     self.assertEqual(len(user_tuples.closing_lookbacks), 4)
     self.assertEqual(len(user_tuples.closing_lookbacks["("]), 2)
     self.assertEqual(len(user_tuples.closing_lookbacks["["]), 1)
     self.assertEqual(len(user_tuples.closing_lookbacks["\""]), 1)
-    self.assertEqual(user_tuples.closing_lookbacks["("], {('a]', 'b}'): ['c)'], ('b', 'c]'): ['d)']})
-    self.assertEqual(user_tuples.closing_lookbacks["["], {('a', 'b'): ['c]']})
-    self.assertEqual(user_tuples.closing_lookbacks["\""], {('b}', 'c)'): ['d"']})
+    self.assertEqual(self.getLookbacks(user_tuples.closing_lookbacks["("]), self.encodeLookbacks({('a]', 'b}'): ['c)'], ('b', 'c]'): ['d)']}))
+    self.assertEqual(self.getLookbacks(user_tuples.closing_lookbacks["["]), self.encodeLookbacks({('a', 'b'): ['c]']}))
+    self.assertEqual(self.getLookbacks(user_tuples.closing_lookbacks["\""]), self.encodeLookbacks({('b}', 'c)'): ['d"']}))
     self.assertFalse(user_tuples.closing_lookbacks["{"])
 
 
@@ -337,9 +324,9 @@ class TestGenerator(unittest.TestCase):
     (nick, user_tuples) = self.generator.processSource("almond.src", source_data)
 
     self.assertEqual(len(user_tuples.all_lookbacks), 9)
-    self.assertEqual(len(user_tuples.all_lookbacks[("a", "b")]), 2)
-    self.assertEqual(len(user_tuples.all_lookbacks[("b", "c")]), 2)
-    self.assertEqual(len(user_tuples.all_lookbacks[("c", "d")]), 2)
+    self.assertEqual(self.countFollows(user_tuples.all_lookbacks, self.encodeTuple(("a", "b"))), 2)
+    self.assertEqual(self.countFollows(user_tuples.all_lookbacks, self.encodeTuple(("b", "c"))), 2)
+    self.assertEqual(self.countFollows(user_tuples.all_lookbacks, self.encodeTuple(("c", "d"))), 2)
     self.assertEqual(len(user_tuples.closing_lookbacks), 4)
     self.assertFalse(user_tuples.closing_lookbacks["("])
     self.assertFalse(user_tuples.closing_lookbacks["["])
@@ -379,16 +366,202 @@ class TestGenerator(unittest.TestCase):
 
     (nick, user_tuples) = self.generator.processSource("almond.src", source_data)
 
+    # URLs are all held as the URL token, but those closing a parenthesis are closing successors as themselves
     self.assertEqual(len(user_tuples.closing_lookbacks), 4)
-    self.assertEqual(len(user_tuples.closing_lookbacks["("]), 3)
-    self.assertTrue(("a", "b") in user_tuples.closing_lookbacks["("])
-    self.assertTrue(("b", "c") in user_tuples.closing_lookbacks["("])
+    self.assertEqual(self.getLookbacks(user_tuples.closing_lookbacks["("]), self.encodeLookbacks({
+      ("a", "b") : ["http://a.b.com)"],
+      ("b", "c") : ["http://a.b.com)"],
+      ("e", "f") : ["http://a.b.com(s))"],
+    }))
     self.assertFalse(user_tuples.closing_lookbacks["["])
     self.assertFalse(user_tuples.closing_lookbacks["\""])
     self.assertFalse(user_tuples.closing_lookbacks["{"])
     self.assertEqual(len(user_tuples.urls), 5)
 
 
+  def assertTablesEqual(self, table, other):
+    self.assertEqual([list(arr) for arr in table.getArrays()], [list(arr) for arr in other.getArrays()])
+
+
+  def test_merge_source_counts(self):
+
+    tokens = [None, None, "b", "a", "http://c.d)"]
+    successor_counts = {3 : 2, SpecialToken.URL : 1}
+    lookback_counts = [array(transitions.INDEX_TYPECODE, [2, 3])] + TransitionTable.flattenCounts([successor_counts])
+    counted = UserTuples(GeneratorUtil.dumpArrays(lookback_counts), {(2, 3) : {4 : 1}}, {(2, 3) : 1}, {4 : 1})
+
+    self.generator.vocabulary.getOrCreateId("a")
+    ids = self.generator.getRemappedIds(tokens)
+    (merged, closing_urls, starters, urls) = generator.mergeSourceCounts((2, False, [(ids, counted), (ids, counted)]))
+
+    a = self.encodeToken("a")
+    b = self.encodeToken("b")
+    url = self.encodeToken("http://c.d)")
+    packer = self.generator.lookback_states.packer
+
+    (keys, offsets, successors, counts) = GeneratorUtil.loadArrays(merged)
+    self.assertEqual(list(keys), [packer.pack((b, a))])
+    self.assertEqual(list(offsets), [0, 2])
+    self.assertEqual(dict(zip(successors, counts)), {a : 4, SpecialToken.URL : 2})
+
+    self.assertEqual(GeneratorUtil.loadArrays(starters), [array(transitions.INDEX_TYPECODE, [b, a]), \
+      array(transitions.INDEX_TYPECODE, [2])])
+    self.assertEqual(closing_urls, {(b, a) : {url : 2}})
+    self.assertEqual(GeneratorUtil.loadArrays(urls), [array(transitions.INDEX_TYPECODE, [url]), \
+      array(transitions.INDEX_TYPECODE, [2])])
+
+
+  def assertParallelMatchesSerial(self, sources, build_workers):
+
+    source_dir = tempfile.mkdtemp()
+    source_filepaths = writeSources(source_dir, sources)
+
+    serial = Generator(build_workers=1)
+    parallel = Generator(build_workers=build_workers)
+
+    try:
+      serial_processed = list(serial.processSourcesSerial(source_filepaths))
+      parallel_processed = list(parallel.processSourcesParallel(source_filepaths))
+    finally:
+      shutil.rmtree(source_dir)
+
+    self.assertEqual(parallel.vocabulary.tokens, serial.vocabulary.tokens)
+    self.assertEqual(len(parallel_processed), len(serial_processed))
+
+    # States are given the same ids either way, so the tables are identical down to their bytes
+    serial.lookback_states.commit()
+    parallel.lookback_states.commit()
+    self.assertEqual(parallel.lookback_states.getArrays(), serial.lookback_states.getArrays())
+
+    for (parallel_result, serial_result) in zip(parallel_processed, serial_processed):
+      (nick, user_tuples, vocabulary_size, state_count) = parallel_result
+      (serial_nick, serial_user_tuples, serial_vocabulary_size, serial_state_count) = serial_result
+      self.assertEqual(nick, serial_nick)
+      self.assertEqual(vocabulary_size, serial_vocabulary_size)
+      self.assertEqual(state_count, serial_state_count)
+      self.assertEqual(user_tuples.starters.getCounts(), serial_user_tuples.starters.getCounts())
+      self.assertEqual(user_tuples.urls.getCounts(), serial_user_tuples.urls.getCounts())
+      self.assertTablesEqual(user_tuples.all_lookbacks, serial_user_tuples.all_lookbacks)
+      self.assertEqual(user_tuples.all_lookbacks.getArrays(), serial_user_tuples.all_lookbacks.getArrays())
+      for opener in config.OPENERS_TO_CLOSERS:
+        self.assertTablesEqual(user_tuples.closing_lookbacks[opener], serial_user_tuples.closing_lookbacks[opener])
+
+
+  def test_process_sources_parallel_matches_serial(self):
+
+    sources = {
+      "almond" : ["a b c d", "a b c e", "(f g h) i", "http://a.b.com j k", "(a b http://e.f.com) c"],
+      "birch" : ["a b [c d] e", "l m n", "q http://c.d.com r"],
+      "cedar" : ["x"],
+      "dogwood" : ["m n o p", "z y a b c"],
+    }
+
+    self.assertParallelMatchesSerial(sources, 2)
+
+
+  @patch("generator.config.CHUNKED_PARSE_MIN_BYTES", 0)
+  def test_process_sources_parallel_chunked_matches_serial(self):
+
+    sources = {
+      "all" : ["a b c d", "a b c e", "(f g h) i", "http://a.b.com j k", "a b [c d] e", "l m n", "x", "m n o p", \
+        "q http://c.d.com r", "z y a b c", "c d e f g"],
+      "birch" : ["a b [c d] e", "l m n"],
+    }
+
+    self.assertParallelMatchesSerial(sources, 3)
+
+
+  # Enough distinct lookbacks for the order of the maps holding them to differ between the builds
+  @patch("generator.config.CHUNKED_PARSE_MIN_BYTES", 0)
+  def test_process_sources_parallel_many_lookbacks_matches_serial(self):
+
+    rng = random.Random(4)
+    sources = {}
+    for nick in ["almond", "birch"]:
+      sources[nick] = [" ".join(["w%d" % rng.randrange(300) for i in range(0, 8)]) for line in range(0, 300)]
+
+    self.assertParallelMatchesSerial(sources, 3)
+
+
+  # More distinct tokens than fit in keys of a smaller KEY_BITS, all in one source after another that fits
+  def getWideSources(self):
+
+    words = ["w%d" % i for i in range(0, 400)]
+
+    return {
+      "almond" : ["a b c d", "a b c e"],
+      "birch" : [" ".join(words[i:i + 5]) for i in range(0, len(words), 5)],
+      "cedar" : ["a b w399 f"],
+    }
+
+
+  @patch("generator.transitions.KEY_BITS", 16)
+  def test_build_more_tokens_than_fit(self):
+
+    source_dir = tempfile.mkdtemp()
+    writeSources(source_dir, self.getWideSources())
+
+    generator = Generator(build_workers=1)
+    try:
+      generator.build(source_dir)
+    finally:
+      shutil.rmtree(source_dir)
+
+    self.assertTrue(len(generator.vocabulary) > 1 << 8)
+    self.assertTrue(generator.lookback_states.packer.wide)
+
+    (_, quote) = generator.generate([(0, "birch")], ("w300",), increment_quote_count=False)
+    self.assertEqual(quote, "w300 w301 w302 w303 w304")
+    (_, quote) = generator.generate([(0, "cedar")], ("w399",), increment_quote_count=False)
+    self.assertEqual(quote, "w399 f")
+
+    # A table built before the states were packed wide keeps its narrower suffix index, which holds no newer tokens
+    almond = generator.users.getAllLookbacks("almond")
+    self.assertFalse(almond.suffix_index.packer.wide)
+    self.assertEqual(almond.sampleSuffix((generator.vocabulary.getId("b"),)), generator.vocabulary.getId("c"))
+    self.assertEqual(almond.sampleSuffix((generator.vocabulary.getId("w399"),)), None)
+
+    cedar = generator.users.getAllLookbacks("cedar")
+    self.assertTrue(cedar.suffix_index.packer.wide)
+    self.assertEqual(cedar.sampleSuffix((generator.vocabulary.getId("w399"),)), generator.vocabulary.getId("f"))
+
+
+  @patch("generator.transitions.KEY_BITS", 16)
+  def test_process_sources_parallel_more_tokens_than_fit_matches_serial(self):
+    self.assertParallelMatchesSerial(self.getWideSources(), 2)
+
+
+  def test_get_chunks(self):
+
+    source_dir = tempfile.mkdtemp()
+    (source_filepath,) = writeSources(source_dir, {"almond" : ["a b c d", "e f", "g h i j k l", "m"]})
+
+    try:
+
+      with patch("generator.config.CHUNKED_PARSE_MIN_BYTES", 0):
+        chunks = GeneratorUtil.getChunks(source_filepath, 3)
+        too_many_chunks = GeneratorUtil.getChunks(source_filepath, 100)
+
+      with patch("generator.config.CHUNKED_PARSE_MIN_BYTES", 1000):
+        small_chunks = GeneratorUtil.getChunks(source_filepath, 3)
+
+      source_file = open(source_filepath, "r")
+      contents = source_file.read()
+      lines = []
+      for (start, end) in chunks:
+        source_file.seek(start)
+        lines += list(GeneratorUtil.readLines(source_file, end - start))
+      source_file.close()
+
+    finally:
+      shutil.rmtree(source_dir)
+
+    self.assertEqual(chunks, [(0, 8), (8, 24), (24, 26)])
+    self.assertEqual(len(too_many_chunks), 4)
+    self.assertEqual(small_chunks, [(0, len(contents))])
+    self.assertEqual("".join(lines), contents)
+
+
   def test_get_generic_statistics_empty(self):
 
     time = 818
@@ -397,6 +570,7 @@ class TestGenerator(unittest.TestCase):
     self.users_instance.countUsers.return_value = user_count
     self.users_instance.getBiggestUsers.return_value = None
     self.users_instance.getMostQuoted.return_value = None
+    self.users_instance.getModelCacheStatistics.return_value = None
 
     self.generator.init(self.users_instance, {}, time)
     stats = self.generator.getGenericStatistics()
@@ -407,6 +581,7 @@ class TestGenerator(unittest.TestCase):
     self.assertTrue(GenericStatisticType.SOURCE_CHANNELS in stats)
     self.assertTrue(GenericStatisticType.BIGGEST_USERS in stats)
     self.assertTrue(GenericStatisticType.MOST_QUOTED_USERS in stats)
+    self.assertTrue(GenericStatisticType.MODEL_CACHE in stats)
 
     self.assertEqual(stats[GenericStatisticType.USER_COUNT], user_count)
     self.assertEqual(stats[GenericStatisticType.DATE_STARTED], time)
@@ -418,6 +593,7 @@ class TestGenerator(unittest.TestCase):
 
     self.assertEqual(stats[GenericStatisticType.BIGGEST_USERS], None)
     self.assertEqual(stats[GenericStatisticType.MOST_QUOTED_USERS], None)
+    self.assertEqual(stats[GenericStatisticType.MODEL_CACHE], None)
 
 
   def test_get_generic_statistics_nonempty(self):
@@ -524,7 +700,7 @@ class TestGenerator(unittest.TestCase):
 
     self.assertEqual(len(nicks), 1)
     self.assertEqual(nicks[0], self.saoi_nick)
-    self.assertEqual(quote, ' '.join(list(self.starters[self.saoi_nick][0])))
+    self.assertEqual(quote, ' '.join(self.generator.vocabulary.getTokens(self.starters[self.saoi_nick][0])))
 
 
   def test_generate_nonrandom_known_single(self):
@@ -619,6 +795,7 @@ class TestGenerator(unittest.TestCase):
     self.users_instance.getRealNicks.return_value = [self.saoi_nick, self.file_nick]
     self.users_instance.getStarters.side_effect = self.starters_side_effect
     self.users_instance.getAllLookbacks.side_effect = self.all_lookbacks_side_effect
+    self.users_instance.getClosingLookbacks.side_effect = self.closing_lookbacks_side_effect
 
     self.generator.init(self.users_instance, {}, 0)
     nicks, quote = self.generator.generate(nick_tuples)
@@ -648,6 +825,431 @@ class TestGenerator(unittest.TestCase):
     self.assertTrue(quote in self.quotes[self.bard_nick])
 
 
+  def test_generate_order_lower(self):
+
+    nick_tuples = [(users.UserNickType.NONRANDOM, self.poet_nick)]
+
+    self.users_instance.getRealNicks.return_value = [self.poet_nick]
+    self.users_instance.getStarters.side_effect = self.starters_side_effect
+    self.users_instance.getAllLookbacks.side_effect = self.all_lookbacks_side_effect
+
+    self.generator.init(self.users_instance, {}, 0)
+
+    nicks, quote = self.generator.generate(nick_tuples, ("is", "binn"), order=1)
+    self.assertEqual(quote, "is binn béal ina thost")
+
+    # Only the last word is looked at, so "ciaróg" may follow itself any number of times
+    quotes = set()
+    for i in range(0, 50):
+      nicks, quote = self.generator.generate(nick_tuples, ("aithníonn", "ciaróg"), order=1)
+      quotes.add(quote)
+
+    self.assertTrue("aithníonn ciaróg eile" in quotes)
+    self.assertTrue("aithníonn ciaróg ciaróg ciaróg eile" in quotes)
+
+
+  # While the parenthesis is open, only the URL closing it may follow, though all URLs are held as one token
+  def test_generate_closes_with_url(self):
+
+    source_dir = tempfile.mkdtemp()
+    writeSources(source_dir, {"almond" : ["(a b http://c.d.com) e", "(a b http://f.g.com h"]})
+
+    walker = Generator()
+    try:
+      walker.build(source_dir)
+    finally:
+      shutil.rmtree(source_dir)
+
+    user_tuples = walker.getTuples(["almond"])
+    initial = (walker.vocabulary.getId("(a"), walker.vocabulary.getId("b"))
+
+    quotes = set([walker.generateFromInitial(user_tuples, initial) for i in range(0, 50)])
+
+    self.assertEqual(quotes, {"(a b http://c.d.com) e", "(a b http://c.d.com) h"})
+
+
+  def test_get_follow_backs_off(self):
+
+    all_lookbacks = TransitionTable.fromLookbacks(LookbackStates(2), {(2, 3) : {4 : 1}, (5, 4) : {6 : 1}})
+    user_tuples = UserTuples(all_lookbacks, {}, [], [])
+
+    self.assertEqual(Generator.getFollow(user_tuples, all_lookbacks.lookback_states.packer.pack((2, 3)), [], 2), 4)
+    self.assertEqual(Generator.getFollow(user_tuples, all_lookbacks.lookback_states.packer.pack((3, 4)), [], 2), 6)
+    self.assertEqual(Generator.getFollow(user_tuples, all_lookbacks.lookback_states.packer.pack((3, 7)), [], 2), None)
+
+
+  def test_walk_by_rows_matches_lookups(self):
+
+    source_dir = tempfile.mkdtemp()
+    writeSources(source_dir, {"almond" : ["a b c a b d", "(e a b) c a b", "c a b http://a.b.com", "b c (a b c", \
+      "(a b http://c.d.com) c a"]})
+
+    walker = Generator()
+    try:
+      walker.build(source_dir)
+    finally:
+      shutil.rmtree(source_dir)
+
+    user_tuples = walker.getTuples(["almond"])
+
+    for starter in set(user_tuples.starters):
+      for seed in range(0, 10):
+
+        random.seed(seed)
+        by_rows = walker.generateFromInitial(user_tuples, starter)
+
+        # Only single tables are walked by row, so this makes the walk look up each lookback as it comes
+        random.seed(seed)
+        with patch(generator.__name__ + ".TransitionTable", UnionTable):
+          by_lookups = walker.generateFromInitial(user_tuples, starter)
+
+        self.assertEqual(by_rows, by_lookups)
+
+
+  @patch("generator.config.OUTPUT_WORDS_MAX", 6)
+  def test_walk_takes_runs_whole(self):
+
+    source_dir = tempfile.mkdtemp()
+    writeSources(source_dir, {"almond" : ["a b (c d) e f g h", "x y http://a.b.com"]})
+
+    walker = Generator()
+    try:
+      walker.build(source_dir)
+    finally:
+      shutil.rmtree(source_dir)
+
+    user_tuples = walker.getTuples(["almond"])
+    starter = walker.vocabulary.getIds(["a", "b"])
+
+    # Every lookback has a single successor, so the whole line is one run, and nothing is drawn along it
+    with patch(transitions.__name__ + ".random.randrange") as randrange_mock:
+      self.assertEqual(walker.generateFromInitial(user_tuples, starter), "a b (c d) e f")
+      self.assertEqual(walker.generateFromInitial(user_tuples, walker.vocabulary.getIds(["b", "(c"])), "b (c d) e f g")
+      self.assertFalse(randrange_mock.called)
+
+    # The URL is substituted as it is taken, and the run ending after it leads to no row
+    self.assertTrue(walker.generateFromInitial(user_tuples, walker.vocabulary.getIds(["x", "y"])).startswith("x y http"))
+
+
+  def test_get_order(self):
+
+    self.assertEqual(self.generator.getOrder(None), config.LOOKBACK_LEN)
+    self.assertEqual(self.generator.getOrder(1), 1)
+    self.assertEqual(self.generator.getOrder(config.LOOKBACK_LEN + 5), config.LOOKBACK_LEN)
+
+
+  def test_generate_words(self):
+
+    nick_tuples = [(users.UserNickType.NONRANDOM, self.poet_nick)]
+
+    self.users_instance.getRealNicks.return_value = [self.poet_nick]
+    self.users_instance.getStarters.side_effect = self.starters_side_effect
+    self.users_instance.getAllLookbacks.side_effect = self.all_lookbacks_side_effect
+
+    self.generator.init(self.users_instance, {}, 0)
+    nicks, words = self.generator.generateWords(nick_tuples, ("is", "binn"))
+
+    self.assertEqual(nicks, [self.poet_nick])
+    self.assertEqual(list(words), ["is", "binn", "béal", "ina", "thost"])
+
+
+  def test_generate_words_unknown(self):
+
+    self.users_instance.getRealNicks.return_value = []
+
+    self.generator.init(self.users_instance, {}, 0)
+    nicks, words = self.generator.generateWords([])
+
+    self.assertEqual(nicks, [])
+    self.assertEqual(list(words), [])
+
+
+  @patch("generator.config.OUTPUT_WORDS_MAX", 4)
+  def test_generate_words_closes_parentheses_on_last_word(self):
+
+    nick_tuples = [(users.UserNickType.NONRANDOM, self.bard_nick)]
+
+    self.users_instance.getRealNicks.return_value = [self.bard_nick]
+    self.users_instance.getStarters.side_effect = self.starters_side_effect
+    self.users_instance.getAllLookbacks.side_effect = self.all_lookbacks_side_effect
+    self.users_instance.getClosingLookbacks.side_effect = self.closing_lookbacks_side_effect
+
+    self.generator.init(self.users_instance, {}, 0)
+    nicks, words = self.generator.generateWords(nick_tuples, ("is", "olc"))
+
+    self.assertEqual(list(words), ["is", "olc", "(an", "ghaoth)"])
+
+
+  def test_generate_many(self):
+
+    nick_tuples = [(users.UserNickType.NONRANDOM, self.poet_nick)]
+
+    self.users_instance.getRealNicks.return_value = [self.poet_nick]
+    self.users_instance.getStarters.side_effect = self.starters_side_effect
+    self.users_instance.getAllLookbacks.side_effect = self.all_lookbacks_side_effect
+
+    self.generator.init(self.users_instance, {}, 0)
+    nicks, quotes = self.generator.generateMany(nick_tuples, 20)
+
+    self.assertEqual(nicks, [self.poet_nick])
+    self.assertEqual(len(quotes), 20)
+    self.assertEqual(set(quotes), set(self.quotes[self.poet_nick]))
+    self.assertEqual(self.users_instance.getRealNicks.call_count, 1)
+    self.assertEqual(self.users_instance.getAllLookbacks.call_count, 1)
+
+
+  def test_generate_many_unique(self):
+
+    nick_tuples = [(users.UserNickType.NONRANDOM, self.poet_nick)]
+
+    self.users_instance.getRealNicks.return_value = [self.poet_nick]
+    self.users_instance.getStarters.side_effect = self.starters_side_effect
+    self.users_instance.getAllLookbacks.side_effect = self.all_lookbacks_side_effect
+
+    self.generator.init(self.users_instance, {}, 0)
+    nicks, quotes = self.generator.generateMany(nick_tuples, 5, unique=True)
+
+    self.assertEqual(sorted(quotes), sorted(self.quotes[self.poet_nick]))
+
+
+  def test_generate_many_seeded(self):
+
+    nick_tuples = [(users.UserNickType.NONRANDOM, self.poet_nick)]
+
+    self.users_instance.getRealNicks.return_value = [self.poet_nick]
+    self.users_instance.getStarters.side_effect = self.starters_side_effect
+    self.users_instance.getAllLookbacks.side_effect = self.all_lookbacks_side_effect
+
+    self.generator.init(self.users_instance, {}, 0)
+    nicks, quotes1 = self.generator.generateMany(nick_tuples, 10, seed=7)
+    nicks, quotes2 = self.generator.generateMany(nick_tuples, 10, seed=7)
+
+    self.assertEqual(quotes1, quotes2)
+
+
+  def test_generate_many_initial_short(self):
+
+    nick_tuples = [(users.UserNickType.NONRANDOM, self.poet_nick)]
+
+    self.users_instance.getRealNicks.return_value = [self.poet_nick]
+    self.users_instance.getStarters.side_effect = self.starters_side_effect
+    self.users_instance.getAllLookbacks.side_effect = self.all_lookbacks_side_effect
+
+    self.generator.init(self.users_instance, {}, 0)
+    nicks, quotes = self.generator.generateMany(nick_tuples, 3, initial=("is",))
+
+    self.assertEqual(quotes, ["is binn béal ina thost"] * 3)
+
+
+  def test_generate_many_initial_unknown(self):
+
+    nick_tuples = [(users.UserNickType.NONRANDOM, self.poet_nick)]
+
+    self.users_instance.getRealNicks.return_value = [self.poet_nick]
+    self.users_instance.getStarters.side_effect = self.starters_side_effect
+    self.users_instance.getAllLookbacks.side_effect = self.all_lookbacks_side_effect
+
+    self.generator.init(self.users_instance, {}, 0)
+    nicks, quotes = self.generator.generateMany(nick_tuples, 3, initial=("is", "maith"))
+
+    self.assertEqual(nicks, [])
+    self.assertEqual(quotes, [])
+
+
+class TestCompositeModel(unittest.TestCase):
+
+  def setUp(self):
+
+    self.source_dir = tempfile.mkdtemp()
+
+    writeSource(self.source_dir, "almond", ["a b c d", "(f g h) i"])
+    writeSource(self.source_dir, "birch", ["a b e", "l m n"])
+    writeSource(self.source_dir, "all", ["x y z"])
+
+    self.generator = Generator(composite_nick="all")
+    self.generator.build(self.source_dir)
+
+
+  def tearDown(self):
+    shutil.rmtree(self.source_dir)
+
+
+  def getCompositeCounts(self, lookback):
+    return self.generator.users.getAllLookbacks("all").getCounts(self.generator.vocabulary.getIds(lookback))
+
+
+  def test_build_composite(self):
+
+    composite = self.generator.users.getByAlias("all")
+
+    self.assertEqual(self.generator.users.countUsers(), 2)
+    self.assertEqual(composite.production_count, 10)
+    self.assertEqual(composite.starter_count, 4)
+    self.assertEqual(sorted(self.getCompositeCounts(("a", "b")).values()), [1, 1])
+
+    nicks, quote = self.generator.generate([(0, "all")], ("l",))
+    self.assertEqual(nicks, ["all"])
+    self.assertEqual(quote, "l m n")
+
+    nicks, quote = self.generator.generate([(0, "all")], ("(f",))
+    self.assertEqual(quote, "(f g h) i")
+
+
+  def test_build_composite_ignores_source(self):
+
+    nicks, quote = self.generator.generate([(0, "all")], ("x",))
+    self.assertEqual(quote, "")
+
+
+  def test_reload_user_updates_composite(self):
+
+    writeSource(self.source_dir, "birch", ["a b c d", "p q r"])
+    self.generator.reloadUser("birch")
+
+    composite = self.generator.users.getByAlias("all")
+
+    self.assertEqual(composite.production_count, 11)
+    self.assertEqual(self.getCompositeCounts(("a", "b")).values(), [2])
+    self.assertFalse(self.generator.vocabulary.getIds(("l", "m")) in composite.all_lookbacks)
+
+    nicks, quote = self.generator.generate([(0, "all")], ("p",))
+    self.assertEqual(quote, "p q r")
+
+    nicks, quote = self.generator.generate([(0, "all")], ("l",))
+    self.assertEqual(quote, "")
+
+
+  # Only the rows of the user's lookbacks are built again, rather than the composite's tables merged afresh
+  def test_reload_user_updates_composite_rows(self):
+
+    writeSource(self.source_dir, "birch", ["a b c d", "p q r"])
+
+    with mock.patch.object(TransitionTable, "merge") as merge:
+      self.generator.reloadUser("birch")
+
+    self.assertFalse(merge.called)
+    self.assertEqual(self.getCompositeCounts(("a", "b")).values(), [2])
+    self.assertEqual(self.getCompositeCounts(("p", "q")).values(), [1])
+    self.assertEqual(self.getCompositeCounts(("l", "m")), {})
+
+
+  def test_reload_user_updates_composite_lazy(self):
+
+    generator = Generator(lazy_models=True, composite_nick="all")
+    generator.build(self.source_dir)
+
+    writeSource(self.source_dir, "birch", ["p q r"])
+    generator.reloadUser("birch")
+
+    nicks, quote = generator.generate([(0, "all")], ("p",))
+    self.assertEqual(quote, "p q r")
+    self.assertEqual(generator.users.getByAlias("all").production_count, 8)
+
+
+class TestQuotePools(unittest.TestCase):
+
+  def setUp(self):
+
+    self.source_dir = tempfile.mkdtemp()
+
+    writeSource(self.source_dir, "almond", ["a b c d"])
+    writeSource(self.source_dir, "birch", ["l m n"])
+
+    self.generator = Generator(quote_pool_depth=3)
+    self.generator.build(self.source_dir)
+
+    # Counts persisted by other tests would make other users hot
+    for user in self.generator.users.userset:
+      user.quotes_requested = 0
+
+
+  def tearDown(self):
+    shutil.rmtree(self.source_dir)
+
+
+  def test_generate_hot_user_from_pool(self):
+
+    self.generator.generate([(UserNickType.NONRANDOM, "almond")])
+    self.assertEqual(self.generator.refillPools(10), 3)
+    self.assertEqual(self.generator.refillPools(10), 0)
+
+    nicks, quote = self.generator.generate([(UserNickType.NONRANDOM, "almond")])
+
+    self.assertEqual((nicks, quote), (["almond"], "a b c d"))
+    self.assertEqual(self.generator.users.getByAlias("almond").quotes_requested, 2)
+
+    stats = self.generator.getQuotePoolStatistics()
+    self.assertEqual((stats.pool_count, stats.quote_count, stats.hits, stats.misses, stats.refills), (1, 2, 1, 0, 3))
+
+
+  def test_generate_random_from_pool(self):
+
+    nicks, quote = self.generator.generate([(UserNickType.RANDOM, "")], None, 0, False)
+    self.assertTrue(nicks)
+
+    self.assertEqual(self.generator.refillPools(2), 2)
+    self.assertEqual(len(self.generator.quote_pool.pools[(UserNickType.RANDOM, 0)]), 2)
+
+    nicks, quote = self.generator.generate([(UserNickType.RANDOM, "")], None, 0, False)
+    self.assertTrue((nicks, quote) in [(["almond"], "a b c d"), (["birch"], "l m n")])
+    self.assertEqual(self.generator.quote_pool.hits, 1)
+    self.assertEqual(self.generator.quote_pool.misses, 1)
+
+
+  def test_refill_pools_skips_unloaded_users(self):
+
+    generator = Generator(lazy_models=True, quote_pool_depth=3)
+    generator.build(self.source_dir)
+    generator.users.model_cache.budget = 0
+
+    for user in generator.users.userset:
+      user.quotes_requested = 0
+
+    generator.generate([(UserNickType.RANDOM, "")], None, 0, False)
+    generator.generate([(UserNickType.NONRANDOM, "almond")], None, 0, False)
+    generator.generate([(UserNickType.NONRANDOM, "birch")], None, 0, False)
+    generator.users.getByAlias("almond").quotes_requested = 1
+    generator.users.getByAlias("birch").quotes_requested = 1
+    misses = generator.users.model_cache.misses
+
+    self.assertEqual(generator.refillPools(10), 3)
+    self.assertEqual(generator.users.model_cache.misses, misses)
+    self.assertEqual(len(generator.quote_pool.pools["birch"]), 3)
+    self.assertEqual(len(generator.quote_pool.pools["almond"]), 0)
+    self.assertEqual(len(generator.quote_pool.pools[(UserNickType.RANDOM, 0)]), 0)
+
+
+  def test_generate_pool_not_used_for_seeds(self):
+
+    self.generator.generate([(UserNickType.NONRANDOM, "almond")])
+    self.generator.refillPools(10)
+
+    nicks, quote = self.generator.generate([(UserNickType.NONRANDOM, "almond")], ("c",))
+
+    self.assertEqual(quote, "c d")
+    self.assertEqual(len(self.generator.quote_pool.pools["almond"]), 3)
+
+
+  def test_reload_user_discards_pooled(self):
+
+    self.generator.generate([(UserNickType.NONRANDOM, "almond")])
+    self.generator.refillPools(10)
+
+    writeSource(self.source_dir, "almond", ["p q r"])
+    self.generator.reloadUser("almond")
+
+    nicks, quote = self.generator.generate([(UserNickType.NONRANDOM, "almond")])
+    self.assertEqual(quote, "p q r")
+
+
+  def test_no_pool(self):
+
+    generator = Generator()
+    generator.build(self.source_dir)
+
+    self.assertEqual(generator.refillPools(10), 0)
+    self.assertEqual(generator.getQuotePoolStatistics(), None)
+
+
 if __name__ == "__main__":
   unittest.main()
-
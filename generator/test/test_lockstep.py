@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+from mock import patch
+import shutil
+import tempfile
+import unittest
+
+from generator import config
+from generator import lockstep
+from generator.generator import Generator
+from generator.generator import UserTuples
+from generator.lockstep import LockstepEngine
+from generator.test.sources import writeSources
+from generator.union import UnionTable
+
+
+@unittest.skipIf(lockstep.numpy is None, "NumPy is not installed")
+class TestLockstepEngine(unittest.TestCase):
+
+  def setUp(self):
+
+    self.source_dir = tempfile.mkdtemp()
+
+    sources = {
+      "almond" : ["a b c d e f", "(g h i] j", "(k l (m n) o", "p q r s t u"],
+      "birch" : ["see http://a.b.com now", "[x y z"],
+      "cedar" : ["(v w http://c.d.com) now", "(v w http://e.f.com then"],
+    }
+
+    writeSources(self.source_dir, sources)
+
+    self.generator = Generator()
+    self.generator.build(self.source_dir)
+
+
+  def tearDown(self):
+    shutil.rmtree(self.source_dir)
+
+
+  def generate(self, nick, count=config.LOCKSTEP_MIN_QUOTES):
+
+    user_tuples = self.generator.getTuples([nick])
+    quotes = self.generator.lockstep.generate(user_tuples, user_tuples.starters, count)
+    self.assertEqual(len(quotes), count)
+
+    return quotes
+
+
+  def test_generate_matches_scalar(self):
+
+    user_tuples = self.generator.getTuples(["almond"])
+    expected = set([self.generator.generateFromInitial(user_tuples, starter) for starter in user_tuples.starters])
+
+    self.assertEqual(set(self.generate("almond")), expected)
+    self.assertTrue("(g h i j)" in expected)
+    self.assertTrue("(k l (m n) o)" in expected)
+
+
+  def test_generate_substitutes_urls(self):
+    self.assertEqual(set(self.generate("birch")), {"see http://a.b.com now", "[x y z]"})
+
+
+  def test_generate_closes_with_url(self):
+    self.assertTrue(set(self.generate("cedar")) <= {"(v w http://c.d.com) now", "(v w http://c.d.com) then"})
+
+
+  @patch("generator.config.OUTPUT_WORDS_MAX", 4)
+  def test_generate_words_max(self):
+
+    quotes = self.generate("almond")
+
+    self.assertTrue("a b c d" in quotes)
+    self.assertTrue("(k l (m n))" in quotes)
+
+
+  def test_generate_many_uses_lockstep(self):
+
+    with patch.object(LockstepEngine, "generate", wraps=self.generator.lockstep.generate) as generate:
+      nicks, quotes = self.generator.generateMany([(0, "almond")], config.LOCKSTEP_MIN_QUOTES, initial=("p",))
+
+    self.assertTrue(generate.called)
+    self.assertEqual(quotes, ["p q r s t u"] * config.LOCKSTEP_MIN_QUOTES)
+
+
+  def test_cannot_walk_views(self):
+
+    user_tuples = self.generator.getTuples(["almond"])
+    union_tuples = UserTuples(UnionTable([user_tuples.all_lookbacks]), None, None, None)
+
+    self.assertTrue(LockstepEngine.canWalk(user_tuples))
+    self.assertFalse(LockstepEngine.canWalk(union_tuples))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from generator.generator import Generator
+from generator.modelcache import MergedModelCache
+from generator.modelcache import ModelCache
+from generator.modelfile import ModelFile
+from generator.test.sources import writeSource
+from generator.test.sources import writeSources
+
+
+class TestModelCache(unittest.TestCase):
+
+  def setUp(self):
+
+    self.cache = ModelCache(100)
+    self.users = {}
+
+    for (nick, size) in [("almond", 40), ("birch", 50), ("cedar", 30), ("dogwood", 150)]:
+      user = mock.Mock()
+      user.nick = nick
+      user.countModelBytes.return_value = size
+      self.users[nick] = user
+
+
+  def test_load_miss_then_hit(self):
+
+    self.cache.load(self.users["almond"])
+    self.cache.load(self.users["almond"])
+
+    self.assertEqual(self.users["almond"].loadModel.call_count, 1)
+    self.assertEqual(self.cache.hits, 1)
+    self.assertEqual(self.cache.misses, 1)
+    self.assertEqual(self.cache.size, 40)
+
+
+  def test_load_evicts_least_recently_used(self):
+
+    self.cache.load(self.users["almond"])
+    self.cache.load(self.users["birch"])
+    self.cache.load(self.users["almond"])
+    self.cache.load(self.users["cedar"])
+
+    self.assertTrue("almond" in self.cache)
+    self.assertFalse("birch" in self.cache)
+    self.assertTrue("cedar" in self.cache)
+    self.assertTrue(self.users["birch"].unloadModel.called)
+    self.assertEqual(self.cache.evictions, 1)
+    self.assertEqual(self.cache.size, 70)
+
+
+  def test_load_over_budget_keeps_last(self):
+
+    self.cache.load(self.users["almond"])
+    self.cache.load(self.users["dogwood"])
+
+    self.assertEqual(len(self.cache), 1)
+    self.assertTrue("dogwood" in self.cache)
+    self.assertEqual(self.cache.evictions, 1)
+
+
+  def test_discard(self):
+
+    self.cache.load(self.users["almond"])
+    self.cache.discard("almond")
+    self.cache.discard("birch")
+
+    self.assertFalse("almond" in self.cache)
+    self.assertEqual(self.cache.size, 0)
+    self.assertTrue(self.users["almond"].unloadModel.called)
+
+
+  def test_get_statistics(self):
+
+    self.cache.load(self.users["almond"])
+    self.cache.load(self.users["almond"])
+
+    stats = self.cache.getStatistics()
+
+    self.assertEqual(stats.model_count, 1)
+    self.assertEqual(stats.size, 40)
+    self.assertEqual(stats.budget, 100)
+    self.assertEqual(stats.hits, 1)
+    self.assertEqual(stats.misses, 1)
+    self.assertEqual(stats.evictions, 0)
+
+
+class TestMergedModelCache(unittest.TestCase):
+
+  def setUp(self):
+
+    self.cache = MergedModelCache(100, 2)
+    self.almond_birch = (("almond", 1), ("birch", 1))
+    self.almond_cedar = (("almond", 1), ("cedar", 2))
+    self.birch_cedar = (("birch", 1), ("cedar", 1))
+
+
+  def build(self, size):
+    return mock.Mock(return_value=("model", size))
+
+
+  def test_get_builds_on_repeat_request(self):
+
+    build = self.build(40)
+
+    self.assertEqual(self.cache.get(self.almond_birch, build), None)
+    self.assertFalse(build.called)
+
+    self.assertEqual(self.cache.get(self.almond_birch, build), "model")
+    self.assertEqual(self.cache.get(self.almond_birch, build), "model")
+
+    self.assertEqual(build.call_count, 1)
+    self.assertEqual(self.cache.hits, 1)
+    self.assertEqual(self.cache.misses, 2)
+    self.assertEqual(self.cache.size, 40)
+
+
+  def test_get_evicts_least_recently_used(self):
+
+    for key in [self.almond_birch, self.almond_birch, self.almond_cedar, self.almond_cedar, self.almond_birch, \
+      self.birch_cedar, self.birch_cedar]:
+      self.cache.get(key, self.build(40))
+
+    self.assertTrue(self.almond_birch in self.cache)
+    self.assertFalse(self.almond_cedar in self.cache)
+    self.assertTrue(self.birch_cedar in self.cache)
+    self.assertEqual(self.cache.evictions, 1)
+    self.assertEqual(self.cache.size, 80)
+
+
+  def test_get_forced(self):
+
+    build = self.build(40)
+
+    self.assertEqual(self.cache.get(self.almond_birch, build, force=True), "model")
+    self.assertTrue(self.almond_birch in self.cache)
+
+
+  def test_get_too_big_not_cached(self):
+
+    build = self.build(400)
+
+    self.cache.get(self.almond_birch, build)
+    self.assertEqual(self.cache.get(self.almond_birch, build), "model")
+
+    self.assertEqual(len(self.cache), 0)
+    self.assertEqual(self.cache.size, 0)
+
+    # Once found to be too big, the model is not built again
+    self.assertEqual(self.cache.get(self.almond_birch, build), None)
+    self.assertEqual(build.call_count, 1)
+
+
+  def test_get_estimated_too_big(self):
+
+    build = self.build(400)
+    estimate = mock.Mock(return_value=200)
+
+    for i in range(0, 3):
+      self.assertEqual(self.cache.get(self.almond_birch, build, estimate), None)
+
+    self.assertFalse(build.called)
+    self.assertEqual(estimate.call_count, 1)
+    self.assertTrue(self.almond_birch in self.cache.oversized)
+
+    self.assertEqual(self.cache.get(self.almond_birch, build, estimate, force=True), "model")
+    self.assertEqual(len(self.cache), 0)
+
+    self.cache.invalidate("birch")
+    self.assertFalse(self.almond_birch in self.cache.oversized)
+
+
+  def test_get_estimated_within_budget(self):
+
+    estimate = mock.Mock(return_value=30)
+
+    self.cache.get(self.almond_birch, self.build(40), estimate)
+    self.assertEqual(self.cache.get(self.almond_birch, self.build(40), estimate), "model")
+    self.assertEqual(self.cache.size, 40)
+
+
+  def test_invalidate(self):
+
+    for key in [self.almond_birch, self.almond_birch, self.birch_cedar, self.almond_cedar]:
+      self.cache.get(key, self.build(30))
+
+    self.cache.invalidate("birch")
+
+    self.assertFalse(self.almond_birch in self.cache)
+    self.assertEqual(self.cache.size, 0)
+    self.assertFalse(self.birch_cedar in self.cache.request_counts)
+    self.assertTrue(self.almond_cedar in self.cache.request_counts)
+
+
+class TestLazyModels(unittest.TestCase):
+
+  def setUp(self):
+
+    self.source_dir = tempfile.mkdtemp()
+
+    sources = {
+      "almond" : ["a b c d", "a b c e", "(f g h) i"],
+      "birch" : ["a b [c d] e", "l m n"],
+    }
+
+    writeSources(self.source_dir, sources)
+
+    self.generator = Generator(lazy_models=True)
+    self.generator.build(self.source_dir)
+
+
+  def tearDown(self):
+    shutil.rmtree(self.source_dir)
+
+
+  def test_build_keeps_index_only(self):
+
+    birch = self.generator.users.getByAlias("birch")
+
+    self.assertEqual(self.generator.users.countUsers(), 2)
+    self.assertEqual(birch.starter_count, 2)
+    self.assertEqual(birch.production_count, 6)
+    self.assertEqual(birch.all_lookbacks, None)
+    self.assertEqual(self.generator.users.getBiggestUsers()[0].nick, "almond")
+
+
+  def test_rebuild_reads_counts_only(self):
+
+    generator = Generator(lazy_models=True)
+    with mock.patch.object(ModelFile, "readUser") as read_user:
+      generator.build(self.source_dir)
+      self.assertFalse(read_user.called)
+
+    birch = generator.users.getByAlias("birch")
+    self.assertEqual(birch.starter_count, 2)
+    self.assertEqual(birch.production_count, 6)
+
+    nicks, quote = generator.generate([(0, "birch")], ("l",))
+    self.assertEqual(quote, "l m n")
+
+
+  def test_generate_loads_on_demand(self):
+
+    nicks, quote = self.generator.generate([(0, "birch")], ("l",))
+
+    self.assertEqual(quote, "l m n")
+
+    stats = self.generator.users.getModelCacheStatistics()
+    self.assertEqual(stats.model_count, 1)
+    self.assertEqual(stats.misses, 1)
+    self.assertTrue(stats.size > 0)
+
+
+  def test_load_replaced_model_from_source(self):
+
+    # A model rewritten by another build may refer to another vocabulary, so it must not be used
+    model_filepath = ModelFile.getUserFilepath(Generator.getModelDir(self.source_dir), "birch")
+    os.rename(model_filepath, model_filepath + ".old")
+    shutil.copy(model_filepath + ".old", model_filepath)
+
+    with mock.patch.object(ModelFile, "readUser") as read_user:
+      nicks, quote = self.generator.generate([(0, "birch")], ("l",))
+      self.assertFalse(read_user.called)
+
+    self.assertEqual(quote, "l m n")
+
+
+class TestMergedModels(unittest.TestCase):
+
+  def setUp(self):
+
+    self.source_dir = tempfile.mkdtemp()
+
+    writeSource(self.source_dir, "almond", ["a b c d"])
+    writeSource(self.source_dir, "birch", ["l m n"])
+
+    self.generator = Generator()
+    self.generator.build(self.source_dir)
+
+    self.nick_tuples = [(0, "almond"), (0, "birch")]
+
+
+  def tearDown(self):
+    shutil.rmtree(self.source_dir)
+
+
+  def test_generate_repeated_pair_merged(self):
+
+    self.generator.generate(self.nick_tuples, ("l",), increment_quote_count=False)
+    self.assertEqual(len(self.generator.merged_cache), 0)
+
+    nicks, quote = self.generator.generate(self.nick_tuples, ("l",), increment_quote_count=False)
+    self.assertEqual(len(self.generator.merged_cache), 1)
+    self.assertEqual(quote, "l m n")
+
+    nicks, quote = self.generator.generate(list(reversed(self.nick_tuples)), ("a",), increment_quote_count=False)
+    self.assertEqual(quote, "a b c d")
+    self.assertEqual(self.generator.merged_cache.hits, 1)
+
+
+  def test_generate_pair_too_big_not_merged(self):
+
+    self.generator.merged_cache.budget = 1
+
+    with mock.patch.object(self.generator, "mergeTuples") as merge_tuples:
+      for i in range(0, 3):
+        nicks, quote = self.generator.generate(self.nick_tuples, ("l",), increment_quote_count=False)
+
+    self.assertFalse(merge_tuples.called)
+    self.assertEqual(quote, "l m n")
+    self.assertEqual(len(self.generator.merged_cache.oversized), 1)
+
+
+  def test_generate_many_merges_at_once(self):
+
+    nicks, quotes = self.generator.generateMany(self.nick_tuples, 3, initial=("l",))
+
+    self.assertEqual(len(self.generator.merged_cache), 1)
+    self.assertEqual(quotes, ["l m n"] * 3)
+
+
+  def test_reload_user_invalidates_merged(self):
+
+    self.generator.generate(self.nick_tuples, ("l",), increment_quote_count=False)
+    self.generator.generate(self.nick_tuples, ("l",), increment_quote_count=False)
+
+    writeSource(self.source_dir, "birch", ["l m o p"])
+    self.generator.reloadUser("birch")
+
+    self.assertEqual(len(self.generator.merged_cache), 0)
+    self.assertEqual(self.generator.users.getByAlias("birch").production_count, 3)
+
+    nicks, quote = self.generator.generate(self.nick_tuples, ("l",), increment_quote_count=False)
+    self.assertEqual(quote, "l m o p")
+
+
+  def test_reload_user_lazy(self):
+
+    generator = Generator(lazy_models=True)
+    generator.build(self.source_dir)
+    generator.generate([(0, "birch")], ("l",))
+
+    writeSource(self.source_dir, "birch", ["l m o p"])
+    generator.reloadUser("birch")
+
+    self.assertFalse("birch" in generator.users.model_cache)
+
+    nicks, quote = generator.generate([(0, "birch")], ("l",))
+    self.assertEqual(quote, "l m o p")
+
+
+if __name__ == "__main__":
+  unittest.main()
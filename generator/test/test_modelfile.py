@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+
+from array import array
+import mock
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from generator import config
+from generator import modelfile
+from generator.generator import Generator
+from generator.modelfile import MappedArray
+from generator.modelfile import ModelFile
+from generator.modelfile import ModelFormatError
+from generator.states import LookbackStates
+from generator.test.sources import writeSources
+
+
+class TestModelFile(unittest.TestCase):
+
+  def setUp(self):
+
+    self.source_dir = tempfile.mkdtemp()
+    self.model_dir = os.path.join(self.source_dir, config.MODEL_DIR_NAME)
+
+    self.sources = {
+      "almond" : ["a b c d", "a b c e", "(f g h) i", "http://a.b.com j k"],
+      "birch" : ["a b [c d] e", "l m n"],
+    }
+
+    writeSources(self.source_dir, self.sources)
+
+    self.generator = Generator()
+    self.users = self.generator.compile(self.source_dir)
+
+
+  def tearDown(self):
+    shutil.rmtree(self.source_dir)
+
+
+  def test_mapped_array(self):
+
+    values = array("I", [5, 0, 7, 12])
+    buf = "\0" * 8 + values.tostring()
+
+    mapped = MappedArray(buf, 8, "I", 4)
+
+    self.assertEqual(len(mapped), 4)
+    self.assertEqual(mapped[2], 7)
+    self.assertEqual(mapped[-1], 12)
+    self.assertEqual(mapped[1:3], [0, 7])
+    self.assertEqual(list(mapped), [5, 0, 7, 12])
+    self.assertEqual(mapped.tostring(), values.tostring())
+    self.assertRaises(IndexError, mapped.__getitem__, 4)
+
+
+  def test_compile_writes_files(self):
+
+    model_filenames = os.listdir(self.model_dir)
+
+    self.assertTrue(config.VOCABULARY_FILE_NAME in model_filenames)
+    self.assertTrue("almond" + config.MODEL_FILE_EXT in model_filenames)
+    self.assertTrue("birch" + config.MODEL_FILE_EXT in model_filenames)
+    self.assertEqual(sorted(self.users.usermap), ["almond", "birch"])
+
+
+  def test_read_vocabulary(self):
+
+    vocabulary = ModelFile.readVocabulary(os.path.join(self.model_dir, config.VOCABULARY_FILE_NAME))
+
+    self.assertEqual(vocabulary.tokens, self.generator.vocabulary.tokens)
+    self.assertEqual(vocabulary.ids, self.generator.vocabulary.ids)
+
+
+  def test_read_states(self):
+
+    lookback_states = ModelFile.readStates(os.path.join(self.model_dir, config.STATES_FILE_NAME), config.LOOKBACK_LEN)
+
+    self.assertEqual(lookback_states.getArrays(), self.generator.lookback_states.getArrays())
+    self.assertEqual(lookback_states.pending, {})
+    self.assertRaises(ModelFormatError, ModelFile.readStates, os.path.join(self.model_dir, config.STATES_FILE_NAME), \
+      config.LOOKBACK_LEN + 1)
+
+
+  def test_read_user_round_trip(self):
+
+    for nick in self.sources:
+
+      user_fields = ModelFile.readUser(ModelFile.getUserFilepath(self.model_dir, nick), self.generator.lookback_states, \
+        len(self.generator.vocabulary))
+
+      self.assertEqual(user_fields["nick"], nick)
+      (_, original) = self.generator.processSource(nick + config.SOURCEFILE_EXT, self.sources[nick])
+
+      self.assertEqual(user_fields["starters"].getCounts(), original.starters.getCounts())
+      self.assertEqual(user_fields["urls"].getCounts(), original.urls.getCounts())
+      self.assertEqual(user_fields["all_lookbacks"].countProductions(), original.all_lookbacks.countProductions())
+      self.assertEqual(sorted(user_fields["all_lookbacks"]), sorted(original.all_lookbacks))
+
+      for lookback in original.all_lookbacks:
+        self.assertEqual(user_fields["all_lookbacks"].getCounts(lookback), original.all_lookbacks.getCounts(lookback))
+
+      self.assertEqual([list(arr) for arr in user_fields["all_lookbacks"].suffix_index.getArrays()], \
+        [list(arr) for arr in original.all_lookbacks.suffix_index.getArrays()])
+
+      for opener in config.OPENERS_TO_CLOSERS:
+        closing_lookbacks = user_fields["closing_lookbacks"][opener]
+        for lookback in original.closing_lookbacks[opener]:
+          self.assertEqual(closing_lookbacks.getCounts(lookback), original.closing_lookbacks[opener].getCounts(lookback))
+
+
+  def test_read_user_counts(self):
+
+    for nick in self.sources:
+
+      model_filepath = ModelFile.getUserFilepath(self.model_dir, nick)
+
+      with mock.patch.object(ModelFile, "mapArrays") as map_arrays:
+        counts = ModelFile.readUserCounts(model_filepath, self.generator.lookback_states, len(self.generator.vocabulary))
+        self.assertFalse(map_arrays.called)
+
+      user = self.users.getByAlias(nick)
+      self.assertEqual(counts, {"nick" : nick, "starter_count" : len(user.starters), \
+        "production_count" : user.all_lookbacks.countProductions()})
+
+
+  def test_read_user_copies_small_arrays(self):
+
+    model_filepath = ModelFile.getUserFilepath(self.model_dir, "almond")
+    vocabulary_size = len(self.generator.vocabulary)
+
+    user_fields = ModelFile.readUser(model_filepath, self.generator.lookback_states, vocabulary_size)
+    self.assertTrue(isinstance(user_fields["all_lookbacks"].successors, array))
+
+    with mock.patch("generator.config.MODEL_COPY_BYTES", 0):
+      user_fields = ModelFile.readUser(model_filepath, self.generator.lookback_states, vocabulary_size)
+    self.assertTrue(isinstance(user_fields["all_lookbacks"].successors, MappedArray))
+    (_, original) = self.generator.processSource("almond" + config.SOURCEFILE_EXT, self.sources["almond"])
+    self.assertEqual(user_fields["all_lookbacks"].countProductions(), original.all_lookbacks.countProductions())
+
+
+  def test_build_from_models(self):
+
+    generator = Generator()
+    generator.processSource = mock.Mock(side_effect=AssertionError("source should not be processed"))
+    generator.build(self.source_dir)
+
+    self.assertFalse(generator.empty())
+    self.assertEqual(generator.users.countUsers(), 2)
+
+    nicks, quote = generator.generate([(0, "birch")], ("l",))
+    self.assertEqual(nicks, ["birch"])
+    self.assertEqual(quote, "l m n")
+
+
+  @mock.patch("generator.transitions.KEY_BITS", 16)
+  def test_build_from_wide_models(self):
+
+    source_dir = tempfile.mkdtemp()
+    words = ["w%d" % i for i in range(0, 400)]
+    writeSources(source_dir, {
+      "almond" : ["a b c d"],
+      "birch" : [" ".join(words[i:i + 5]) for i in range(0, len(words), 5)],
+    })
+
+    try:
+      compiled = Generator()
+      compiled.compile(source_dir)
+
+      generator = Generator()
+      generator.processSource = mock.Mock(side_effect=AssertionError("source should not be processed"))
+      generator.build(source_dir)
+
+    finally:
+      shutil.rmtree(source_dir)
+
+    self.assertTrue(generator.lookback_states.packer.wide)
+    self.assertEqual(generator.lookback_states.getArrays(), compiled.lookback_states.getArrays())
+    self.assertFalse(generator.users.getAllLookbacks("almond").suffix_index.packer.wide)
+    self.assertTrue(generator.users.getAllLookbacks("birch").suffix_index.packer.wide)
+
+    (_, quote) = generator.generate([(0, "birch")], ("w300",), increment_quote_count=False)
+    self.assertEqual(quote, "w300 w301 w302 w303 w304")
+    (_, quote) = generator.generate([(0, "almond")], ("b",), increment_quote_count=False, order=1)
+    self.assertEqual(quote, "b c d")
+
+
+  def test_read_user_wrong_lookback(self):
+
+    model_filepath = ModelFile.getUserFilepath(self.model_dir, "almond")
+
+    self.assertRaises(ModelFormatError, ModelFile.readUser, model_filepath, LookbackStates(config.LOOKBACK_LEN + 1), \
+      len(self.generator.vocabulary))
+
+
+  def test_read_user_missing_states(self):
+
+    model_filepath = ModelFile.getUserFilepath(self.model_dir, "almond")
+
+    self.assertRaises(ModelFormatError, ModelFile.readUser, model_filepath, LookbackStates(config.LOOKBACK_LEN), \
+      len(self.generator.vocabulary))
+
+
+  def test_read_user_wrong_version(self):
+
+    model_filepath = ModelFile.getUserFilepath(self.model_dir, "almond")
+
+    model_file = open(model_filepath, "r+b")
+    model_file.seek(4)
+    model_file.write(struct.pack("=I", modelfile.FORMAT_VERSION + 1))
+    model_file.close()
+
+    self.assertRaises(ModelFormatError, ModelFile.readUser, model_filepath, self.generator.lookback_states, \
+      len(self.generator.vocabulary))
+
+
+  def test_read_user_truncated(self):
+
+    model_filepath = ModelFile.getUserFilepath(self.model_dir, "almond")
+
+    model_file = open(model_filepath, "r+b")
+    model_file.truncate(64)
+    model_file.close()
+
+    self.assertRaises(ModelFormatError, ModelFile.readUser, model_filepath, self.generator.lookback_states, \
+      len(self.generator.vocabulary))
+
+
+  def test_build_stale_models_falls_back_to_sources(self):
+
+    generator = Generator(config.LOOKBACK_LEN + 1)
+    generator.build(self.source_dir)
+
+    self.assertEqual(generator.users.countUsers(), 2)
+    self.assertEqual(generator.users.getByAlias("birch").all_lookbacks.lookback_count, config.LOOKBACK_LEN + 1)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from generator.quotepool import QuotePool
+
+
+class TestQuotePool(unittest.TestCase):
+
+  def setUp(self):
+
+    self.pool = QuotePool(2)
+    self.pool.setKeys(["almond", (1, 0)])
+
+
+  def test_pop_unpooled_key(self):
+
+    self.assertEqual(self.pool.pop("birch"), None)
+    self.assertEqual((self.pool.hits, self.pool.misses), (0, 0))
+
+
+  def test_pop_empty_and_full(self):
+
+    self.assertEqual(self.pool.pop("almond"), None)
+
+    self.pool.push("almond", ["almond"], "a b c")
+    self.pool.push("almond", ["almond"], "d e f")
+    self.pool.push("almond", ["almond"], "g h i")
+
+    self.assertEqual(self.pool.pop("almond"), (["almond"], "d e f"))
+    self.assertEqual(self.pool.pop("almond"), (["almond"], "g h i"))
+    self.assertEqual((self.pool.hits, self.pool.misses, self.pool.refills), (2, 1, 3))
+
+
+  def test_push_unpooled_key(self):
+
+    self.pool.push("birch", ["birch"], "a b c")
+
+    self.assertFalse("birch" in self.pool)
+    self.assertEqual(self.pool.refills, 0)
+
+
+  def test_set_keys_drops_others(self):
+
+    self.pool.push("almond", ["almond"], "a b c")
+    self.pool.setKeys(["birch"])
+
+    self.assertEqual(len(self.pool), 1)
+    self.assertTrue("birch" in self.pool)
+
+
+  def test_find_shortfalls(self):
+
+    self.pool.push("almond", ["almond"], "a b c")
+    self.assertEqual(self.pool.findShortfalls(), [((1, 0), 2), ("almond", 1)])
+
+    self.pool.push("almond", ["almond"], "d e f")
+    self.assertEqual(self.pool.findShortfalls(), [((1, 0), 2)])
+
+
+  def test_discard(self):
+
+    self.pool.push("almond", ["almond"], "a b c")
+    self.pool.push((1, 0), ["birch"], "d e f")
+    self.pool.push((1, 0), ["almond"], "g h i")
+    self.pool.discard("almond")
+
+    self.assertEqual(self.pool.pop("almond"), None)
+    self.assertEqual(self.pool.pop((1, 0)), (["birch"], "d e f"))
+    self.assertEqual(self.pool.getStatistics().quote_count, 0)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from generator.states import LookbackStates
+
+
+class TestLookbackStates(unittest.TestCase):
+
+  def setUp(self):
+
+    self.lookback_states = LookbackStates(2)
+    self.packer = self.lookback_states.packer
+
+    for lookback in [(3, 4), (2, 3), (9, 2), (3, 5)]:
+      self.lookback_states.getOrCreateId(self.packer.pack(lookback))
+
+
+  def test_ids_in_order_seen(self):
+
+    self.assertEqual(len(self.lookback_states), 4)
+    self.assertEqual(self.lookback_states.findLookback((3, 4)), 0)
+    self.assertEqual(self.lookback_states.findLookback((3, 5)), 3)
+    self.assertEqual(self.lookback_states.getLookback(1), (2, 3))
+    self.assertEqual(self.lookback_states.getOrCreateId(self.packer.pack((9, 2))), 2)
+
+
+  def test_find_absent(self):
+
+    self.assertEqual(self.lookback_states.findLookback((4, 3)), None)
+    self.assertEqual(self.lookback_states.findLookback((3,)), None)
+
+
+  def test_commit(self):
+
+    self.lookback_states.commit()
+
+    self.assertEqual(self.lookback_states.pending, {})
+    self.assertEqual(list(self.lookback_states.sorted_ids), [1, 0, 3, 2])
+    self.assertEqual(self.lookback_states.findLookback((3, 5)), 3)
+
+    # Ids already handed out are kept, and later states are merged into the index
+    self.lookback_states.getOrCreateId(self.packer.pack((3, 1)))
+    self.assertEqual(self.lookback_states.findLookback((3, 1)), 4)
+    self.lookback_states.commit()
+
+    self.assertEqual(list(self.lookback_states.sorted_ids), [1, 4, 0, 3, 2])
+    self.assertEqual(self.lookback_states.findLookback((3, 1)), 4)
+    self.assertEqual(self.lookback_states.findLookback((2, 3)), 1)
+
+
+  def test_get_or_create_ids(self):
+
+    keys = [self.packer.pack(lookback) for lookback in [(7, 7), (2, 3), (1, 1)]]
+
+    self.assertEqual(self.lookback_states.getOrCreateIds(keys), [4, 1, 5])
+    self.assertEqual(self.lookback_states.getLookback(5), (1, 1))
+
+    self.lookback_states.commit()
+    keys.append(self.packer.pack((0, 1)))
+
+    self.assertEqual(self.lookback_states.getOrCreateIds(keys), [4, 1, 5, 6])
+    self.assertEqual(len(self.lookback_states), 7)
+
+
+  def test_get_key(self):
+
+    self.assertEqual(self.lookback_states.getKey(2), self.packer.pack((9, 2)))
+
+    self.lookback_states.commit()
+    self.lookback_states.getOrCreateId(self.packer.pack((3, 1)))
+
+    self.assertEqual(list(self.lookback_states.positions), [1, 0, 3, 2])
+    self.assertEqual([self.lookback_states.getLookback(ident) for ident in range(0, 5)], \
+      [(3, 4), (2, 3), (9, 2), (3, 5), (3, 1)])
+
+    # Each key is kept only once, in the index or among those pending
+    self.lookback_states.commit()
+    self.assertEqual(list(self.lookback_states.positions), [2, 0, 4, 3, 1])
+    self.assertEqual(len(self.lookback_states.sorted_keys), 5)
+    self.assertEqual(len(self.lookback_states.pending_keys), 0)
+    self.assertEqual(self.lookback_states.getLookback(4), (3, 1))
+
+
+  def test_extends(self):
+
+    extended = LookbackStates(2)
+    for lookback in [(3, 4), (2, 3), (9, 2), (3, 5), (1, 1)]:
+      extended.getOrCreateId(self.packer.pack(lookback))
+    extended.commit()
+
+    self.assertTrue(extended.extends(self.lookback_states))
+    self.assertTrue(self.lookback_states.extends(self.lookback_states))
+    self.assertFalse(self.lookback_states.extends(extended))
+
+    reordered = LookbackStates(2)
+    for lookback in [(2, 3), (3, 4)]:
+      reordered.getOrCreateId(self.packer.pack(lookback))
+    self.assertFalse(self.lookback_states.extends(reordered))
+
+
+  def test_widen(self):
+
+    lookback_states = LookbackStates(3)
+    narrow = LookbackStates(3)
+    for states in [lookback_states, narrow]:
+      for lookback in [(3, 4, 1), (2, 3, 9)]:
+        states.getOrCreateId(states.packer.pack(lookback))
+      states.commit()
+      states.getOrCreateId(states.packer.pack((3, 1, 1)))
+
+    lookback_states.widen()
+
+    self.assertTrue(lookback_states.packer.wide)
+    self.assertEqual([lookback_states.getLookback(ident) for ident in range(0, 3)], [(3, 4, 1), (2, 3, 9), (3, 1, 1)])
+    self.assertEqual(lookback_states.findLookback((3, 1, 1)), 2)
+    self.assertTrue(lookback_states.extends(narrow))
+
+    # Tokens too big for the narrower keys now fit
+    self.assertEqual(lookback_states.getOrCreateId(lookback_states.packer.pack((1 << 21, 0, 0))), 3)
+    lookback_states.commit()
+
+    self.assertEqual(list(lookback_states.sorted_ids), [1, 2, 0, 3])
+    self.assertEqual(lookback_states.findLookback((1 << 21, 0, 0)), 3)
+    self.assertEqual(lookback_states.findLookback((3, 4, 1)), 0)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,616 @@
+# -*- coding: utf-8 -*-
+
+from collections import Counter
+from mock import patch
+import unittest
+
+from generator import transitions
+from generator.states import LookbackStates
+from generator.transitions import ClosingOverlay
+from generator.transitions import NO_ROW
+from generator.transitions import RUN_END
+from generator.transitions import KeyPacker
+from generator.transitions import TransitionTable
+
+
+class TestTransitions(unittest.TestCase):
+
+  def setUp(self):
+
+    self.lookback_states = LookbackStates(2)
+    self.lookbacks = {
+      (2, 3) : {4 : 3, 5 : 1},
+      (3, 4) : {6 : 1},
+      (9, 2) : {3 : 2},
+      (3, 5) : {0 : 1},
+    }
+    self.table = TransitionTable.fromLookbacks(self.lookback_states, self.lookbacks)
+
+
+  def test_pack_unpack(self):
+
+    packer = KeyPacker(2)
+
+    self.assertEqual(packer.token_bits, 32)
+    self.assertEqual(packer.pack((1, 2)), (1 << 32) | 2)
+    self.assertEqual(packer.unpack((1 << 32) | 2), (1, 2))
+
+
+  def test_pack_unpack_longer(self):
+
+    packer = KeyPacker(3)
+    lookback = (7, 0, 12345)
+
+    self.assertEqual(packer.token_bits, 21)
+    self.assertEqual(packer.unpack(packer.pack(lookback)), lookback)
+
+
+  def test_pack_order_follows_first_token(self):
+
+    packer = KeyPacker(2)
+
+    self.assertTrue(packer.pack((1, 9)) < packer.pack((2, 0)))
+
+
+  def test_pack_too_large(self):
+
+    packer = KeyPacker(3)
+
+    self.assertRaises(ValueError, packer.pack, (1 << 21, 0, 0))
+
+
+  def test_pack_wide(self):
+
+    narrow = KeyPacker(3)
+    packer = KeyPacker(3, True)
+    lookback = (7, 1 << 21, 12345)
+
+    self.assertTrue(packer.wide)
+    self.assertEqual(packer.token_bits, 32)
+    self.assertEqual(packer.unpack(packer.pack(lookback)), lookback)
+    self.assertTrue(narrow.fits(1 << 21))
+    self.assertFalse(narrow.fits((1 << 21) + 1))
+    self.assertTrue(packer.fits((1 << 21) + 1))
+
+    # Keys stay in the same order when packed wider, and are written as several words each
+    keys = [packer.repack(narrow.pack(lookback), narrow) for lookback in [(1, 2, 3), (1, 3, 0), (2, 0, 0)]]
+    self.assertEqual(keys, sorted(keys))
+    self.assertEqual(keys, [packer.pack(lookback) for lookback in [(1, 2, 3), (1, 3, 0), (2, 0, 0)]])
+    self.assertEqual(len(packer.dumpKeys(keys)), 6)
+    self.assertEqual(packer.loadKeys(packer.dumpKeys(keys)), keys)
+
+
+  def test_pack_wide_unneeded(self):
+
+    packer = KeyPacker(2, True)
+
+    self.assertFalse(packer.wide)
+    self.assertEqual(packer.token_bits, 32)
+
+
+  def test_from_lookbacks(self):
+
+    self.assertEqual(len(self.table), 4)
+    self.assertEqual(list(self.table.states), sorted(self.table.states))
+    self.assertEqual(self.table.offsets[-1], 5)
+    self.assertEqual(sorted([self.table.offsets[row+1] - self.table.offsets[row] for row in range(0, 4)]), [1, 1, 1, 2])
+    self.assertEqual(self.table.countProductions(), 8)
+
+    for (lookback, successor_counts) in self.lookbacks.iteritems():
+      self.assertTrue(lookback in self.table)
+      self.assertEqual(self.table.getCounts(lookback), successor_counts)
+
+
+  def test_next_rows(self):
+
+    for row in range(0, len(self.table)):
+      lookback = self.table.getLookback(row)
+      for edge in range(self.table.offsets[row], self.table.offsets[row+1]):
+        next_lookback = lookback[1:] + (self.table.successors[edge],)
+        next_row = self.table.findRow(next_lookback)
+        if next_row is None:
+          next_row = NO_ROW
+        self.assertEqual(self.table.next_rows[edge], next_row)
+
+    self.assertEqual(self.table.getLookback(self.table.next_rows[self.table.offsets[self.table.findRow((2, 3))]]), (3, 4))
+
+
+  # Return the successors along the run of a lookback's row, and the row it leads to
+  def getRun(self, table, lookback):
+
+    position = table.runs[table.findRow(lookback)]
+    successors = []
+
+    while table.run_successors[position] != RUN_END:
+      successors.append(table.run_successors[position])
+      position += 1
+
+    return (successors, table.run_successors[position+1])
+
+
+  def test_runs(self):
+
+    self.assertEqual(self.table.runs[self.table.findRow((2, 3))], NO_ROW)
+    self.assertEqual(self.getRun(self.table, (9, 2)), ([3], self.table.findRow((2, 3))))
+    self.assertEqual(self.getRun(self.table, (3, 4)), ([6], NO_ROW))
+    self.assertEqual(self.getRun(self.table, (3, 5)), ([0], NO_ROW))
+    self.assertEqual(self.table.getRunCompression(), 1.0)
+
+
+  def test_runs_chain(self):
+
+    lookbacks = {
+      (1, 2) : {3 : 2},
+      (2, 3) : {4 : 2},
+      (3, 4) : {5 : 1, 6 : 1},
+      (7, 2) : {3 : 1},
+    }
+    table = TransitionTable.fromLookbacks(self.lookback_states, lookbacks)
+
+    self.assertEqual(self.getRun(table, (1, 2)), ([3, 4], table.findRow((3, 4))))
+    self.assertEqual(self.getRun(table, (2, 3)), ([4], table.findRow((3, 4))))
+    self.assertEqual(self.getRun(table, (7, 2)), ([3], table.findRow((2, 3))))
+    self.assertEqual(table.getRunCompression(), 5.0 / 4)
+
+
+  def test_runs_cycle(self):
+
+    table = TransitionTable.fromLookbacks(self.lookback_states, {(7, 8) : {7 : 1}, (8, 7) : {8 : 1}})
+
+    runs = [self.getRun(table, (7, 8)), self.getRun(table, (8, 7))]
+
+    self.assertTrue(runs == [([7, 8], table.findRow((7, 8))), ([8], table.findRow((7, 8)))] or \
+      runs == [([7], table.findRow((8, 7))), ([8, 7], table.findRow((8, 7)))])
+
+
+  def test_run_compression_empty(self):
+    self.assertEqual(TransitionTable.fromLookbacks(self.lookback_states, {}).getRunCompression(), None)
+
+
+  def test_alias_table_exact(self):
+
+    counts = [5, 1, 3, 7]
+    total = sum(counts)
+    masses = [0] * len(counts)
+
+    (thresholds, aliases) = TransitionTable.buildAliasTable(counts)
+
+    # Each column's share of draws, out of columns * total, is its own part plus what other columns alias to it
+    for i in range(0, len(counts)):
+      masses[i] += thresholds[i]
+      masses[aliases[i]] += total - thresholds[i]
+
+    self.assertEqual(masses, [count * len(counts) for count in counts])
+
+
+  def test_alias_table_uniform(self):
+
+    self.assertEqual(TransitionTable.buildAliasTable([2, 2, 2]), ((6, 6, 6), (0, 1, 2)))
+
+
+  def test_pack_all(self):
+
+    packer = KeyPacker(3)
+    lookbacks = [(7, 0, 12345), (1, 2, 3)]
+
+    self.assertEqual(list(packer.packAll(lookbacks)), [packer.pack(lookback) for lookback in lookbacks])
+    self.assertEqual(list(packer.packAll([])), [])
+    self.assertRaises(ValueError, packer.packAll, [(1, 2, 3), (1 << 21, 0, 0)])
+
+
+  @unittest.skipIf(transitions.numpy is None, "NumPy is not installed")
+  def test_build_arrays_without_numpy(self):
+
+    lookbacks = {
+      (1, 2) : {3 : 2},
+      (2, 3) : {4 : 2},
+      (3, 4) : {5 : 1, 6 : 1, 9 : 4},
+      (7, 2) : {3 : 1},
+      (7, 8) : {7 : 1},
+      (8, 7) : {8 : 1},
+      (4, 6) : {2 : 3, 0 : 3},
+    }
+    table = TransitionTable.fromLookbacks(self.lookback_states, lookbacks)
+
+    with patch.object(transitions, "numpy", None):
+      built = TransitionTable.fromLookbacks(self.lookback_states, lookbacks)
+
+    for (arr, built_arr) in zip(table.getArrays() + table.suffix_index.getArrays(), \
+      built.getArrays() + built.suffix_index.getArrays()):
+      self.assertEqual(arr.typecode, built_arr.typecode)
+      self.assertEqual(list(arr), list(built_arr))
+
+
+  def test_pack_shift(self):
+
+    packer = KeyPacker(2)
+
+    self.assertEqual(packer.shift(packer.pack((1, 2)), 3), packer.pack((2, 3)))
+
+
+  def test_from_lookbacks_empty(self):
+
+    table = TransitionTable.fromLookbacks(self.lookback_states, {})
+
+    self.assertFalse(table)
+    self.assertFalse((2, 3) in table)
+    self.assertEqual(table.countProductions(), 0)
+
+
+  def test_find_row_absent(self):
+
+    self.assertEqual(self.table.findRow((4, 3)), None)
+    self.assertEqual(self.table.findRow((2,)), None)
+    self.assertEqual(self.table.findRow((2, 3, 4)), None)
+    self.assertEqual(self.table.getCounts((4, 3)), {})
+
+
+  def test_iter(self):
+    self.assertEqual(sorted(self.table), sorted(self.lookbacks))
+
+
+  def test_find_prefix(self):
+
+    self.assertEqual(self.table.findPrefix((3,)), [(3, 4), (3, 5)])
+    self.assertEqual(self.table.findPrefix((9,)), [(9, 2)])
+    self.assertEqual(self.table.findPrefix((4,)), [])
+    self.assertEqual(self.table.findPrefix(()), sorted(self.lookbacks))
+
+
+  def test_find_prefix_longer(self):
+
+    table = TransitionTable.fromLookbacks(LookbackStates(3), {
+      (1, 2, 3) : {0 : 1},
+      (1, 2, 4) : {0 : 1},
+      (1, 3, 2) : {0 : 1},
+      (2, 2, 2) : {0 : 1},
+    })
+
+    self.assertEqual(table.findPrefix((1, 2)), [(1, 2, 3), (1, 2, 4)])
+    self.assertEqual(table.findPrefix((1,)), [(1, 2, 3), (1, 2, 4), (1, 3, 2)])
+
+
+  def test_choose_prefix(self):
+
+    for i in range(0, 10):
+      self.assertTrue(self.table.choosePrefix((3,)) in [(3, 4), (3, 5)])
+
+    self.assertEqual(self.table.choosePrefix((4,)), None)
+
+
+  # States held only by other tables are never looked at
+  def test_find_prefix_own_rows(self):
+
+    for second in range(0, 1000):
+      self.lookback_states.getOrCreateId(self.lookback_states.packer.pack((3, second + 10)))
+    self.lookback_states.commit()
+
+    with patch.object(self.lookback_states, "getKey", wraps=self.lookback_states.getKey) as get_key:
+      self.assertEqual(self.table.findPrefix((3,)), [(3, 4), (3, 5)])
+      self.assertTrue(self.table.choosePrefix((3,)) in [(3, 4), (3, 5)])
+      self.assertTrue(get_key.call_count < 20)
+
+
+  def test_merge(self):
+
+    other = TransitionTable.fromLookbacks(self.lookback_states, {
+      (2, 3) : {5 : 2, 7 : 1},
+      (8, 8) : {0 : 1},
+    })
+
+    merged = TransitionTable.merge([self.table, other])
+
+    self.assertEqual(len(merged), 5)
+    self.assertEqual(merged.getCounts((2, 3)), {4 : 3, 5 : 3, 7 : 1})
+    self.assertEqual(merged.getCounts((8, 8)), {0 : 1})
+    self.assertEqual(merged.getCounts((3, 4)), {6 : 1})
+    self.assertEqual(merged.countProductions(), 12)
+
+    # Ensure the originals are unchanged
+    self.assertEqual(self.table.getCounts((2, 3)), {4 : 3, 5 : 1})
+    self.assertFalse((8, 8) in self.table)
+
+
+  def test_merge_weighted(self):
+
+    other = TransitionTable.fromLookbacks(self.lookback_states, {
+      (2, 3) : {5 : 2, 7 : 1},
+    })
+
+    merged = TransitionTable.merge([self.table, other], [2, 3])
+
+    self.assertEqual(merged.getCounts((2, 3)), {4 : 6, 5 : 8, 7 : 3})
+
+
+  def test_merge_subtract(self):
+
+    other = TransitionTable.fromLookbacks(self.lookback_states, {
+      (2, 3) : {5 : 2, 7 : 1},
+      (8, 8) : {0 : 1},
+    })
+
+    merged = TransitionTable.merge([self.table, other])
+    unmerged = TransitionTable.merge([merged, other], [1, -1])
+
+    self.assertEqual(len(unmerged), len(self.table))
+    self.assertEqual(unmerged.getCounts((2, 3)), {4 : 3, 5 : 1})
+    self.assertFalse((8, 8) in unmerged)
+    self.assertEqual(unmerged.countProductions(), self.table.countProductions())
+
+
+  # Check that every row with a single successor, and only those, has a run, following the row's chain of next rows
+  #  for as long as it goes
+  def assertRunsFollowChains(self, table):
+
+    for row in xrange(0, len(table)):
+
+      if table.offsets[row+1] - table.offsets[row] != 1:
+        self.assertEqual(table.runs[row], NO_ROW)
+        continue
+
+      (successors, end) = self.getRun(table, table.getLookback(row))
+      for successor in successors:
+        self.assertEqual(table.successors[table.offsets[row]], successor)
+        row = table.next_rows[table.offsets[row]]
+
+      self.assertEqual(row, end)
+
+
+  def test_replace_rows(self):
+
+    lookbacks = {
+      (1, 2) : {3 : 2},
+      (2, 3) : {4 : 2},
+      (3, 4) : {5 : 1, 6 : 1},
+      (7, 2) : {3 : 1},
+      (7, 8) : {7 : 1},
+      (8, 7) : {8 : 1},
+      (4, 6) : {2 : 3, 0 : 3},
+    }
+    table = TransitionTable.fromLookbacks(self.lookback_states, lookbacks)
+
+    # (2, 3) leaves the run it was in, and (3, 4) starts one with the new (4, 5); the cycle is left as it was
+    replacements = {(2, 3) : {4 : 1, 9 : 1}, (3, 4) : {5 : 2}, (4, 6) : {}, (4, 5) : {1 : 3}}
+    replaced_lookbacks = dict(lookbacks)
+    replaced_lookbacks.update(replacements)
+    del replaced_lookbacks[(4, 6)]
+    expected = TransitionTable.fromLookbacks(self.lookback_states, replaced_lookbacks)
+
+    replaced = table.replaceRows(dict([(self.lookback_states.findLookback(lookback), counts) \
+      for (lookback, counts) in replacements.iteritems()]))
+
+    self.assertEqual(sorted(replaced), sorted(replaced_lookbacks))
+    for lookback in replaced_lookbacks:
+      self.assertEqual(replaced.getCounts(lookback), replaced_lookbacks[lookback])
+    self.assertEqual(replaced.countProductions(), 12)
+    self.assertEqual(self.getRun(replaced, (3, 4)), ([5, 1], NO_ROW))
+    self.assertRunsFollowChains(replaced)
+
+    # Everything but where the runs are laid out is as if the table were built from the new counts
+    for name in ["states", "offsets", "totals", "successors", "counts", "thresholds", "aliases", "next_rows", \
+      "key_rows"]:
+      self.assertEqual(list(getattr(replaced, name)), list(getattr(expected, name)))
+    for (arr, expected_arr) in zip(replaced.suffix_index.getArrays(), expected.suffix_index.getArrays()):
+      self.assertEqual(list(arr), list(expected_arr))
+
+    # The original is unchanged
+    self.assertEqual(table.getCounts((4, 6)), {2 : 3, 0 : 3})
+    self.assertRunsFollowChains(table)
+
+
+  def test_replace_rows_without_numpy(self):
+
+    state = self.lookback_states.findLookback((2, 3))
+
+    with patch.object(transitions, "numpy", None):
+      replaced = self.table.replaceRows({state : {5 : 2}, self.lookback_states.findLookback((9, 2)) : {}})
+
+    self.assertEqual(sorted(replaced), [(2, 3), (3, 4), (3, 5)])
+    self.assertEqual(replaced.getCounts((2, 3)), {5 : 2})
+    self.assertEqual(self.getRun(replaced, (2, 3)), ([5, 0], NO_ROW))
+    self.assertRunsFollowChains(replaced)
+
+
+  def test_replace_rows_empty(self):
+
+    state = self.lookback_states.findLookback((2, 3))
+    empty = TransitionTable.fromLookbacks(self.lookback_states, {})
+
+    self.assertEqual(len(self.table.replaceRows({})), len(self.table))
+    self.assertEqual(len(empty.replaceRows({state : {}})), 0)
+    self.assertEqual(empty.replaceRows({state : {5 : 1}}).getCounts((2, 3)), {5 : 1})
+
+
+  def test_count_suffix(self):
+
+    table = TransitionTable.fromLookbacks(self.lookback_states, {
+      (2, 3) : {4 : 3, 5 : 1},
+      (7, 3) : {4 : 1, 6 : 2},
+      (3, 4) : {6 : 1},
+    })
+
+    self.assertEqual(table.countSuffix((2, 3)), 4)
+    self.assertEqual(table.countSuffix((3,)), 7)
+    self.assertEqual(table.countSuffix((4,)), 1)
+    self.assertEqual(table.countSuffix((2,)), 0)
+    self.assertEqual(table.countSuffix((8, 8)), 0)
+
+
+  def test_sample_suffix(self):
+
+    table = TransitionTable.fromLookbacks(self.lookback_states, {
+      (2, 3) : {4 : 3, 5 : 1},
+      (7, 3) : {4 : 1, 6 : 2},
+      (3, 4) : {6 : 1},
+    })
+
+    samples = Counter([table.sampleSuffix((3,)) for i in range(0, 7000)])
+
+    self.assertEqual(set(samples), {4, 5, 6})
+    self.assertTrue(abs(samples[4] / 7000.0 - 4 / 7.0) < 0.03)
+    self.assertTrue(abs(samples[6] / 7000.0 - 2 / 7.0) < 0.03)
+
+
+  def test_suffix_index_built_with_table(self):
+
+    build_index_arrays = transitions.SuffixIndex.buildArrays
+    with patch.object(transitions.SuffixIndex, "buildArrays", wraps=build_index_arrays) as build_arrays:
+      table = TransitionTable.fromLookbacks(self.lookback_states, self.lookbacks)
+      self.assertEqual(build_arrays.call_count, 1)
+
+      table.sampleSuffix((3,))
+      self.assertEqual(build_arrays.call_count, 1)
+
+    table_bytes = sum([len(arr) * arr.itemsize for arr in table.getArrays()])
+    self.assertEqual(table.countBytes(), table_bytes + table.suffix_index.countBytes())
+    self.assertTrue(table.suffix_index.countBytes() > 0)
+
+
+  def test_sample_suffix_full_length(self):
+    self.assertEqual(self.table.sampleSuffix((3, 4)), 6)
+    self.assertEqual(self.table.sampleSuffix((4, 3)), None)
+
+
+  def test_sample_suffix_unseen(self):
+    self.assertEqual(self.table.sampleSuffix((6,)), None)
+
+
+  def test_sample_single(self):
+
+    for i in range(0, 10):
+      self.assertEqual(self.table.sample((3, 4)), 6)
+
+
+  def test_sample_single_draws_nothing(self):
+
+    with patch(transitions.__name__ + ".random.randrange") as randrange_mock:
+      self.assertEqual(self.table.sample((3, 4)), 6)
+      self.assertFalse(randrange_mock.called)
+
+
+  def test_sample_every_draw(self):
+
+    draw_count = 2 * 4
+    samples = {}
+
+    with patch(transitions.__name__ + ".random.randrange") as randrange_mock:
+
+      for draw in range(0, draw_count):
+        randrange_mock.return_value = draw
+        successor = self.table.sample((2, 3))
+        samples[successor] = samples.get(successor, 0) + 1
+
+    self.assertEqual(samples, {4 : 6, 5 : 2})
+
+
+  def test_closing_overlay(self):
+
+    overlays = ClosingOverlay.fromTable(self.table, ["(", "["], {5 : "(", 6 : "(", 3 : "["})
+    closing = overlays["("]
+
+    self.assertEqual(len(closing), 2)
+    self.assertEqual(sorted(closing), [(2, 3), (3, 4)])
+    self.assertEqual(closing.getCounts((2, 3)), {5 : 1})
+    self.assertEqual(closing.getCounts((9, 2)), {})
+    self.assertEqual(list(overlays["["]), [(9, 2)])
+
+    self.assertEqual(closing.sample((2, 3)), 5)
+    self.assertEqual(closing.sample((3, 4)), 6)
+    self.assertEqual(closing.sample((9, 2)), None)
+    self.assertEqual(closing.sample((7, 7)), None)
+
+    self.assertEqual(closing.sampleState(self.lookback_states.findLookback((3, 4))), 6)
+    self.assertEqual(closing.sampleState(self.lookback_states.findLookback((9, 2))), None)
+
+
+  def test_closing_overlay_urls(self):
+
+    # Token 1 stands for every URL; 20 and 21 are URLs closing parentheses, held in the table as 1
+    table = TransitionTable.fromLookbacks(self.lookback_states, {(2, 3) : {1 : 4, 5 : 1}, (3, 4) : {1 : 1}})
+    url_counts = {
+      self.lookback_states.findLookback((2, 3)) : {20 : 2, 21 : 1},
+      self.lookback_states.findLookback((3, 4)) : {21 : 1},
+    }
+    overlays = ClosingOverlay.fromTable(table, ["(", "["], {5 : "(", 20 : "(", 21 : "["}, 1, url_counts)
+
+    self.assertEqual(overlays["("].getCounts((2, 3)), {5 : 1, 20 : 2})
+    self.assertEqual(overlays["("].countRow(0), 3)
+    self.assertEqual(overlays["["].getCounts((2, 3)), {21 : 1})
+    self.assertEqual(overlays["["].getCounts((3, 4)), {21 : 1})
+    self.assertEqual(overlays["("].getUrlCounts(), {self.lookback_states.findLookback((2, 3)) : {20 : 2}})
+
+    # A URL is sampled on the edge of the URL token, so that the walk goes on from there
+    row = table.findRow((3, 4))
+    self.assertEqual(overlays["["].sampleEdge(overlays["["].findOverlayRow(row)), (table.offsets[row], 21))
+    self.assertEqual(overlays["["].sample((3, 4)), 21)
+
+    samples = Counter([overlays["("].sample((2, 3)) for i in range(0, 2000)])
+    self.assertEqual(set(samples), {5, 20})
+    self.assertTrue(samples[20] > samples[5])
+
+
+  def test_closing_overlay_merge_urls(self):
+
+    table = TransitionTable.fromLookbacks(self.lookback_states, {(2, 3) : {1 : 4}, (3, 4) : {1 : 1}})
+    state = self.lookback_states.findLookback((2, 3))
+    other_state = self.lookback_states.findLookback((3, 4))
+    closers = {20 : "(", 21 : "["}
+
+    overlays = ClosingOverlay.fromTable(table, ["(", "["], closers, 1, {state : {20 : 2}, other_state : {21 : 1}})
+    other = ClosingOverlay.fromTable(table, ["(", "["], closers, 1, {state : {20 : 1}})
+
+    self.assertEqual(ClosingOverlay.mergeUrlCounts([overlays, overlays]), {state : {20 : 4}, other_state : {21 : 2}})
+    self.assertEqual(ClosingOverlay.mergeUrlCounts([overlays, other, overlays], [1, 2, -1]), {state : {20 : 2}})
+
+
+  @unittest.skipIf(transitions.numpy is None, "NumPy is not installed")
+  def test_closing_overlay_without_numpy(self):
+
+    table = TransitionTable.fromLookbacks(self.lookback_states, {(2, 3) : {1 : 4, 5 : 1}, (3, 4) : {1 : 1, 3 : 2}})
+    url_counts = {
+      self.lookback_states.findLookback((2, 3)) : {21 : 2, 20 : 1},
+      self.lookback_states.findLookback((3, 4)) : {21 : 1},
+    }
+    closers = {5 : "(", 3 : "(", 20 : "(", 21 : "["}
+
+    overlays = ClosingOverlay.fromTable(table, ["(", "[", "{"], closers, 1, url_counts)
+    with patch.object(transitions, "numpy", None):
+      built = ClosingOverlay.fromTable(table, ["(", "[", "{"], closers, 1, url_counts)
+
+    for opener in overlays:
+      for (arr, built_arr) in zip(overlays[opener].getArrays(), built[opener].getArrays()):
+        self.assertEqual(arr.typecode, built_arr.typecode)
+        self.assertEqual(list(arr), list(built_arr))
+
+
+  def test_states_shared(self):
+
+    other = TransitionTable.fromLookbacks(self.lookback_states, {(3, 4) : {7 : 1}, (8, 8) : {0 : 1}})
+
+    self.assertEqual(len(self.lookback_states), 5)
+    self.assertEqual(other.getLookback(other.findRow((3, 4))), (3, 4))
+    self.assertEqual(other.states[other.findRow((3, 4))], self.table.states[self.table.findRow((3, 4))])
+
+    # A state known to the shared states need not be in every table
+    state = self.lookback_states.findLookback((8, 8))
+    self.assertEqual(other.sampleState(state), 0)
+    self.assertEqual(self.table.sampleState(state), None)
+    self.assertFalse(self.table.containsState(state))
+
+
+  def test_closing_overlay_counts(self):
+
+    table = TransitionTable.fromLookbacks(self.lookback_states, {(2, 3) : {4 : 1, 5 : 3, 6 : 1, 7 : 2}})
+    closing = ClosingOverlay.fromTable(table, ["("], {5 : "(", 7 : "("})["("]
+
+    self.assertEqual(closing.countRow(0), 5)
+    self.assertEqual(closing.findOverlayRow(0), 0)
+    self.assertEqual(closing.findOverlayRow(1), None)
+
+    samples = Counter([closing.sample((2, 3)) for i in range(0, 2000)])
+    self.assertEqual(set(samples), {5, 7})
+    self.assertTrue(samples[5] > samples[7])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+from collections import Counter
+import random
+import unittest
+
+from generator.states import LookbackStates
+from generator.transitions import ClosingOverlay
+from generator.transitions import TransitionTable
+from generator.union import UnionSequence
+from generator.union import UnionTable
+
+
+class TestUnion(unittest.TestCase):
+
+  def setUp(self):
+
+    self.lookback_states = LookbackStates(2)
+
+    self.first = TransitionTable.fromLookbacks(self.lookback_states, {
+      (2, 3) : {4 : 1, 5 : 1},
+      (3, 4) : {0 : 2},
+    })
+
+    self.second = TransitionTable.fromLookbacks(self.lookback_states, {
+      (2, 3) : {5 : 2},
+      (6, 7) : {8 : 1},
+    })
+
+    self.union = UnionTable([self.first, self.second])
+    self.weighted = UnionTable([self.first, self.second], [3, 1])
+
+
+  def test_contains(self):
+
+    self.assertTrue((2, 3) in self.union)
+    self.assertTrue((3, 4) in self.union)
+    self.assertTrue((6, 7) in self.union)
+    self.assertFalse((4, 5) in self.union)
+
+
+  def test_iter_unique(self):
+    self.assertEqual(sorted(self.union), [(2, 3), (3, 4), (6, 7)])
+
+
+  def test_nonzero(self):
+
+    empty = TransitionTable.fromLookbacks(self.lookback_states, {})
+
+    self.assertTrue(self.union)
+    self.assertFalse(UnionTable([empty, empty]))
+
+
+  def test_find_prefix(self):
+
+    self.assertEqual(self.union.findPrefix((2,)), [(2, 3)])
+    self.assertEqual(self.union.findPrefix((6,)), [(6, 7)])
+    self.assertEqual(self.union.findPrefix((5,)), [])
+
+
+  def test_choose_prefix(self):
+
+    self.assertEqual(self.union.choosePrefix((3,)), (3, 4))
+    self.assertEqual(self.union.choosePrefix((5,)), None)
+
+
+  # (2, 3) is in both tables, but is chosen no more often than (2, 4), which is in one
+  def test_choose_prefix_uniform(self):
+
+    third = TransitionTable.fromLookbacks(self.lookback_states, {(2, 4) : {1 : 1}})
+    union = UnionTable([self.first, self.second, third])
+
+    random.seed(5)
+    samples = Counter([union.choosePrefix((2,)) for i in range(0, 4000)])
+
+    self.assertEqual(set(samples), {(2, 3), (2, 4)})
+    self.assertTrue(abs(samples[(2, 3)] / 4000.0 - 0.5) < 0.03)
+
+
+  def test_get_counts_matches_merge(self):
+
+    merged = TransitionTable.merge([self.first, self.second])
+
+    for lookback in merged:
+      self.assertEqual(self.union.getCounts(lookback), merged.getCounts(lookback))
+
+    self.assertEqual(self.union.countProductions(), merged.countProductions())
+
+
+  def test_get_counts_weighted(self):
+
+    self.assertEqual(self.weighted.getCounts((2, 3)), {4 : 3, 5 : 5})
+    self.assertEqual(self.weighted.countProductions(), 3 * 4 + 3)
+
+
+  def test_sample_weighted(self):
+
+    random.seed(7)
+    samples = Counter([self.weighted.sample((2, 3)) for i in range(0, 8000)])
+
+    self.assertEqual(set(samples), {4, 5})
+    self.assertTrue(abs(samples[4] / 8000.0 - 3 / 8.0) < 0.03)
+
+
+  def test_sample_single_table(self):
+    self.assertEqual(self.union.sample((6, 7)), 8)
+
+
+  def test_sample_state(self):
+
+    self.assertEqual(self.union.sampleState(self.lookback_states.findLookback((3, 4))), 0)
+    self.assertEqual(self.union.sample((4, 5)), None)
+
+    # Known to the shared states, but to neither table
+    TransitionTable.fromLookbacks(self.lookback_states, {(4, 5) : {6 : 1}})
+    self.assertEqual(self.union.sampleState(self.lookback_states.findLookback((4, 5))), None)
+    self.assertFalse((4, 5) in self.union)
+
+
+  def test_sample_closing_overlays(self):
+
+    closers = {5 : "(", 8 : "("}
+    closing = UnionTable([ClosingOverlay.fromTable(table, ["("], closers)["("] for table in [self.first, self.second]])
+
+    self.assertEqual(set([closing.sample((2, 3)) for i in range(0, 50)]), {5})
+    self.assertEqual(closing.sample((6, 7)), 8)
+    self.assertEqual(closing.sample((3, 4)), None)
+
+
+  def test_sample_suffix_weighted(self):
+
+    random.seed(7)
+    samples = Counter([self.weighted.sampleSuffix((3,)) for i in range(0, 8000)])
+
+    self.assertEqual(set(samples), {4, 5})
+    self.assertTrue(abs(samples[4] / 8000.0 - 3 / 8.0) < 0.03)
+    self.assertEqual(self.weighted.countSuffix((3,)), 8)
+    self.assertEqual(self.union.sampleSuffix((9,)), None)
+
+
+  def test_sequence(self):
+
+    sequence = UnionSequence([["a", "b"], [], ["c"]])
+
+    self.assertEqual(len(sequence), 3)
+    self.assertEqual(list(sequence), ["a", "b", "c"])
+    self.assertEqual(sequence[-1], "c")
+    self.assertRaises(IndexError, sequence.__getitem__, 3)
+
+
+  def test_sequence_weighted(self):
+
+    sequence = UnionSequence([["a", "b"], ["c"]], [2, 3])
+
+    self.assertEqual(list(sequence), ["a", "a", "b", "b", "c", "c", "c"])
+
+
+  def test_sequence_empty(self):
+
+    sequence = UnionSequence([])
+
+    self.assertEqual(len(sequence), 0)
+    self.assertEqual(list(sequence), [])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+from collections import Counter
+import random
+import unittest
+
+from generator.userindex import UserIndex
+
+
+class TestUserIndex(unittest.TestCase):
+
+  def setUp(self):
+
+    random.seed(0)
+
+    self.index = UserIndex()
+    self.index.add("almond", 3, 10)
+    self.index.add("birch", 1, 20)
+    self.index.add("cedar", 5, 30)
+    self.index.add("dogwood", 3, 0)
+
+
+  def drawMany(self, excludes, min_starters, weighted, count=3000):
+    return Counter([self.index.choose(excludes, min_starters, weighted) for i in range(0, count)])
+
+
+  def test_add_keeps_order(self):
+    self.assertEqual(self.index.keys, [(1, "birch"), (3, "almond"), (3, "dogwood"), (5, "cedar")])
+    self.assertEqual(self.index.production_counts, [20, 10, 0, 30])
+
+
+  def test_add_existing_moves(self):
+
+    self.index.add("birch", 4, 25)
+
+    self.assertEqual(len(self.index), 4)
+    self.assertEqual(self.index.keys, [(3, "almond"), (3, "dogwood"), (4, "birch"), (5, "cedar")])
+    self.assertEqual(self.index.production_counts, [10, 0, 25, 30])
+
+
+  def test_remove(self):
+
+    self.index.remove("almond")
+    self.index.remove("nonexistent")
+
+    self.assertFalse("almond" in self.index)
+    self.assertEqual(self.index.keys, [(1, "birch"), (3, "dogwood"), (5, "cedar")])
+
+
+  def test_choose_uniform_threshold_and_excludes(self):
+
+    counts = self.drawMany(["almond", "birch"], 2, False)
+
+    self.assertEqual(set(counts.keys()), {"cedar", "dogwood"})
+    self.assertTrue(counts["cedar"] > 1200)
+    self.assertTrue(counts["dogwood"] > 1200)
+
+
+  def test_choose_uniform_none_eligible(self):
+    self.assertEqual(self.index.choose(["cedar"], 4), None)
+    self.assertEqual(self.index.choose([], 6), None)
+
+
+  def test_choose_weighted(self):
+
+    counts = self.drawMany([], 0, True)
+
+    self.assertEqual(set(counts.keys()), {"almond", "birch", "cedar"})
+    self.assertTrue(counts["almond"] < counts["birch"] < counts["cedar"])
+
+
+  def test_choose_weighted_threshold_and_excludes(self):
+
+    counts = self.drawMany(["cedar"], 2, True, 100)
+    self.assertEqual(counts, Counter({"almond" : 100}))
+
+
+  def test_choose_weighted_none_eligible(self):
+    self.assertEqual(self.index.choose(["almond", "cedar"], 2, True), None)
+
+
+  def test_choose_weighted_after_change(self):
+
+    self.index.choose([], 0, True)
+    self.index.add("cedar", 5, 0)
+    self.index.add("birch", 1, 0)
+
+    self.assertEqual(self.index.choose([], 0, True), "almond")
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -1,18 +1,27 @@
 # -*- coding: utf-8 -*-
 
+from collections import Counter
 import unittest
 
+from generator import config
+from generator.counted import CountedSequence
+from generator.states import LookbackStates
+from generator.transitions import TransitionTable
 from generator.users import User
 from generator.users import UserCollection
 from generator.users import UserNickType
 from generator.users import UserStatisticType
 from generator.users import UserStatsToPersist
+from generator.vocabulary import Vocabulary
 
 
 class TestUser(unittest.TestCase):
 
   def setUp(self):
 
+    self.vocabulary = Vocabulary()
+    self.lookback_states = LookbackStates(config.LOOKBACK_LEN)
+
     nick = "mollusc"
 
     tuple1 = ("the", "cat")
@@ -40,7 +49,7 @@ class TestUser(unittest.TestCase):
     self.user = User(
       nick=nick,
       starters=starters,
-      all_lookbacks=all_lookbacks,
+      all_lookbacks=self.buildTable(all_lookbacks),
       closing_lookbacks=closing_lookbacks,
       urls=urls
     )
@@ -65,7 +74,7 @@ class TestUser(unittest.TestCase):
     local_user = User(
       nick=local_nick,
       starters=local_starters,
-      all_lookbacks=local_lookbacks,
+      all_lookbacks=self.buildTable(local_lookbacks),
       closing_lookbacks={},
       urls=[]
     )
@@ -160,8 +169,8 @@ class TestUser(unittest.TestCase):
     self.user_collection.addUser(
       nick=nick,
       starters=starters,
-      all_lookbacks=all_lookbacks,
-      closing_lookbacks=closing_lookbacks,
+      all_lookbacks=self.buildTable(all_lookbacks),
+      closing_lookbacks=self.buildClosingTables(closing_lookbacks),
       urls=urls
     )
 
@@ -177,16 +186,16 @@ class TestUser(unittest.TestCase):
 
     self.assertEqual(birch.production_count, 8)
 
-    self.assertEqual(len(birch.all_lookbacks[("a", "b")]), 2)
-    self.assertEqual(len(birch.all_lookbacks[("b", "c")]), 2)
-    self.assertFalse(("c", "d") in birch.all_lookbacks)
-    self.assertEqual(len(birch.all_lookbacks[("c", "e")]), 1)
+    self.assertEqual(birch.all_lookbacks.getCounts(self.encodeTuple(("a", "b"))), {self.encodeToken("c") : 2})
+    self.assertEqual(len(birch.all_lookbacks.getCounts(self.encodeTuple(("b", "c")))), 2)
+    self.assertFalse(self.encodeTuple(("c", "d")) in birch.all_lookbacks)
+    self.assertEqual(len(birch.all_lookbacks.getCounts(self.encodeTuple(("c", "e")))), 1)
 
     self.assertEqual(len(birch.closing_lookbacks), 1)
     self.assertTrue("(" in birch.closing_lookbacks)
     self.assertEqual(len(birch.closing_lookbacks["("]), 1)
-    self.assertTrue(("l", "m") in birch.closing_lookbacks["("])
-    self.assertEqual(birch.closing_lookbacks["("][("l", "m")], ["n)"])
+    self.assertTrue(self.encodeTuple(("l", "m")) in birch.closing_lookbacks["("])
+    self.assertEqual(birch.closing_lookbacks["("].getCounts(self.encodeTuple(("l", "m"))), {self.encodeToken("n)") : 1})
 
 
   def test_build_static_stats(self):
@@ -376,6 +385,34 @@ class TestUser(unittest.TestCase):
     self.assertEqual(random_nick, None)
 
 
+  def test_get_random_nick_after_replace_model(self):
+
+    self.createAndAddUser(self.captured_nick)
+    self.user_collection.initUserset()
+
+    self.user_collection.replaceModel(
+      nick=self.captured_nick,
+      starters=[("a", "b"), ("b", "c")],
+      all_lookbacks=self.buildTable({("a", "b") : ["c"], ("b", "c") : ["d"]}),
+      closing_lookbacks={},
+      urls=[]
+    )
+
+    random_nick = self.user_collection.getRandomNick([], 2)
+    self.assertEqual(random_nick, self.captured_nick)
+
+
+  def test_get_random_nick_weighted(self):
+
+    self.user_collection = UserCollection(random_weighted=True)
+    self.createAndAddUser(self.captured_nick)
+    self.createAndAddUser("nobody", starters=[], all_lookbacks={})
+    self.user_collection.initUserset()
+
+    random_nick = self.user_collection.getRandomNick([])
+    self.assertEqual(random_nick, self.captured_nick)
+
+
   def test_get_real_nicks_no_minimum_starters(self):
 
     nonexistent_nick = "nonexistent"
@@ -504,6 +541,39 @@ class TestUser(unittest.TestCase):
     self.assertEqual(stats[UserStatisticType.QUOTES_REQUESTED], 0)
 
 
+  def test_lazy_user_loaded_on_demand(self):
+
+    fields = {
+      "nick" : self.captured_nick,
+      "starters" : CountedSequence.fromCounts({self.encodeTuple(("a", "b")) : 1}, 2),
+      "all_lookbacks" : self.buildTable({("a", "b") : ["c"]}),
+      "closing_lookbacks" : self.buildClosingTables({}),
+      "urls" : CountedSequence.fromCounts({}),
+    }
+    loader = lambda: fields
+
+    self.user_collection.addUser(nick=self.captured_nick, starter_count=1, production_count=1, loader=loader)
+    self.user_collection.initUserset()
+
+    user = self.user_collection.getByAlias(self.captured_nick)
+    self.assertEqual(user.all_lookbacks, None)
+    self.assertEqual(self.user_collection.getRandomNick([], 1), self.captured_nick)
+
+    self.assertTrue(self.user_collection.getStarters(self.captured_nick) is fields["starters"])
+    self.assertTrue(self.user_collection.getAllLookbacks(self.captured_nick) is fields["all_lookbacks"])
+
+    stats = self.user_collection.getModelCacheStatistics()
+    self.assertEqual(stats.misses, 1)
+    self.assertEqual(stats.hits, 1)
+
+
+  def test_model_cache_statistics_not_lazy(self):
+
+    self.createAndAddUser(self.captured_nick)
+
+    self.assertEqual(self.user_collection.getModelCacheStatistics(), None)
+
+
   def createAndAddUser(self,\
                        nick,\
                        starters=[("a", "b")],\
@@ -517,12 +587,41 @@ class TestUser(unittest.TestCase):
     self.user_collection.addUser(
       nick=nick,
       starters=starters,
-      all_lookbacks=all_lookbacks,
-      closing_lookbacks=closing_lookbacks,
+      all_lookbacks=self.buildTable(all_lookbacks),
+      closing_lookbacks=self.buildClosingTables(closing_lookbacks),
       urls=urls
     )
 
 
+  def encodeToken(self, token):
+    return self.vocabulary.getOrCreateId(token)
+
+
+  def encodeTuple(self, tokens):
+    return tuple([self.encodeToken(token) for token in tokens])
+
+
+  # Build a table from a string-based map of lookbacks to lists of follows
+  def buildTable(self, lookbacks):
+
+    encoded = {}
+
+    for (lookback, follows) in lookbacks.iteritems():
+      encoded[self.encodeTuple(lookback)] = Counter(self.encodeTuple(follows))
+
+    return TransitionTable.fromLookbacks(self.lookback_states, encoded)
+
+
+  def buildClosingTables(self, closing_lookbacks):
+
+    closing_tables = {}
+
+    for (opener, lookbacks) in closing_lookbacks.iteritems():
+      closing_tables[opener] = self.buildTable(lookbacks)
+
+    return closing_tables
+
+
   @staticmethod
   def mkSourceFilename(nick):
     return nick + ".src"
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from generator.vocabulary import SpecialToken
+from generator.vocabulary import Vocabulary
+
+
+class TestVocabulary(unittest.TestCase):
+
+  def setUp(self):
+
+    self.vocabulary = Vocabulary()
+
+
+  def test_init_empty(self):
+
+    self.assertEqual(len(self.vocabulary), SpecialToken.COUNT)
+    self.assertEqual(self.vocabulary.getId("crann"), None)
+
+
+  def test_get_or_create_id_new(self):
+
+    crann_id = self.vocabulary.getOrCreateId("crann")
+    duilleog_id = self.vocabulary.getOrCreateId("duilleog")
+
+    self.assertEqual(crann_id, SpecialToken.COUNT)
+    self.assertEqual(duilleog_id, SpecialToken.COUNT + 1)
+    self.assertEqual(len(self.vocabulary), SpecialToken.COUNT + 2)
+
+
+  def test_get_or_create_id_existing(self):
+
+    crann_id = self.vocabulary.getOrCreateId("crann")
+
+    self.assertEqual(self.vocabulary.getOrCreateId("crann"), crann_id)
+    self.assertEqual(self.vocabulary.getId("crann"), crann_id)
+    self.assertEqual(len(self.vocabulary), SpecialToken.COUNT + 1)
+
+
+  def test_get_token(self):
+
+    crann_id = self.vocabulary.getOrCreateId("crann")
+    duilleog_id = self.vocabulary.getOrCreateId("duilleog")
+
+    self.assertEqual(self.vocabulary.getToken(crann_id), "crann")
+    self.assertEqual(self.vocabulary.getTokens([duilleog_id, crann_id]), ["duilleog", "crann"])
+
+
+  def test_get_ids_known(self):
+
+    crann_id = self.vocabulary.getOrCreateId("crann")
+    duilleog_id = self.vocabulary.getOrCreateId("duilleog")
+
+    self.assertEqual(self.vocabulary.getIds(("duilleog", "crann")), (duilleog_id, crann_id))
+
+
+  def test_get_ids_unknown(self):
+
+    self.vocabulary.getOrCreateId("crann")
+
+    self.assertEqual(self.vocabulary.getIds(("crann", "bláth")), None)
+
+
+if __name__ == "__main__":
+  unittest.main()
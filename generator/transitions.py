@@ -0,0 +1,1515 @@
+# Array-backed transition tables, stored in compressed-sparse-row form
+
+from array import array
+from bisect import bisect_left
+from bisect import bisect_right
+from itertools import chain
+import random
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+KEY_BITS = 64 # Width of a packed lookback key, unless the vocabulary outgrows it
+KEY_TYPECODE = "L" # Array type for packed keys; unsigned long is 64 bits on the platforms we run on
+INDEX_TYPECODE = "I" # Array type for offsets, token ids, counts and alias entries
+TOKEN_BITS = 32 # Width of each token in a wide key; token ids are held in INDEX_TYPECODE arrays, so need no more
+NO_ROW = (1 << 32) - 1 # Next row of an edge leading to a lookback that the table does not hold
+RUN_END = (1 << 32) - 1 # Ends each run of successors; no token id is ever this high
+
+
+# Packs a lookback tuple of token ids into a single integer, with the first token in the highest bits
+# Keys fit in KEY_BITS, and so in KEY_TYPECODE arrays, as long as the vocabulary does in the bits each token gets; a
+#  wide packer gives each token TOKEN_BITS instead, so that any vocabulary fits, and its keys are then Python longs,
+#  held in lists, and written as several KEY_BITS words each
+# Either way, keys are in the same order as their lookbacks, so a set of keys stays sorted when packed again wider
+class KeyPacker:
+
+  def __init__(self, lookback_count, wide=False):
+
+    self.lookback_count = lookback_count
+    self.token_bits = KEY_BITS // lookback_count
+    if wide:
+      self.token_bits = max(self.token_bits, TOKEN_BITS)
+
+    self.token_mask = (1 << self.token_bits) - 1
+    self.key_mask = (1 << (self.token_bits * lookback_count)) - 1
+    self.key_words = (self.token_bits * lookback_count + KEY_BITS - 1) // KEY_BITS # Words each key is written as
+    self.wide = self.key_words > 1
+
+
+  # Return whether every token id in a vocabulary of a given size fits in a key
+  def fits(self, token_count):
+    return token_count - 1 <= self.token_mask
+
+
+  # Return whether all of the given token ids fit in a key
+  def canPack(self, tokens):
+
+    for token in tokens:
+      if token > self.token_mask:
+        return False
+
+    return True
+
+
+  def pack(self, lookback):
+
+    key = 0
+
+    for token in lookback:
+      if token > self.token_mask:
+        raise ValueError("Token id %d does not fit in a packed key of %d-bit tokens" % (token, self.token_bits))
+      key = (key << self.token_bits) | token
+
+    return key
+
+
+  # Return the keys of a list of lookback tuples, as createKeys holds them
+  def packAll(self, lookbacks):
+
+    if numpy is None or self.wide:
+      return self.createKeys([self.pack(lookback) for lookback in lookbacks])
+
+    tokens = TransitionTable.toNumPy(array(INDEX_TYPECODE, chain.from_iterable(lookbacks)))
+    tokens = tokens.reshape(-1, self.lookback_count)
+
+    # Packed one by one instead, the first lookback holding a token id that does not fit raises as pack does
+    if len(tokens) and tokens.max() > self.token_mask:
+      return self.createKeys([self.pack(lookback) for lookback in lookbacks])
+
+    keys = numpy.zeros(len(tokens), numpy.uint64)
+    for i in xrange(0, self.lookback_count):
+      keys = (keys << numpy.uint64(self.token_bits)) | tokens[:, i]
+
+    return TransitionTable.fromNumPy(keys, KEY_TYPECODE)
+
+
+  # Return the range [low, high) of the keys of all lookbacks starting with a given prefix of token ids
+  def getPrefixRange(self, prefix):
+
+    shift = self.token_bits * (self.lookback_count - len(prefix))
+    low = self.pack(prefix) << shift
+
+    return (low, low + (1 << shift))
+
+
+  # Return the key of the lookback following a packed one when a given token comes next
+  def shift(self, key, token):
+    return ((key << self.token_bits) | token) & self.key_mask
+
+
+  def unpack(self, key):
+
+    lookback = [0] * self.lookback_count
+
+    for i in range(self.lookback_count - 1, -1, -1):
+      lookback[i] = key & self.token_mask
+      key >>= self.token_bits
+
+    return tuple(lookback)
+
+
+  # Return the key packed by another packer of the same lookback as packed by this one
+  def repack(self, key, packer):
+    return self.pack(packer.unpack(key))
+
+
+  # Return a sequence of keys, in which keys can be held, found by bisection, and added to
+  def createKeys(self, keys=[]):
+
+    if self.wide:
+      return list(keys)
+
+    return array(KEY_TYPECODE, keys)
+
+
+  # Return a sequence of keys as an array of the words they are written as, most significant first
+  def dumpKeys(self, keys):
+
+    if not self.wide:
+      return keys
+
+    words = array(KEY_TYPECODE)
+    word_mask = (1 << KEY_BITS) - 1
+
+    for key in keys:
+      for i in xrange(self.key_words - 1, -1, -1):
+        words.append((key >> (i * KEY_BITS)) & word_mask)
+
+    return words
+
+
+  # Return a sequence of keys from an array of the words they were written as
+  def loadKeys(self, words):
+
+    if not self.wide:
+      return words
+
+    keys = []
+
+    for start in xrange(0, len(words), self.key_words):
+      key = 0
+      for i in xrange(start, start + self.key_words):
+        key = (key << KEY_BITS) | words[i]
+      keys.append(key)
+
+    return keys
+
+
+  # Return the number of bytes a sequence of keys takes up as written
+  def countKeyBytes(self, keys):
+    return len(keys) * self.key_words * array(KEY_TYPECODE).itemsize
+
+
+# One row per lookback, sorted by the id of its state among those shared by all tables (see LookbackStates);
+#  row i owns the edges in [offsets[i], offsets[i+1])
+# Each edge holds a successor id, the number of times it was seen, its alias table entry, and the row of the lookback
+#  it leads to, so that a walk through the table need never look up a lookback after its first
+# Rows with a single successor are strung together into runs, each holding the successors along a chain of such rows
+#  in order, then RUN_END and the row the chain leads to; runs[i] is where the run of row i starts, or NO_ROW if the
+#  row has several successors, so a walk can take a whole chain with no draws
+# key_rows holds the rows in order of their lookbacks, so that those starting with a prefix are found by bisection
+# The arrays may be any indexable sequences, such as views onto a memory-mapped model file
+class TransitionTable:
+
+  # Names and array types of the arrays making up a table, in constructor order
+  ARRAY_FIELDS = [
+    ("states", INDEX_TYPECODE),
+    ("offsets", INDEX_TYPECODE),
+    ("totals", INDEX_TYPECODE),
+    ("successors", INDEX_TYPECODE),
+    ("counts", INDEX_TYPECODE),
+    ("thresholds", INDEX_TYPECODE),
+    ("aliases", INDEX_TYPECODE),
+    ("next_rows", INDEX_TYPECODE),
+    ("runs", INDEX_TYPECODE),
+    ("run_successors", INDEX_TYPECODE),
+    ("key_rows", INDEX_TYPECODE),
+  ]
+
+  def __init__(self, lookback_states, states, offsets, totals, successors, counts, thresholds, aliases, next_rows, \
+    runs, run_successors, key_rows, production_count=None, suffix_index=None):
+
+    self.lookback_states = lookback_states
+    self.lookback_count = lookback_states.lookback_count
+
+    self.states = states
+    self.offsets = offsets
+    self.totals = totals
+    self.successors = successors
+    self.counts = counts
+    self.thresholds = thresholds
+    self.aliases = aliases
+    self.next_rows = next_rows
+    self.runs = runs
+    self.run_successors = run_successors
+    self.key_rows = key_rows
+
+    self.production_count = production_count # Computed on first request if not known in advance
+
+    # For sampling after lookbacks shorter than a row's; built here unless it was stored with the table, so that the
+    #  first generation to back off is not kept waiting for it
+    self.suffix_index = suffix_index
+    if suffix_index is None:
+      self.suffix_index = SuffixIndex.fromTable(self)
+
+
+  # Build from a map of state ids to maps of successor ids to counts
+  @staticmethod
+  def fromCounts(lookback_states, counts_by_state):
+
+    states = array(INDEX_TYPECODE, counts_by_state.iterkeys())
+    keys = lookback_states.packer.createKeys([lookback_states.getKey(state) for state in states])
+
+    return TransitionTable.fromRows(lookback_states, states, keys, \
+      *TransitionTable.flattenCounts(counts_by_state.values()))
+
+
+  # Build from a map of lookback tuples to maps of successor ids to counts, adding any states not yet seen
+  @staticmethod
+  def fromLookbacks(lookback_states, lookbacks):
+
+    packer = lookback_states.packer
+    keys = packer.packAll(lookbacks.keys())
+
+    # New states are given ids in order of their keys, rather than in whatever order the map holds them, so that
+    #  every build of the same sources gives the same ids, however it was spread over workers
+    if numpy is not None and not packer.wide:
+      rows = numpy.argsort(TransitionTable.toNumPy(keys)).tolist()
+    else:
+      rows = sorted(xrange(0, len(keys)), key=keys.__getitem__)
+
+    keys = packer.createKeys([keys[row] for row in rows])
+    states = array(INDEX_TYPECODE, lookback_states.getOrCreateIds(keys))
+    successor_counts_list = lookbacks.values()
+
+    return TransitionTable.fromRows(lookback_states, states, keys, \
+      *TransitionTable.flattenCounts([successor_counts_list[row] for row in rows]))
+
+
+  # Build from the state ids and packed keys of its rows and their flattened counts, as buildArrays takes them
+  @staticmethod
+  def fromRows(lookback_states, states, keys, offsets, successors, counts):
+
+    packer = lookback_states.packer
+    (arrays, index_arrays) = TransitionTable.buildArrays(packer, states, keys, offsets, successors, counts)
+
+    return TransitionTable(lookback_states, *arrays, suffix_index=SuffixIndex(packer, *index_arrays))
+
+
+  # Return the offsets of the rows of a list of maps of successor ids to counts, and the successors and counts of
+  #  their edges, all in order, as arrays
+  @staticmethod
+  def flattenCounts(successor_counts_list):
+
+    offsets = array(INDEX_TYPECODE, [0])
+    lengths = map(len, successor_counts_list)
+
+    if numpy is not None:
+      offsets.extend(TransitionTable.fromNumPy(numpy.cumsum(lengths)))
+    else:
+      for length in lengths:
+        offsets.append(offsets[-1] + length)
+
+    successors = array(INDEX_TYPECODE, [successor for successor_counts in successor_counts_list \
+      for successor in successor_counts])
+    counts = array(INDEX_TYPECODE, [count for successor_counts in successor_counts_list \
+      for count in successor_counts.itervalues()])
+
+    return [offsets, successors, counts]
+
+
+  # Return the arrays of a table and those of its suffix index, each in constructor order, from the state id and
+  #  packed key of each of its rows, and their flattened counts (see flattenCounts); the rows, and the edges of each,
+  #  may be in any order
+  # Edges are led to their next rows through the table's own keys, so this needs nothing from the shared states, and
+  #  can be done in a worker process
+  @staticmethod
+  def buildArrays(packer, states, keys, offsets, successors, counts):
+
+    # NumPy sorts and looks up every edge in one go, but its integers only hold keys that are not wide
+    if numpy is not None and not packer.wide:
+      sorted_arrays = TransitionTable.sortRowsWithNumPy(packer, states, keys, offsets, successors, counts)
+    else:
+      sorted_arrays = TransitionTable.sortRows(packer, states, keys, offsets, successors, counts)
+
+    (states, keys, offsets, successors, counts, totals, next_rows, key_rows) = sorted_arrays
+    (thresholds, aliases) = TransitionTable.buildAliasTables(offsets, counts, totals)
+    (runs, run_successors) = TransitionTable.buildRuns(offsets, successors, next_rows)
+
+    arrays = [states, offsets, totals, successors, counts, thresholds, aliases, next_rows, runs, run_successors, \
+      key_rows]
+
+    return (arrays, SuffixIndex.buildArrays(packer, keys, totals))
+
+
+  # Return the states, keys, offsets, successors and counts of a table's rows, sorted by state and by successor
+  #  within each row, followed by the totals of the rows, the rows their edges lead to, and the rows in order of
+  #  their keys
+  @staticmethod
+  def sortRows(packer, states, keys, offsets, successors, counts):
+
+    rows = sorted(xrange(0, len(states)), key=states.__getitem__)
+    rows_by_key = dict([(keys[row], position) for (position, row) in enumerate(rows)])
+
+    sorted_offsets = array(INDEX_TYPECODE, [0])
+    sorted_successors = array(INDEX_TYPECODE)
+    sorted_counts = array(INDEX_TYPECODE)
+    totals = array(INDEX_TYPECODE)
+    next_rows = array(INDEX_TYPECODE)
+
+    for row in rows:
+
+      start = offsets[row]
+      end = offsets[row+1]
+
+      for (successor, count) in sorted(zip(successors[start:end], counts[start:end])):
+        sorted_successors.append(successor)
+        sorted_counts.append(count)
+        next_rows.append(rows_by_key.get(packer.shift(keys[row], successor), NO_ROW))
+
+      sorted_offsets.append(len(sorted_successors))
+      totals.append(sum(counts[start:end]))
+
+    sorted_states = array(INDEX_TYPECODE, [states[row] for row in rows])
+    sorted_keys = packer.createKeys([keys[row] for row in rows])
+    key_rows = array(INDEX_TYPECODE, sorted(xrange(0, len(rows)), key=sorted_keys.__getitem__))
+
+    return (sorted_states, sorted_keys, sorted_offsets, sorted_successors, sorted_counts, totals, next_rows, key_rows)
+
+
+  # As sortRows, sorting the edges of all rows at once by the places of their rows and their successors packed
+  #  together, and finding the keys of their next lookbacks among the table's own by bisection
+  @staticmethod
+  def sortRowsWithNumPy(packer, states, keys, offsets, successors, counts):
+
+    rows = numpy.argsort(TransitionTable.toNumPy(states))
+    places = numpy.empty(len(rows), numpy.uint64)
+    places[rows] = numpy.arange(len(rows), dtype=numpy.uint64)
+
+    lengths = numpy.diff(TransitionTable.toNumPy(offsets).astype(numpy.int64))
+    edge_places = numpy.repeat(places, lengths)
+    successors = TransitionTable.toNumPy(successors).astype(numpy.uint64)
+
+    order = numpy.argsort((edge_places << numpy.uint64(TOKEN_BITS)) | successors)
+    edge_places = edge_places[order].astype(numpy.int64)
+    successors = successors[order]
+    counts = TransitionTable.toNumPy(counts)[order]
+
+    offsets = numpy.concatenate([numpy.zeros(1, numpy.int64), numpy.cumsum(lengths[rows])])
+    cumulative = numpy.concatenate([numpy.zeros(1, numpy.uint64), numpy.cumsum(counts, dtype=numpy.uint64)])
+    totals = cumulative[offsets[1:]] - cumulative[offsets[:-1]]
+
+    keys = TransitionTable.toNumPy(keys)[rows]
+    key_rows = numpy.argsort(keys)
+    next_rows = TransitionTable.findNextRowsWithNumPy(packer, keys[key_rows], key_rows, keys[edge_places], successors)
+    states = TransitionTable.toNumPy(states)[rows]
+
+    return tuple([TransitionTable.fromNumPy(states), TransitionTable.fromNumPy(keys, KEY_TYPECODE)] + \
+      [TransitionTable.fromNumPy(values) for values in [offsets, successors, counts, totals, next_rows, key_rows]])
+
+
+  # Return the row each of some edges leads to, or NO_ROW, from the keys of the rows they leave and their successors,
+  #  looked up among the sorted keys of rows and the rows those are the keys of, all as NumPy arrays
+  @staticmethod
+  def findNextRowsWithNumPy(packer, sorted_keys, key_rows, edge_keys, successors):
+
+    next_keys = ((edge_keys << numpy.uint64(packer.token_bits)) | successors.astype(numpy.uint64)) & \
+      numpy.uint64(packer.key_mask)
+
+    next_rows = numpy.full(len(successors), NO_ROW, numpy.int64)
+    if len(sorted_keys):
+      positions = numpy.minimum(numpy.searchsorted(sorted_keys, next_keys), len(sorted_keys) - 1)
+      found = sorted_keys[positions] == next_keys
+      next_rows[found] = key_rows[positions[found]]
+
+    return next_rows
+
+
+  # Return a NumPy view onto an array, or onto one mapped from a model file, without copying it
+  @staticmethod
+  def toNumPy(arr):
+
+    if isinstance(arr, array):
+      return numpy.frombuffer(arr, numpy.dtype(arr.typecode))
+
+    return numpy.frombuffer(arr.buf, numpy.dtype(arr.typecode), arr.length, arr.offset)
+
+
+  # Return an array of NumPy values, which must fit in its type, as array() would check for each value
+  @staticmethod
+  def fromNumPy(values, typecode=INDEX_TYPECODE):
+
+    dtype = numpy.dtype(typecode)
+    if len(values) and (values.min() < 0 or values.max() > numpy.iinfo(dtype).max):
+      raise OverflowError("NumPy values do not fit in an array of type %s" % typecode)
+
+    arr = array(typecode)
+    arr.fromstring(values.astype(dtype).tostring())
+
+    return arr
+
+
+  # Return the thresholds and aliases of the alias tables of all rows of a table, as buildAliasTable builds each
+  # Most rows have a single successor, or successors all seen as often; each column of those yields itself, so their
+  #  tables are laid out in one go, and only those of the other rows built
+  @staticmethod
+  def buildAliasTables(offsets, counts, totals):
+
+    if numpy is None:
+
+      thresholds = array(INDEX_TYPECODE)
+      aliases = array(INDEX_TYPECODE)
+
+      for row in xrange(0, len(totals)):
+        (row_thresholds, row_aliases) = TransitionTable.buildAliasTable(counts[offsets[row]:offsets[row+1]])
+        thresholds.extend(row_thresholds)
+        aliases.extend(row_aliases)
+
+      return (thresholds, aliases)
+
+    offsets = TransitionTable.toNumPy(offsets).astype(numpy.int64)
+    lengths = numpy.diff(offsets)
+    edge_rows = numpy.repeat(numpy.arange(len(totals)), lengths)
+
+    thresholds = numpy.repeat(TransitionTable.toNumPy(totals), lengths)
+    aliases = numpy.arange(len(counts)) - offsets[edge_rows]
+
+    # A column yields itself outright when its count, scaled by the number of columns, is the total
+    scaled = TransitionTable.toNumPy(counts).astype(numpy.uint64) * lengths[edge_rows].astype(numpy.uint64)
+    uneven = numpy.unique(edge_rows[scaled != thresholds])
+
+    thresholds = TransitionTable.fromNumPy(thresholds)
+    aliases = TransitionTable.fromNumPy(aliases)
+
+    for row in uneven.tolist():
+      (start, end) = (offsets[row], offsets[row+1])
+      (row_thresholds, row_aliases) = TransitionTable.buildAliasTable(counts[start:end])
+      thresholds[start:end] = array(INDEX_TYPECODE, row_thresholds)
+      aliases[start:end] = array(INDEX_TYPECODE, row_aliases)
+
+    return (thresholds, aliases)
+
+
+  # Build an alias table over integer counts; everything is scaled by the number of columns so
+  #  that the arithmetic is exact, and each column is hit in proportion to the total given
+  # Column i yields itself when a draw in [0, total) is below thresholds[i], and aliases[i] otherwise
+  @staticmethod
+  def buildAliasTable(counts):
+
+    column_count = len(counts)
+    total = sum(counts)
+
+    scaled = [count * column_count for count in counts]
+    thresholds = [total] * column_count
+    aliases = range(column_count)
+
+    smalls = [i for i in range(column_count) if scaled[i] < total]
+    larges = [i for i in range(column_count) if scaled[i] > total]
+
+    while smalls and larges:
+
+      small = smalls.pop()
+      large = larges[-1]
+
+      thresholds[small] = scaled[small]
+      aliases[small] = large
+      scaled[large] -= total - scaled[small]
+
+      if scaled[large] <= total:
+        larges.pop()
+        if scaled[large] < total:
+          smalls.append(large)
+
+    return (tuple(thresholds), tuple(aliases))
+
+
+  # Return the runs of the rows with a single successor, and the successors along them
+  # Each chain is followed from a row that no other such row leads to, so that it is held in one run; any such rows
+  #  left over after that are on cycles, and are followed from wherever they are first come to
+  # A chain running into a row already in a run ends there, leading to that row
+  @staticmethod
+  def buildRuns(offsets, successors, next_rows):
+
+    row_count = len(offsets) - 1
+    (single_rows, run_heads, runs, row_successors, row_nexts) = \
+      TransitionTable.findChains(offsets, successors, next_rows)
+    run_successors = []
+    TransitionTable.followChains(run_heads + single_rows, runs, row_successors, row_nexts, run_successors)
+
+    runs.pop()
+    for row in xrange(0, row_count):
+      if runs[row] < 0:
+        runs[row] = NO_ROW
+
+    return (array(INDEX_TYPECODE, runs), array(INDEX_TYPECODE, run_successors))
+
+
+  # Follow a chain from each of the given rows in turn that is not yet in a run, marking the rows along it in runs
+  #  with their places in run_successors, and appending their successors and the end of the run to that; places are
+  #  counted from first_place, where run_successors is to go after others
+  # A chain goes on for as long as it comes to rows still marked NO_ROW, which are only those with a single
+  #  successor not yet in a run; the place past the last row, where rows leading nowhere lead, is marked -1
+  @staticmethod
+  def followChains(rows, runs, row_successors, row_nexts, run_successors, first_place=0):
+
+    row_count = len(runs) - 1
+
+    for row in rows:
+
+      if runs[row] != NO_ROW:
+        continue
+
+      while runs[row] == NO_ROW:
+        runs[row] = first_place + len(run_successors)
+        run_successors.append(row_successors[row])
+        row = row_nexts[row]
+
+      if row == row_count:
+        row = NO_ROW
+
+      run_successors.append(RUN_END)
+      run_successors.append(row)
+
+
+  # Return the rows with a single successor, and those of them that no other such row leads to, in order, followed
+  #  by lists of what buildRuns follows chains through: a mark for each row, past which there is one more place,
+  #  holding NO_ROW for rows with a single successor and -1 otherwise, and the successor and next row of each row,
+  #  with rows leading nowhere led to the place past the last row
+  @staticmethod
+  def findChains(offsets, successors, next_rows):
+
+    row_count = len(offsets) - 1
+
+    if numpy is None:
+
+      single_rows = [row for row in xrange(0, row_count) if offsets[row+1] - offsets[row] == 1]
+      runs = [-1] * (row_count + 1)
+      row_successors = [0] * row_count
+      row_nexts = [row_count] * row_count
+
+      for row in single_rows:
+        runs[row] = NO_ROW
+        row_successors[row] = successors[offsets[row]]
+        if next_rows[offsets[row]] != NO_ROW:
+          row_nexts[row] = next_rows[offsets[row]]
+
+      entered = set([row_nexts[row] for row in single_rows])
+      run_heads = [row for row in single_rows if not row in entered]
+
+      return (single_rows, run_heads, runs, row_successors, row_nexts)
+
+    offsets = TransitionTable.toNumPy(offsets).astype(numpy.int64)
+    single = numpy.diff(offsets) == 1
+    firsts = offsets[:-1][single]
+
+    row_successors = numpy.zeros(row_count, numpy.int64)
+    row_successors[single] = TransitionTable.toNumPy(successors)[firsts]
+
+    nexts = TransitionTable.toNumPy(next_rows)[firsts].astype(numpy.int64)
+    nexts[nexts == NO_ROW] = row_count
+    row_nexts = numpy.full(row_count, row_count, numpy.int64)
+    row_nexts[single] = nexts
+
+    entered = numpy.zeros(row_count + 1, bool)
+    entered[nexts] = True
+    run_heads = numpy.flatnonzero(single & ~entered[:-1])
+
+    runs = numpy.append(numpy.where(single, NO_ROW, -1), -1)
+
+    return (numpy.flatnonzero(single).tolist(), run_heads.tolist(), runs.tolist(), row_successors.tolist(), \
+      row_nexts.tolist())
+
+
+  # Return a new table whose counts are the sums of those of the given tables, optionally multiplied by integer weights
+  # A weight of -1 takes away the counts of a table that went into another; successors and lookbacks left without
+  #  any count are dropped
+  # The tables must share their states, whose ids then line up between them
+  @staticmethod
+  def merge(tables, weights=None):
+
+    weights = weights or [1] * len(tables)
+    counts_by_state = {}
+
+    for (table, weight) in zip(tables, weights):
+      for row in range(0, len(table.states)):
+
+        successor_counts = counts_by_state.setdefault(table.states[row], {})
+
+        for edge in range(table.offsets[row], table.offsets[row+1]):
+          successor = table.successors[edge]
+          successor_counts[successor] = successor_counts.get(successor, 0) + table.counts[edge] * weight
+
+    if min(weights) < 0:
+      counts_by_state = TransitionTable.dropUncounted(counts_by_state)
+
+    return TransitionTable.fromCounts(tables[0].lookback_states, counts_by_state)
+
+
+  @staticmethod
+  def dropUncounted(counts_by_state):
+
+    counted = {}
+
+    for (state, successor_counts) in counts_by_state.iteritems():
+      row_counts = {successor: count for (successor, count) in successor_counts.iteritems() if count > 0}
+      if row_counts:
+        counted[state] = row_counts
+
+    return counted
+
+
+  # Return a new table with the rows of some states replaced, given as a map of state ids to maps of successor ids to
+  #  counts; a state mapped to no counts loses its row
+  # Only the new rows are built, and only the edges that might lead to them looked up: the rest of the table, down to
+  #  the order of its keys and the runs through rows kept, is copied across with NumPy, so that this takes time in
+  #  proportion to the rows replaced, bar copying arrays
+  # Without NumPy, or with wide keys, the table is built again from the counts of all of its rows
+  def replaceRows(self, counts_by_state):
+
+    packer = self.lookback_states.packer
+    if numpy is None or packer.wide:
+      all_counts = dict([(self.states[row], self.getRowCounts(row)) for row in xrange(0, len(self.states))])
+      all_counts.update(counts_by_state)
+      return TransitionTable.fromCounts(self.lookback_states, TransitionTable.dropUncounted(all_counts))
+
+    (states, offsets, totals, successors, counts, thresholds, aliases, next_rows, runs, run_successors, key_rows) = \
+      [TransitionTable.toNumPy(arr).astype(numpy.int64) for arr in self.getArrays()]
+    row_count = len(states)
+    lengths = numpy.diff(offsets)
+
+    kept = numpy.ones(row_count, bool)
+    replaced_states = numpy.array(sorted(counts_by_state), numpy.int64)
+    if row_count:
+      positions = numpy.minimum(numpy.searchsorted(states, replaced_states), row_count - 1)
+      kept[positions[states[positions] == replaced_states]] = False
+    kept_rows = numpy.flatnonzero(kept)
+
+    # The added rows are sorted and given alias tables as buildArrays does, but for where their edges lead
+    added_states = numpy.array([state for state in sorted(counts_by_state) if counts_by_state[state]], numpy.int64)
+    (added_offsets, added_successors, added_counts) = [TransitionTable.toNumPy(arr).astype(numpy.int64) for arr in \
+      TransitionTable.flattenCounts([counts_by_state[state] for state in added_states.tolist()])]
+    added_lengths = numpy.diff(added_offsets)
+    order = numpy.lexsort((added_successors, numpy.repeat(numpy.arange(len(added_states)), added_lengths)))
+    added_successors = added_successors[order]
+    added_counts = added_counts[order]
+    cumulative = numpy.concatenate([numpy.zeros(1, numpy.int64), numpy.cumsum(added_counts)])
+    added_totals = cumulative[added_offsets[1:]] - cumulative[added_offsets[:-1]]
+    (added_thresholds, added_aliases) = [TransitionTable.toNumPy(arr) for arr in TransitionTable.buildAliasTables( \
+      TransitionTable.fromNumPy(added_offsets), TransitionTable.fromNumPy(added_counts), \
+      TransitionTable.fromNumPy(added_totals))]
+
+    # Rows are placed by state, as in any table; those of replaced states still present move to their new rows too
+    new_states = numpy.sort(numpy.concatenate([states[kept_rows], added_states]))
+    new_count = len(new_states)
+    places = numpy.full(row_count, -1, numpy.int64)
+    if new_count:
+      moved = numpy.minimum(numpy.searchsorted(new_states, states), new_count - 1)
+      present = new_states[moved] == states
+      places[present] = moved[present]
+    added_places = numpy.searchsorted(new_states, added_states)
+
+    new_lengths = numpy.zeros(new_count, numpy.int64)
+    new_lengths[places[kept_rows]] = lengths[kept_rows]
+    new_lengths[added_places] = added_lengths
+    new_offsets = numpy.concatenate([numpy.zeros(1, numpy.int64), numpy.cumsum(new_lengths)])
+
+    edge_rows = numpy.repeat(numpy.arange(row_count), lengths)
+    kept_edges = numpy.flatnonzero(kept[edge_rows])
+    kept_edge_rows = edge_rows[kept_edges]
+    kept_edge_places = new_offsets[places[kept_edge_rows]] + kept_edges - offsets[kept_edge_rows]
+    added_edge_places = numpy.arange(len(added_successors)) + numpy.repeat(new_offsets[added_places] - \
+      added_offsets[:-1], added_lengths)
+
+    def placeEdges(kept_values, added_values):
+
+      values = numpy.empty(len(kept_edges) + len(added_edge_places), numpy.int64)
+      values[kept_edge_places] = kept_values
+      values[added_edge_places] = added_values
+
+      return values
+
+    new_totals = numpy.empty(new_count, numpy.int64)
+    new_totals[places[kept_rows]] = totals[kept_rows]
+    new_totals[added_places] = added_totals
+
+    # The keys of the old rows are those of their places in the suffix index, reversed back, and the added rows' are
+    #  merged into their order
+    index = self.suffix_index
+    keys = numpy.empty(row_count, numpy.uint64)
+    keys[TransitionTable.toNumPy(index.rows)] = SuffixIndex.reverseKeysWithNumPy(index.packer, \
+      TransitionTable.toNumPy(index.reversed_keys))
+    added_keys = numpy.array([self.lookback_states.getKey(state) for state in added_states.tolist()], numpy.uint64)
+    added_key_order = numpy.argsort(added_keys)
+
+    kept_key_rows = key_rows[kept[key_rows]]
+    positions = numpy.searchsorted(keys[kept_key_rows], added_keys[added_key_order])
+    sorted_keys = numpy.insert(keys[kept_key_rows], positions, added_keys[added_key_order])
+    new_key_rows = numpy.insert(places[kept_key_rows], positions, added_places[added_key_order])
+
+    # Kept edges lead where they did, unless to rows that have gone; only those that led nowhere can lead to an added
+    #  row instead, and the added rows' own edges are looked up among all rows
+    kept_next_rows = next_rows[kept_edges]
+    nowhere = kept_next_rows == NO_ROW
+    kept_next_rows[~nowhere] = places[kept_next_rows[~nowhere]]
+    kept_next_rows[kept_next_rows < 0] = NO_ROW
+    kept_next_rows[nowhere] = TransitionTable.findNextRowsWithNumPy(packer, added_keys[added_key_order], \
+      added_places[added_key_order], keys[kept_edge_rows[nowhere]], successors[kept_edges[nowhere]])
+    added_next_rows = TransitionTable.findNextRowsWithNumPy(packer, sorted_keys, new_key_rows, \
+      numpy.repeat(added_keys, added_lengths), added_successors)
+
+    new_successors = placeEdges(successors[kept_edges], added_successors)
+    new_next_rows = placeEdges(kept_next_rows, added_next_rows)
+    (new_runs, new_run_successors) = TransitionTable.replaceRuns(kept, places, runs, run_successors, new_offsets, \
+      new_successors, new_next_rows)
+
+    arrays = [TransitionTable.fromNumPy(values) for values in [new_states, new_offsets, new_totals, new_successors, \
+      placeEdges(counts[kept_edges], added_counts), placeEdges(thresholds[kept_edges], added_thresholds), \
+      placeEdges(aliases[kept_edges], added_aliases), new_next_rows, new_runs, new_run_successors, new_key_rows]]
+
+    # So are the added rows' reversed keys merged into the suffix index
+    index_rows = TransitionTable.toNumPy(index.rows)
+    kept_index_rows = index_rows[kept[index_rows]]
+    added_reversed_keys = SuffixIndex.reverseKeysWithNumPy(packer, added_keys)
+    added_index_order = numpy.argsort(added_reversed_keys)
+    kept_reversed_keys = TransitionTable.toNumPy(index.reversed_keys)[kept[index_rows]]
+    positions = numpy.searchsorted(kept_reversed_keys, added_reversed_keys[added_index_order])
+
+    index_arrays = SuffixIndex.packArraysWithNumPy(numpy.insert(kept_reversed_keys, positions, \
+      added_reversed_keys[added_index_order]), numpy.insert(places[kept_index_rows], positions, \
+      added_places[added_index_order]), new_totals)
+
+    return TransitionTable(self.lookback_states, *arrays, suffix_index=SuffixIndex(packer, *index_arrays))
+
+
+  # Return the runs and run successors of a table with some rows replaced, as NumPy arrays, from whether each old row
+  #  was kept and its new row, the old runs and run successors, and the new offsets, successors and next rows
+  # Runs through kept rows only are kept as they were, but for where they end, as the rows they lead on to may have
+  #  moved, come or gone; chains are then followed as buildRuns does through the rows with a single successor left
+  #  out of those
+  @staticmethod
+  def replaceRuns(kept, places, runs, run_successors, offsets, successors, next_rows):
+
+    row_count = len(offsets) - 1
+    in_run = runs != NO_ROW
+
+    # Each run is its rows' places, followed by two more; a run's places are told apart by the rows they hold
+    members = numpy.zeros(len(run_successors), bool)
+    members[runs[in_run]] = True
+    member_rows = numpy.full(len(run_successors), -1, numpy.int64)
+    member_rows[runs[in_run]] = numpy.flatnonzero(in_run)
+    segments = numpy.cumsum(members & ~numpy.concatenate([[False], members[:-1]])) - 1
+
+    broken = numpy.zeros(len(run_successors) + 1, bool)
+    broken[segments[runs[in_run & ~kept]]] = True
+    kept_places = ~broken[segments]
+    new_places = numpy.cumsum(kept_places) - 1
+    new_run_successors = run_successors[kept_places]
+
+    ends = numpy.flatnonzero(members[:-1] & ~members[1:]) + 1
+    ends = ends[kept_places[ends]]
+    new_run_successors[new_places[ends + 1]] = next_rows[offsets[places[member_rows[ends - 1]]]]
+
+    new_runs = numpy.full(row_count, NO_ROW, numpy.int64)
+    kept_members = numpy.flatnonzero(in_run & kept)
+    kept_members = kept_members[kept_places[runs[kept_members]]]
+    new_runs[places[kept_members]] = new_places[runs[kept_members]]
+
+    # Only the rows with a single successor left out of runs are looked at one by one
+    single = numpy.diff(offsets) == 1
+    loose = numpy.flatnonzero(single & (new_runs == NO_ROW))
+    loose_nexts = next_rows[offsets[loose]]
+    loose_nexts[loose_nexts == NO_ROW] = row_count
+
+    row_successors = dict(zip(loose.tolist(), successors[offsets[loose]].tolist()))
+    row_nexts = dict(zip(loose.tolist(), loose_nexts.tolist()))
+
+    entered = numpy.zeros(row_count + 1, bool)
+    entered[loose_nexts] = True
+    run_heads = loose[~entered[loose]]
+
+    marks = numpy.append(numpy.where(single, new_runs, -1), -1)
+    added_run_successors = []
+    TransitionTable.followChains(run_heads.tolist() + loose.tolist(), marks, row_successors, row_nexts, \
+      added_run_successors, len(new_run_successors))
+
+    new_runs = marks[:-1]
+    new_runs[new_runs < 0] = NO_ROW
+
+    return (new_runs, numpy.concatenate([new_run_successors, numpy.array(added_run_successors, numpy.int64)]))
+
+
+  # Number of lookbacks
+  def __len__(self):
+    return len(self.states)
+
+
+  def __contains__(self, lookback):
+    return self.findRow(lookback) is not None
+
+
+  def __iter__(self):
+
+    for state in self.states:
+      yield self.lookback_states.getLookback(state)
+
+
+  # Return the row index of a lookback, or None if it is not present
+  def findRow(self, lookback):
+
+    state = self.lookback_states.findLookback(lookback)
+    if state is None:
+      return None
+
+    return self.findStateRow(state)
+
+
+  # Return the row index of a state, or None if it is not present
+  def findStateRow(self, state):
+
+    row = bisect_left(self.states, state)
+
+    if row < len(self.states) and self.states[row] == state:
+      return row
+
+    return None
+
+
+  def getKey(self, row):
+    return self.lookback_states.getKey(self.states[row])
+
+
+  def getLookback(self, row):
+    return self.lookback_states.getLookback(self.states[row])
+
+
+  # Return the range [start, end) of the places in key_rows of the lookbacks starting with a given prefix of token ids
+  def findPrefixRange(self, prefix):
+
+    (low, high) = self.lookback_states.packer.getPrefixRange(prefix)
+
+    return (self.bisectKey(low), self.bisectKey(high))
+
+
+  # Return the first place in key_rows whose lookback's key is not less than a given key
+  # This is done for each table a quote starts from, so the keys of committed states are read straight from the arrays
+  def bisectKey(self, key):
+
+    lookback_states = self.lookback_states
+    sorted_keys = lookback_states.sorted_keys
+    positions = lookback_states.positions
+    committed_count = len(positions)
+    states = self.states
+    key_rows = self.key_rows
+
+    low = 0
+    high = len(key_rows)
+
+    while low < high:
+
+      middle = (low + high) // 2
+      state = states[key_rows[middle]]
+
+      if state < committed_count:
+        middle_key = sorted_keys[positions[state]]
+      else:
+        middle_key = lookback_states.getKey(state)
+
+      if middle_key < key:
+        low = middle + 1
+      else:
+        high = middle
+
+    return low
+
+
+  # Return the rows of all lookbacks starting with a given prefix of token ids, in order of their lookbacks
+  def findPrefixRows(self, prefix):
+
+    (start, end) = self.findPrefixRange(prefix)
+
+    return list(self.key_rows[start:end])
+
+
+  def findPrefix(self, prefix):
+    return [self.getLookback(row) for row in self.findPrefixRows(prefix)]
+
+
+  # Return a lookback starting with a given prefix, chosen uniformly at random, or None if there are none
+  def choosePrefix(self, prefix):
+
+    (start, end) = self.findPrefixRange(prefix)
+    if start == end:
+      return None
+
+    return self.getLookback(self.key_rows[random.randrange(start, end)])
+
+
+  def containsState(self, state):
+    return self.findStateRow(state) is not None
+
+
+  # Return a map of successor ids to counts for a lookback, which is empty if it is not present
+  def getCounts(self, lookback):
+
+    row = self.findRow(lookback)
+    if row is None:
+      return {}
+
+    return self.getRowCounts(row)
+
+
+  # As getCounts, for the lookback of a state
+  def getStateCounts(self, state):
+
+    row = self.findStateRow(state)
+    if row is None:
+      return {}
+
+    return self.getRowCounts(row)
+
+
+  def getRowCounts(self, row):
+
+    start = self.offsets[row]
+    end = self.offsets[row+1]
+
+    return dict(zip(self.successors[start:end], self.counts[start:end]))
+
+
+  # Number of times any successor was seen after the lookback of a row
+  def countRow(self, row):
+    return self.totals[row]
+
+
+  def countProductions(self):
+
+    if self.production_count is None:
+      self.production_count = int(sum(self.totals))
+
+    return self.production_count
+
+
+  def getArrays(self):
+    return [getattr(self, name) for (name, _) in TransitionTable.ARRAY_FIELDS]
+
+
+  # Return how many times fewer edges a walk has to choose between with each chain of rows with a single successor
+  #  taken as one edge, as its run is; each run holds one successor for each row in it, and two entries to end it
+  def getRunCompression(self):
+
+    edge_count = len(self.successors)
+    if not edge_count:
+      return None
+
+    single_count = len([start for start in self.runs if start != NO_ROW])
+    run_count = (len(self.run_successors) - single_count) // 2
+
+    return float(edge_count) / (edge_count - single_count + run_count)
+
+
+  def countBytes(self):
+    return sum([len(arr) * arr.itemsize for arr in self.getArrays()]) + self.suffix_index.countBytes()
+
+
+  # Return the number of times any successor was seen after lookbacks ending with a given suffix of token ids
+  def countSuffix(self, suffix):
+
+    if len(suffix) == self.lookback_count:
+      row = self.findRow(suffix)
+      if row is None:
+        return 0
+      return self.totals[row]
+
+    index = self.suffix_index
+
+    return index.countRange(*index.findRange(suffix))
+
+
+  # Return a successor of the lookbacks ending with a given suffix, with probability proportional to its count after
+  #  all of them together, as in a model with lookbacks that short; return None if there are no such lookbacks
+  def sampleSuffix(self, suffix):
+
+    if len(suffix) == self.lookback_count:
+      row = self.findRow(suffix)
+      if row is None:
+        return None
+      return self.sampleRow(row)
+
+    index = self.suffix_index
+    (start, end) = index.findRange(suffix)
+    if start == end:
+      return None
+
+    return self.sampleRow(index.chooseRow(start, end))
+
+
+  # Return a successor of a lookback known to be present, with probability proportional to its count
+  def sample(self, lookback):
+    return self.sampleRow(self.findRow(lookback))
+
+
+  # As sample, for the lookback of a state, returning None if the table does not hold it
+  def sampleState(self, state):
+
+    row = self.findStateRow(state)
+    if row is None:
+      return None
+
+    return self.sampleRow(row)
+
+
+  def sampleRow(self, row):
+    return self.successors[self.sampleEdge(row)]
+
+
+  # Return one of the edges of a row, with probability proportional to its count; there is nothing to draw for a row
+  #  with a single edge, so walks taking runs of them whole make the same draws as those that do not
+  def sampleEdge(self, row):
+
+    start = self.offsets[row]
+    if self.offsets[row+1] - start == 1:
+      return start
+
+    total = self.totals[row]
+
+    (i, position) = divmod(random.randrange((self.offsets[row+1] - start) * total), total)
+    edge = start + i
+
+    if position >= self.thresholds[edge]:
+      edge = start + self.aliases[edge]
+
+    return edge
+
+
+# Index of a table's rows in order of their lookbacks read backwards, so that the rows of all lookbacks ending with
+#  a given suffix are contiguous, alongside running totals of the rows' counts in that order
+# Picking a row in such a range in proportion to its total, and then a successor from that row, samples from what
+#  a table with lookbacks as short as the suffix would hold; so shorter lookbacks need no tables of their own
+# The rows' keys are held read backwards, packed as keys are; the lookbacks ending with a suffix are then those whose
+#  reversed keys start with it, and these are found by bisection, as prefixes are among the states
+# An index keeps the packer it was built with, so it still holds together if the states are packed wider since
+class SuffixIndex:
+
+  ARRAY_FIELDS = [
+    ("reversed_keys", KEY_TYPECODE),
+    ("rows", INDEX_TYPECODE),
+    ("cumulative", INDEX_TYPECODE), # Wider only in tables merged from several users, which are never stored
+  ]
+
+  def __init__(self, packer, reversed_keys, rows, cumulative):
+
+    self.packer = packer # Packer the reversed keys were packed with
+
+    self.reversed_keys = reversed_keys
+    self.rows = rows
+    self.cumulative = cumulative # Sum of the totals of the rows before each place in the index
+
+
+  @staticmethod
+  def fromTable(table):
+
+    packer = table.lookback_states.packer
+    keys = packer.createKeys([table.getKey(row) for row in xrange(0, len(table.states))])
+
+    return SuffixIndex(packer, *SuffixIndex.buildArrays(packer, keys, table.totals))
+
+
+  # Build from arrays as returned by getArrays
+  @staticmethod
+  def fromArrays(packer, reversed_key_words, rows, cumulative):
+    return SuffixIndex(packer, packer.loadKeys(reversed_key_words), rows, cumulative)
+
+
+  # Return the arrays of the index, in constructor order, from the keys and totals of a table's rows
+  @staticmethod
+  def buildArrays(packer, keys, totals):
+
+    if numpy is not None and not packer.wide:
+      return SuffixIndex.buildArraysWithNumPy(packer, keys, totals)
+
+    reversed_rows = sorted([(SuffixIndex.reverseKey(packer, key), row) for (row, key) in enumerate(keys)])
+    reversed_keys = packer.createKeys([reversed_key for (reversed_key, _) in reversed_rows])
+    rows = array(INDEX_TYPECODE, [row for (_, row) in reversed_rows])
+
+    cumulative = array(SuffixIndex.getCumulativeTypecode(sum(totals)), [0])
+
+    total = 0
+    for row in rows:
+      total += totals[row]
+      cumulative.append(total)
+
+    return [reversed_keys, rows, cumulative]
+
+
+  # As buildArrays, reversing and sorting all keys at once
+  @staticmethod
+  def buildArraysWithNumPy(packer, keys, totals):
+
+    reversed_keys = SuffixIndex.reverseKeysWithNumPy(packer, TransitionTable.toNumPy(keys))
+    rows = numpy.argsort(reversed_keys)
+
+    return SuffixIndex.packArraysWithNumPy(reversed_keys[rows], rows, TransitionTable.toNumPy(totals))
+
+
+  # Return the arrays of an index from its reversed keys and rows, in order, and the totals of the table's rows, all
+  #  as NumPy arrays
+  @staticmethod
+  def packArraysWithNumPy(reversed_keys, rows, totals):
+
+    cumulative = numpy.concatenate([numpy.zeros(1, numpy.uint64), numpy.cumsum(totals[rows], dtype=numpy.uint64)])
+
+    cumulative_typecode = SuffixIndex.getCumulativeTypecode(int(cumulative[-1]))
+
+    return [TransitionTable.fromNumPy(reversed_keys, KEY_TYPECODE), TransitionTable.fromNumPy(rows), \
+      TransitionTable.fromNumPy(cumulative, cumulative_typecode)]
+
+
+  # Return the array type of the cumulative totals of rows summing to a given total
+  @staticmethod
+  def getCumulativeTypecode(total):
+
+    if total >= 1 << (array(INDEX_TYPECODE).itemsize * 8):
+      return KEY_TYPECODE
+
+    return INDEX_TYPECODE
+
+
+  # As reverseKey, for a NumPy array of keys; reversing the keys of an index gives back those of its table
+  @staticmethod
+  def reverseKeysWithNumPy(packer, keys):
+
+    token_bits = numpy.uint64(packer.token_bits)
+    token_mask = numpy.uint64(packer.token_mask)
+
+    reversed_keys = numpy.zeros(len(keys), numpy.uint64)
+    for i in xrange(0, packer.lookback_count):
+      reversed_keys = (reversed_keys << token_bits) | ((keys >> numpy.uint64(packer.token_bits * i)) & token_mask)
+
+    return reversed_keys
+
+
+  # Return the tokens of a packed lookback, packed in reverse order
+  @staticmethod
+  def reverseKey(packer, key):
+
+    reversed_key = 0
+
+    for i in xrange(0, packer.lookback_count):
+      reversed_key = (reversed_key << packer.token_bits) | (key & packer.token_mask)
+      key >>= packer.token_bits
+
+    return reversed_key
+
+
+  # Return the range [start, end) of the places in the index of the lookbacks ending with a given suffix
+  def findRange(self, suffix):
+
+    # Tokens too new for the index's keys are in none of its lookbacks
+    if not self.packer.canPack(suffix):
+      return (0, 0)
+
+    (low, high) = self.packer.getPrefixRange(tuple(reversed(suffix)))
+
+    return (bisect_left(self.reversed_keys, low), bisect_left(self.reversed_keys, high))
+
+
+  def countRange(self, start, end):
+    return self.cumulative[end] - self.cumulative[start]
+
+
+  # Return one of the rows in a range of places in the index, with probability proportional to its total
+  def chooseRow(self, start, end):
+
+    position = self.cumulative[start] + random.randrange(self.countRange(start, end))
+
+    return self.rows[bisect_right(self.cumulative, position, start, end) - 1]
+
+
+  # Return the arrays of the index as they are written, with wide keys split into words
+  def getArrays(self):
+
+    arrays = [getattr(self, name) for (name, _) in SuffixIndex.ARRAY_FIELDS]
+    arrays[0] = self.packer.dumpKeys(self.reversed_keys)
+
+    return arrays
+
+
+  def countBytes(self):
+
+    index_bytes = sum([len(arr) * arr.itemsize for arr in [self.rows, self.cumulative]])
+
+    return self.packer.countKeyBytes(self.reversed_keys) + index_bytes
+
+
+# The rows and edges of a table whose successors close a given opener, for sampling only among those while that
+#  opener is open; closing successors are found by token, so these are indices into the table's own arrays, rather
+#  than a table of their own holding the same lookbacks and counts again
+# Overlay row i is the table row rows[i], and owns the entries offsets[i]:offsets[i+1]; entry j is the table edge
+#  edges[j], except that a URL closing the opener is an entry of its own on the edge of the token that all URLs are
+#  held as, and its token and count are those in url_tokens and url_counts at its position in url_entries
+class ClosingOverlay:
+
+  ARRAY_FIELDS = [
+    ("rows", INDEX_TYPECODE),
+    ("offsets", INDEX_TYPECODE),
+    ("edges", INDEX_TYPECODE),
+    ("url_entries", INDEX_TYPECODE),
+    ("url_tokens", INDEX_TYPECODE),
+    ("url_counts", INDEX_TYPECODE),
+  ]
+
+  def __init__(self, table, rows, offsets, edges, url_entries, url_tokens, url_counts):
+
+    self.table = table
+    self.lookback_states = table.lookback_states
+    self.lookback_count = table.lookback_count
+
+    self.rows = rows
+    self.offsets = offsets
+    self.edges = edges
+    self.url_entries = url_entries
+    self.url_tokens = url_tokens
+    self.url_counts = url_counts
+
+
+  # Build an overlay for each of the given openers from a map of the token ids that close them to the openers
+  # URLs are held in the table as the given URL token, so those closing an opener are given as a map of the lookback
+  #  states they follow to the counts of their own tokens
+  @staticmethod
+  def fromTable(table, openers, closers, url_token=None, url_counts={}):
+
+    url_edges = ClosingOverlay.findUrlEdges(table.states, table.offsets, table.successors, url_token, url_counts)
+
+    overlays = {}
+    for (opener, arrays) in ClosingOverlay.buildArrays(table.offsets, table.successors, openers, closers, \
+      url_edges).iteritems():
+      overlays[opener] = ClosingOverlay(table, *arrays)
+
+    return overlays
+
+
+  # Return a map of the edges of the URL token in a table's arrays to the counts of the URLs it stands for there, from
+  #  those counts by lookback state
+  @staticmethod
+  def findUrlEdges(states, offsets, successors, url_token, url_counts):
+
+    url_edges = {}
+
+    for (state, counts) in url_counts.iteritems():
+
+      row = bisect_left(states, state)
+      if row == len(states) or states[row] != state:
+        continue
+
+      edge = bisect_left(successors, url_token, offsets[row], offsets[row+1])
+      if edge < offsets[row+1] and successors[edge] == url_token:
+        url_edges[edge] = counts
+
+    return url_edges
+
+
+  # Return the arrays of each opener's overlay, in constructor order, from the offsets and successors of a table, and
+  #  the counts of the closing URLs on any of its edges
+  @staticmethod
+  def buildArrays(offsets, successors, openers, closers, url_edges={}):
+
+    if numpy is not None:
+      return ClosingOverlay.buildArraysWithNumPy(offsets, successors, openers, closers, url_edges)
+
+    arrays_by_opener = {}
+    for opener in openers:
+      arrays_by_opener[opener] = [array(INDEX_TYPECODE), array(INDEX_TYPECODE, [0])] + \
+        [array(INDEX_TYPECODE) for i in range(0, 4)]
+
+    # Few successors close anything, so the row of each edge is only looked up for those that do
+    for (edge, successor) in enumerate(successors):
+
+      opener = closers.get(successor)
+      if opener is not None:
+        ClosingOverlay.addEntry(arrays_by_opener[opener], offsets, edge)
+
+      if edge in url_edges:
+        for (url, count) in sorted(url_edges[edge].iteritems()):
+          (_, _, edges, url_entries, url_tokens, url_counts) = arrays_by_opener[closers[url]]
+          url_entries.append(len(edges))
+          url_tokens.append(url)
+          url_counts.append(count)
+          ClosingOverlay.addEntry(arrays_by_opener[closers[url]], offsets, edge)
+
+    return arrays_by_opener
+
+
+  # As buildArrays, finding the closing successors of each opener among all edges at once; the entries of closing
+  #  URLs are then merged in after any on the same edge, in order of their tokens, as buildArrays adds them
+  @staticmethod
+  def buildArraysWithNumPy(offsets, successors, openers, closers, url_edges={}):
+
+    offsets = TransitionTable.toNumPy(offsets)
+    successors = TransitionTable.toNumPy(successors)
+
+    url_entries_by_opener = dict([(opener, []) for opener in openers])
+    for edge in sorted(url_edges):
+      for (url, count) in sorted(url_edges[edge].iteritems()):
+        url_entries_by_opener[closers[url]].append((edge, url, count))
+
+    arrays_by_opener = {}
+    for opener in openers:
+
+      closing_tokens = [token for (token, token_opener) in closers.iteritems() if token_opener == opener]
+      url_entries = url_entries_by_opener[opener]
+
+      closing_edges = numpy.flatnonzero(numpy.in1d(successors, closing_tokens))
+      url_edge_list = numpy.array([edge for (edge, _, _) in url_entries], numpy.int64)
+      order = numpy.argsort(numpy.concatenate([closing_edges, url_edge_list]), kind="mergesort")
+      edges = numpy.concatenate([closing_edges, url_edge_list])[order]
+
+      (rows, row_lengths) = numpy.unique(numpy.searchsorted(offsets, edges, "right") - 1, return_counts=True)
+      overlay_offsets = numpy.concatenate([numpy.zeros(1, numpy.int64), numpy.cumsum(row_lengths)])
+
+      arrays_by_opener[opener] = [TransitionTable.fromNumPy(rows), TransitionTable.fromNumPy(overlay_offsets), \
+        TransitionTable.fromNumPy(edges), TransitionTable.fromNumPy(numpy.flatnonzero(order >= len(closing_edges))), \
+        array(INDEX_TYPECODE, [url for (_, url, _) in url_entries]), \
+        array(INDEX_TYPECODE, [count for (_, _, count) in url_entries])]
+
+    return arrays_by_opener
+
+
+  # Return the counts of the closing URLs in the overlays of several tables, given as maps of openers to overlays, by
+  #  lookback state, summed with the weights of those tables as they are merged
+  @staticmethod
+  def mergeUrlCounts(overlays_list, weights=None):
+
+    weights = weights or [1] * len(overlays_list)
+    counts_by_state = {}
+
+    for (overlays, weight) in zip(overlays_list, weights):
+      for overlay in overlays.itervalues():
+        for (state, url_counts) in overlay.getUrlCounts().iteritems():
+
+          merged_counts = counts_by_state.setdefault(state, {})
+
+          for (url, count) in url_counts.iteritems():
+            merged_counts[url] = merged_counts.get(url, 0) + count * weight
+
+    if min(weights) < 0:
+      counts_by_state = TransitionTable.dropUncounted(counts_by_state)
+
+    return counts_by_state
+
+
+  # Add an entry on a table edge to the arrays of an overlay, in a row of its own unless it is on the last row's
+  @staticmethod
+  def addEntry(arrays, offsets, edge):
+
+    (rows, overlay_offsets, edges) = arrays[:3]
+    row = bisect_right(offsets, edge) - 1
+
+    if not rows or rows[-1] != row:
+      rows.append(row)
+      overlay_offsets.append(overlay_offsets[-1])
+
+    edges.append(edge)
+    overlay_offsets[-1] += 1
+
+
+  # Number of lookbacks with closing successors
+  def __len__(self):
+    return len(self.rows)
+
+
+  def __contains__(self, lookback):
+    return self.findRow(lookback) is not None
+
+
+  def __iter__(self):
+
+    for row in self.rows:
+      yield self.table.getLookback(row)
+
+
+  # Return the overlay row of a lookback, or None if it has no closing successors
+  def findRow(self, lookback):
+
+    table_row = self.table.findRow(lookback)
+    if table_row is None:
+      return None
+
+    return self.findOverlayRow(table_row)
+
+
+  # Return the overlay row of the lookback of a state, or None if it has no closing successors
+  def findStateRow(self, state):
+
+    table_row = self.table.findStateRow(state)
+    if table_row is None:
+      return None
+
+    return self.findOverlayRow(table_row)
+
+
+  # As findRow, for a lookback whose row in the table is already known
+  def findOverlayRow(self, table_row):
+
+    row = bisect_left(self.rows, table_row)
+
+    if row < len(self.rows) and self.rows[row] == table_row:
+      return row
+
+    return None
+
+
+  def getCounts(self, lookback):
+
+    row = self.findRow(lookback)
+    if row is None:
+      return {}
+
+    return dict([self.getEntry(entry) for entry in xrange(self.offsets[row], self.offsets[row+1])])
+
+
+  # Return the token and count of an entry; a URL has its own, rather than those of the token that all URLs are held as
+  def getEntry(self, entry):
+
+    i = bisect_left(self.url_entries, entry)
+    if i < len(self.url_entries) and self.url_entries[i] == entry:
+      return (self.url_tokens[i], self.url_counts[i])
+
+    edge = self.edges[entry]
+
+    return (self.table.successors[edge], self.table.counts[edge])
+
+
+  def countRow(self, row):
+    return sum([self.getEntry(entry)[1] for entry in xrange(self.offsets[row], self.offsets[row+1])])
+
+
+  # Return the counts of the URLs with entries of their own, by the lookback state they follow
+  def getUrlCounts(self):
+
+    url_counts = {}
+
+    for (entry, url, count) in zip(self.url_entries, self.url_tokens, self.url_counts):
+      state = self.table.states[self.rows[bisect_right(self.offsets, entry) - 1]]
+      url_counts.setdefault(state, {})[url] = count
+
+    return url_counts
+
+
+  def getArrays(self):
+    return [getattr(self, name) for (name, _) in ClosingOverlay.ARRAY_FIELDS]
+
+
+  # Only the overlay's own arrays; the table's are counted with the table
+  def countBytes(self):
+    return sum([len(arr) * arr.itemsize for arr in self.getArrays()])
+
+
+  # Return a closing successor of a lookback, with probability proportional to its count, or None if it has none
+  def sample(self, lookback):
+
+    row = self.findRow(lookback)
+    if row is None:
+      return None
+
+    return self.sampleRow(row)
+
+
+  def sampleState(self, state):
+
+    row = self.findStateRow(state)
+    if row is None:
+      return None
+
+    return self.sampleRow(row)
+
+
+  def sampleRow(self, row):
+    return self.getEntry(self.sampleEntry(row))[0]
+
+
+  # Return the table edge of an entry of an overlay row, chosen at random, and the token it yields
+  def sampleEdge(self, row):
+
+    entry = self.sampleEntry(row)
+
+    return (self.edges[entry], self.getEntry(entry)[0])
+
+
+  # Return one of the entries of an overlay row; rows rarely have more than a couple of closing successors, so these
+  #  are simply walked
+  def sampleEntry(self, row):
+
+    start = self.offsets[row]
+    end = self.offsets[row+1]
+    if end - start == 1:
+      return start
+
+    position = random.randrange(self.countRow(row))
+
+    for entry in xrange(start, end):
+      position -= self.getEntry(entry)[1]
+      if position < 0:
+        return entry
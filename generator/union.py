@@ -0,0 +1,210 @@
+# Read-only views combining several users' tables and lists without copying them
+
+from bisect import bisect_right
+import random
+
+
+# Behaves as a table whose counts are the weighted sums of those of the given tables
+# Weights are positive integers, one per table; by default, all are 1, as if the tables had been merged
+# The tables share their lookback states, so a lookback's state is found once for all of them
+class UnionTable:
+
+  def __init__(self, tables, weights=None):
+
+    self.tables = tables
+    self.weights = weights or [1] * len(tables)
+    self.lookback_states = tables[0].lookback_states
+    self.lookback_count = tables[0].lookback_count
+
+
+  # Not the number of lookbacks, as that would take a pass over all of them
+  def __nonzero__(self):
+
+    for table in self.tables:
+      if table:
+        return True
+
+    return False
+
+
+  def __contains__(self, lookback):
+
+    state = self.lookback_states.findLookback(lookback)
+    if state is None:
+      return False
+
+    return self.containsState(state)
+
+
+  def containsState(self, state):
+
+    for table in self.tables:
+      if table.findStateRow(state) is not None:
+        return True
+
+    return False
+
+
+  # Yield each lookback once, even if it is in several tables
+  def __iter__(self):
+
+    seen = set()
+
+    for table in self.tables:
+      for lookback in table:
+        if not lookback in seen:
+          seen.add(lookback)
+          yield lookback
+
+
+  # Each lookback is given once, in order
+  def findPrefix(self, prefix):
+
+    keys = set()
+
+    for table in self.tables:
+      for row in table.findPrefixRows(prefix):
+        keys.add(table.getKey(row))
+
+    return [self.lookback_states.packer.unpack(key) for key in sorted(keys)]
+
+
+  # Choose uniformly among the distinct lookbacks starting with a prefix, as a merged table would
+  # A row is drawn uniformly from those of all the tables starting with the prefix, and kept with probability one over
+  #  the number of tables holding its lookback, so that lookbacks held by several tables are not favoured
+  def choosePrefix(self, prefix):
+
+    ranges = [table.findPrefixRange(prefix) for table in self.tables]
+    total = sum([end - start for (start, end) in ranges])
+    if not total:
+      return None
+
+    while True:
+
+      position = random.randrange(total)
+
+      for (table, (start, end)) in zip(self.tables, ranges):
+        if position < end - start:
+          state = table.states[table.key_rows[start + position]]
+          break
+        position -= end - start
+
+      holders = len([table for table in self.tables if table.findStateRow(state) is not None])
+      if not random.randrange(holders):
+        return self.lookback_states.getLookback(state)
+
+
+  def getCounts(self, lookback):
+
+    counts = {}
+
+    for (table, weight) in zip(self.tables, self.weights):
+      for (successor, count) in table.getCounts(lookback).iteritems():
+        counts[successor] = counts.get(successor, 0) + count * weight
+
+    return counts
+
+
+  def countProductions(self):
+    return sum([table.countProductions() * weight for (table, weight) in zip(self.tables, self.weights)])
+
+
+  def countSuffix(self, suffix):
+    return sum([table.countSuffix(suffix) * weight for (table, weight) in zip(self.tables, self.weights)])
+
+
+  # As with sample, pick a table with probability proportional to its weighted total for the suffix
+  def sampleSuffix(self, suffix):
+
+    totals = [table.countSuffix(suffix) * weight for (table, weight) in zip(self.tables, self.weights)]
+    total = sum(totals)
+    if not total:
+      return None
+
+    position = random.randrange(total)
+
+    for (table, weighted_total) in zip(self.tables, totals):
+      if position < weighted_total:
+        return table.sampleSuffix(suffix)
+      position -= weighted_total
+
+
+  # Pick a table with probability proportional to its weighted total for the lookback, then sample from that;
+  #  this is the same as sampling from the summed counts
+  # The tables may also be closing overlays, which may not hold the lookback at all; then None is returned
+  def sample(self, lookback):
+
+    state = self.lookback_states.findLookback(lookback)
+    if state is None:
+      return None
+
+    return self.sampleState(state)
+
+
+  def sampleState(self, state):
+
+    rows = []
+    total = 0
+
+    for (table, weight) in zip(self.tables, self.weights):
+      row = table.findStateRow(state)
+      if row is not None:
+        weighted_total = table.countRow(row) * weight
+        rows.append((table, row, weighted_total))
+        total += weighted_total
+
+    if not total:
+      return None
+
+    position = random.randrange(total)
+
+    for (table, row, weighted_total) in rows:
+      if position < weighted_total:
+        return table.sampleRow(row)
+      position -= weighted_total
+
+
+# Behaves as the concatenation of the given sequences, with each item repeated as many times as the weight
+#  of its sequence, so that random.choice picks from it as it would from such a list
+class UnionSequence:
+
+  def __init__(self, sequences, weights=None):
+
+    self.sequences = sequences
+    self.weights = weights or [1] * len(sequences)
+
+    self.bounds = [] # Index just past the end of each sequence's items
+    end = 0
+    for (sequence, weight) in zip(sequences, self.weights):
+      end += len(sequence) * weight
+      self.bounds.append(end)
+
+
+  def __len__(self):
+
+    if not self.bounds:
+      return 0
+
+    return self.bounds[-1]
+
+
+  def __getitem__(self, index):
+
+    if index < 0:
+      index += len(self)
+
+    if index < 0 or index >= len(self):
+      raise IndexError("union index out of range")
+
+    i = bisect_right(self.bounds, index)
+    start = 0
+    if i > 0:
+      start = self.bounds[i-1]
+
+    return self.sequences[i][(index - start) // self.weights[i]]
+
+
+  def __iter__(self):
+
+    for i in xrange(0, len(self)):
+      yield self[i]
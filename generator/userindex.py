@@ -0,0 +1,134 @@
+# Index of users by starter count, for drawing a random user with at least so many starters
+
+from bisect import bisect_left
+from bisect import bisect_right
+from bisect import insort
+import random
+
+
+# Users are kept sorted by (starter count, nick), so that those with enough starters are always a suffix of the index
+# Draws may be uniform, or weighted by production count; the latter uses running totals of the production counts,
+#  which are only rebuilt on the first weighted draw after a change
+class UserIndex:
+
+  def __init__(self):
+
+    self.keys = [] # Sorted list of (starter count, nick) pairs
+    self.production_counts = [] # Production count of each user, parallel to keys
+    self.starter_counts = {} # Map of nicks to starter counts, to find users' places in the index
+    self.totals = None # Sum of the production counts before each place in the index, and of all of them at the end
+
+
+  def __len__(self):
+    return len(self.keys)
+
+
+  def __contains__(self, nick):
+    return nick in self.starter_counts
+
+
+  def findPosition(self, nick):
+    return bisect_left(self.keys, (self.starter_counts[nick], nick))
+
+
+  # Add a user, or move one already there to match their new counts
+  def add(self, nick, starter_count, production_count):
+
+    self.remove(nick)
+
+    key = (starter_count, nick)
+    position = bisect_left(self.keys, key)
+    self.keys.insert(position, key)
+    self.production_counts.insert(position, production_count)
+    self.starter_counts[nick] = starter_count
+    self.totals = None
+
+
+  def remove(self, nick):
+
+    if not nick in self.starter_counts:
+      return
+
+    position = self.findPosition(nick)
+    del self.keys[position]
+    del self.production_counts[position]
+    del self.starter_counts[nick]
+    self.totals = None
+
+
+  def buildTotals(self):
+
+    self.totals = [0]
+    total = 0
+    for production_count in self.production_counts:
+      total += production_count
+      self.totals.append(total)
+
+
+  # Return the places, in order, of those excluded users who would otherwise be eligible
+  def findExcluded(self, excludes, start):
+
+    positions = []
+    for nick in excludes:
+      if nick in self.starter_counts:
+        position = self.findPosition(nick)
+        if position >= start:
+          insort(positions, position)
+
+    return positions
+
+
+  # Return a random nick with at least a certain number of starters that is not one of a list of excludes,
+  #  or None if there is no such nick
+  # Excluded users are skipped over rather than drawn and rejected, so this takes O(log n) for a few excludes
+  def choose(self, excludes, min_starters=0, weighted=False):
+
+    start = bisect_left(self.keys, (min_starters,))
+    excluded = self.findExcluded(excludes, start)
+
+    if weighted:
+      position = self.chooseWeighted(start, excluded)
+    else:
+      position = self.chooseUniform(start, excluded)
+
+    if position is None:
+      return None
+
+    return self.keys[position][1]
+
+
+  def chooseUniform(self, start, excluded):
+
+    count = len(self.keys) - start - len(excluded)
+    if count <= 0:
+      return None
+
+    position = start + random.randrange(count)
+    for excluded_position in excluded:
+      if excluded_position > position:
+        break
+      position += 1
+
+    return position
+
+
+  def chooseWeighted(self, start, excluded):
+
+    if self.totals is None:
+      self.buildTotals()
+
+    total = self.totals[-1] - self.totals[start]
+    for excluded_position in excluded:
+      total -= self.production_counts[excluded_position]
+
+    if total <= 0:
+      return None
+
+    # Pick a point among the running totals, then push it past the span of each excluded user it reaches
+    point = self.totals[start] + random.randrange(total)
+    for excluded_position in excluded:
+      if self.totals[excluded_position] > point:
+        break
+      point += self.production_counts[excluded_position]
+
+    return bisect_right(self.totals, point) - 1
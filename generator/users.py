@@ -1,9 +1,10 @@
 from collections import namedtuple
 import os
 import pickle
-import random
 
 import config
+from modelcache import ModelCache
+from userindex import UserIndex
 
 
 AliasInfo = namedtuple("AliasInfo", "aliases, requested_nick")
@@ -33,25 +34,53 @@ class User:
     "urls",
   ]
 
+  MODEL_KEYS = FIELD_KEYS[1:] # Fields that are dropped when a user loaded on demand is unloaded
+
   def __init__(self, **kwargs):
 
     for key in User.FIELD_KEYS:
       self.__dict__[key] = kwargs.get(key)
 
-    self.production_count = self.countProductions() # This is not going to change after initialization
+    # If given, this returns the model fields of a user whose tables are only loaded on demand,
+    #  in which case the counts are given up front, as the tables are not there to count
+    self.loader = kwargs.get("loader")
+
+    if self.loader:
+      self.starter_count = kwargs.get("starter_count")
+      self.production_count = kwargs.get("production_count")
+    else:
+      self.starter_count = len(self.starters)
+      self.production_count = self.countProductions() # This is not going to change after initialization
 
     self.quotes_requested = 0 # Number of times this user has been requested for a quote
     self.aliases = set()
 
 
   def countProductions(self):
+    return self.all_lookbacks.countProductions()
+
+
+  def loadModel(self):
+
+    fields = self.loader()
+    for key in User.MODEL_KEYS:
+      self.__dict__[key] = fields[key]
 
-    production_count = 0
 
-    for (_, generic_production_list) in self.all_lookbacks.iteritems():
-      production_count += len(generic_production_list)
+  def unloadModel(self):
 
-    return production_count
+    for key in User.MODEL_KEYS:
+      self.__dict__[key] = None
+
+
+  # Return roughly how many bytes the tables take up
+  def countModelBytes(self):
+
+    size = self.all_lookbacks.countBytes() + self.starters.countBytes() + self.urls.countBytes()
+    for closing_lookbacks in self.closing_lookbacks.itervalues():
+      size += closing_lookbacks.countBytes()
+
+    return size
 
 
   def setPersistedStatistics(self, stats):
@@ -62,8 +91,9 @@ class User:
     self.aliases = set(aliases)
 
 
+  # Starters are held as a counted sequence, which need not be copied to be chosen from
   def getStarters(self):
-    return tuple(self.starters)
+    return self.starters
 
 
   def getAllLookbacks(self):
@@ -105,9 +135,13 @@ class User:
 
 class UserCollection:
 
-  def __init__(self):
+  def __init__(self, model_cache_bytes=config.MODEL_CACHE_BYTES, random_weighted=config.RANDOM_NICK_WEIGHTED):
 
     self.usermap = {} # Map of nick to User objects
+    self.index = UserIndex() # Real nicks by starter count, for choosing random users
+    self.random_weighted = random_weighted # Whether random users are chosen in proportion to their production counts
+    self.model_cache = ModelCache(model_cache_bytes) # Holds the tables of those users that are loaded on demand
+    self.lazy = False # Whether any users are loaded on demand
     self.count = 0
     self.biggest_users = None
     self.userset = None
@@ -123,6 +157,33 @@ class UserCollection:
 
 
   def addUser(self, **kwargs):
+
+    user = User(**kwargs)
+    self.usermap[user.nick] = user
+    self.index.add(user.nick, user.starter_count, user.production_count)
+    self.lazy = self.lazy or bool(kwargs.get("loader"))
+
+
+  # Replace the tables of a user, given as for addUser; the user keeps their aliases and statistics
+  def replaceModel(self, **kwargs):
+
+    user = self.usermap[kwargs.get("nick")]
+    self.model_cache.discard(user.nick)
+
+    replacement = User(**kwargs)
+    for key in User.MODEL_KEYS + ["loader", "starter_count", "production_count"]:
+      user.__dict__[key] = replacement.__dict__[key]
+
+    if user.nick in self.index:
+      self.index.add(user.nick, user.starter_count, user.production_count)
+
+    if self.userset is not None:
+      self.buildStaticStats()
+
+
+  # Add a model that can be asked for by nick like a user's, but is not a user in its own right, such as one
+  #  combining all users; it is not counted or chosen at random, and its statistics are not persisted
+  def addComposite(self, **kwargs):
     self.usermap[kwargs.get("nick")] = User(**kwargs)
 
 
@@ -216,24 +277,55 @@ class UserCollection:
     return self.usermap[nick]
 
 
+  # Get user object, with its tables loaded, for a nick we know to be in the map
+  def getModel(self, nick):
+
+    user = self.usermap[nick]
+    if user.loader:
+      self.model_cache.load(user)
+
+    return user
+
+
+  # Return whether a user's tables can be used without loading them, for a nick we know to be in the map
+  def isResident(self, nick):
+
+    user = self.usermap[nick]
+    return not user.loader or nick in self.model_cache
+
+
   # Get starters for a nick we know to be in the map
   def getStarters(self, nick):
-    return self.usermap[nick].getStarters()
+    return self.getModel(nick).getStarters()
 
 
   # Get generic lookbacks for a nick we know to be in the map
   def getAllLookbacks(self, nick):
-    return self.usermap[nick].getAllLookbacks()
+    return self.getModel(nick).getAllLookbacks()
 
 
   # Get closing lookbacks for a nick we know to be in the map
   def getClosingLookbacks(self, nick):
-    return self.usermap[nick].getClosingLookbacks()
+    return self.getModel(nick).getClosingLookbacks()
 
 
   # Get URL list for a nick we know to be in the map
   def getUrls(self, nick):
-    return self.usermap[nick].getUrls()
+    return self.getModel(nick).getUrls()
+
+
+  # Return statistics on the loading of users on demand, or None if no users are loaded on demand
+  def getModelCacheStatistics(self):
+
+    if not self.lazy:
+      return None
+
+    return self.model_cache.getStatistics()
+
+
+  # Return the real nicks of all users, in order
+  def getNicks(self):
+    return sorted([user.nick for user in self.userset])
 
 
   def countUsers(self):
@@ -260,6 +352,14 @@ class UserCollection:
     return tuple(most_quoted_tuples)
 
 
+  # Return the nicks of up to a given number of the users prompted for quotes most often, most often first
+  def getMostQuotedNicks(self, count):
+
+    most_quoted_list = sorted(self.userset, key=lambda x:x.quotes_requested, reverse=True)[:count]
+
+    return [user.nick for user in most_quoted_list if user.quotes_requested > 0]
+
+
   # Return a tuple consisting of a user's aliases, or an empty tuple if the user does not exist
   def getUserAliases(self, nick):
     if nick in self.usermap:
@@ -270,16 +370,7 @@ class UserCollection:
   # Return a nick at random, as long as it has at least a certain number of starter entries,
   #  and is not one of a list of excludes (such as to prevent duplicates from occurring)
   def getRandomNick(self, excludes, min_starters=0):
-
-    possibles = []
-    for user in self.userset:
-      if not user.nick in excludes and len(user.starters) >= min_starters:
-        possibles.append(user.nick)
-
-    if possibles:
-      return random.choice(possibles)
-
-    return None
+    return self.index.choose(excludes, min_starters, self.random_weighted)
 
 
   # Filter a list of raw nick tuples; random placeholders will be substituted, while
@@ -0,0 +1,58 @@
+# Interned vocabulary mapping source tokens to integer ids, shared by all users
+
+
+class SpecialToken:
+  TERMINATE = 0
+  URL = 1
+  COUNT = 2 # Number of ids reserved for special tokens
+
+
+class Vocabulary:
+
+  def __init__(self):
+
+    self.ids = {} # Map of token strings to ids
+    self.tokens = [None] * SpecialToken.COUNT # List of token strings, indexed by id
+
+
+  def __len__(self):
+    return len(self.tokens)
+
+
+  def getOrCreateId(self, token):
+
+    ident = self.ids.get(token)
+
+    if ident is None:
+      ident = len(self.tokens)
+      self.ids[token] = ident
+      self.tokens.append(token)
+
+    return ident
+
+
+  # Return the id of a token, or None if it has never been seen
+  def getId(self, token):
+    return self.ids.get(token)
+
+
+  # Return a tuple of ids for a sequence of tokens, or None if any of them is unknown
+  def getIds(self, tokens):
+
+    ids = []
+
+    for token in tokens:
+      ident = self.ids.get(token)
+      if ident is None:
+        return None
+      ids.append(ident)
+
+    return tuple(ids)
+
+
+  def getToken(self, ident):
+    return self.tokens[ident]
+
+
+  def getTokens(self, ids):
+    return [self.tokens[ident] for ident in ids]